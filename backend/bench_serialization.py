@@ -0,0 +1,127 @@
+"""Per-item response cost of the get_matches and get_pets list shapes.
+
+Compares FastAPI's default path (response_model validation plus
+jsonable_encoder) with the trusted fast path (projection shaping plus
+FastJSONResponse) on synthetic documents shaped like Mongo's, in-process
+and without a database:
+
+    python bench_serialization.py [--items 10 100 1000] [--repeat 50]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'bench')
+
+import httpx
+from fastapi import FastAPI, Response
+
+from serialization import orjson
+from server import PET_SHAPE, Pet, fast_json
+
+TRAITS = {'playful': 5, 'calm': 3, 'energetic': 7, 'friendly': 9, 'independent': 2, 'social': 6}
+
+
+def make_pet(now: datetime, i: int) -> dict:
+    return {
+        'id': str(uuid.uuid4()),
+        'foundation_id': str(uuid.uuid4()),
+        'name': f'Mascota {i}',
+        'breed': 'Mestizo',
+        'age': i % 15,
+        'personality_traits': dict(TRAITS),
+        'images': [f'/api/images/{i:064x}.jpg'],
+        'thumbnails': [f'/api/images/{i:064x}_thumb.jpg'],
+        'status': 'available',
+        'created_at': now - timedelta(minutes=i),
+        'ordinal': i,
+    }
+
+
+def make_match(now: datetime, i: int) -> dict:
+    pet = make_pet(now, i)
+    return {
+        'id': str(uuid.uuid4()),
+        'user_id': str(uuid.uuid4()),
+        'pet_id': pet['id'],
+        'match_score': 87.04,
+        'is_match': True,
+        'status': 'pending',
+        'created_at': now - timedelta(minutes=i),
+        'pet': pet,
+        'user': {
+            'id': str(uuid.uuid4()),
+            'email': f'adoptante{i}@example.com',
+            'name': f'Adoptante {i}',
+            'age': 30,
+            'user_type': 'adopter',
+            'personality_traits': dict(TRAITS),
+            'created_at': now,
+        },
+    }
+
+
+def build_app(matches: List[dict], pets: List[dict]) -> FastAPI:
+    app = FastAPI()
+
+    # Every request builds fresh dicts, as a Mongo query would
+    @app.get('/default/matches', response_model=List[dict])
+    async def default_matches():
+        return [dict(match) for match in matches]
+
+    @app.get('/fast/matches', response_model=List[dict])
+    async def fast_matches(response: Response):
+        return fast_json(response, [dict(match) for match in matches])
+
+    @app.get('/default/pets', response_model=List[Pet])
+    async def default_pets():
+        return [dict(pet) for pet in pets]
+
+    @app.get('/fast/pets', response_model=List[Pet])
+    async def fast_pets(response: Response):
+        return fast_json(response, [PET_SHAPE(pet) for pet in pets])
+
+    return app
+
+
+async def time_route(client: httpx.AsyncClient, path: str, repeat: int) -> float:
+    await client.get(path)  # warm up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = await client.get(path)
+        samples.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return statistics.median(samples)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    now = datetime.now(timezone.utc)
+    print(f"orjson: {'sí' if orjson is not None else 'no (json de la librería estándar)'}")
+    print(f"{'ruta':<10}{'items':>7}{'default µs/item':>18}{'rápido µs/item':>17}{'mejora':>9}")
+    for size in args.items:
+        matches = [make_match(now, i) for i in range(size)]
+        pets = [make_pet(now, i) for i in range(size)]
+        transport = httpx.ASGITransport(app=build_app(matches, pets))
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            for route in ('matches', 'pets'):
+                default = await time_route(client, f'/default/{route}', args.repeat)
+                fast = await time_route(client, f'/fast/{route}', args.repeat)
+                print(f"{route:<10}{size:>7}{default / size * 1e6:>18.1f}{fast / size * 1e6:>17.1f}{default / fast:>8.1f}x")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
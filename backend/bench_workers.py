@@ -0,0 +1,163 @@
+"""Throughput of the multi-worker deployment as the number of workers grows.
+
+For every worker count the app is started with gunicorn.conf.py on a fresh
+database, then the loadtest.py scenarios are run against it with the
+simulated users and concurrency multiplied by the worker count, so each
+worker always gets the same share of the load. With linear scaling,
+throughput grows with the worker count and efficiency stays near 1.0:
+
+    python bench_workers.py --workers 1 2 4 8
+    python bench_workers.py --workers 1 2 4 --output results/workers.json
+
+Needs a MongoDB at MONGO_URL. Pub/sub defaults to the Mongo backend unless
+the environment says otherwise, since the local one is not shared between
+workers. Each run's database is dropped afterwards unless --keep-databases
+is given.
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from pymongo import MongoClient
+
+from loadtest import LoadTest, git_commit, summarize
+
+ROOT_DIR = Path(__file__).parent
+# The readiness probe scrapes /metrics, which only answers to this token
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or secrets.token_urlsafe(16)
+
+
+def start_server(workers: int, port: int, db_name: str, log) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        'WEB_CONCURRENCY': str(workers),
+        'BIND': f'127.0.0.1:{port}',
+        'DB_NAME': db_name,
+        'METRICS_TOKEN': METRICS_TOKEN,
+    }
+    env.setdefault('PUBSUB_BACKEND', 'mongo')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'server:app'],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log
+    )
+
+
+async def wait_ready(base_url: str, server: subprocess.Popen, log, timeout: float):
+    """Wait until every worker had time to boot and the app answers"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2) as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                log.seek(0)
+                raise RuntimeError(f'El servidor terminó al iniciar:\n{log.read().decode()[-2000:]}')
+            try:
+                if (await client.get('/metrics', headers={'Authorization': f'Bearer {METRICS_TOKEN}'})).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f'El servidor no respondió en {timeout:.0f} s')
+
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+async def measure(workers: int, args: argparse.Namespace) -> dict:
+    db_name = f'{args.db_prefix}_{int(time.time())}_{workers}'
+    base_url = f'http://127.0.0.1:{args.port}'
+    load_args = argparse.Namespace(
+        foundations=args.foundations * workers,
+        pets=args.pets,
+        adopters=args.adopters * workers,
+        swipes=args.swipes,
+        messages=args.messages,
+        accepts=args.accepts,
+        concurrency=args.concurrency * workers,
+        timeout=args.timeout,
+        seed=args.seed,
+    )
+    # A file rather than a pipe, so a chatty server never blocks on a full buffer
+    log = tempfile.TemporaryFile()
+    server = start_server(workers, args.port, db_name, log)
+    try:
+        await wait_ready(base_url, server, log, args.startup_timeout)
+        # Idle workers may still be connecting; give them a moment before timing
+        await asyncio.sleep(args.warmup)
+        limits = httpx.Limits(max_connections=load_args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            load_test = LoadTest(client, load_args)
+            outcome = await load_test.run()
+    finally:
+        stop_server(server)
+        log.close()
+        if not args.keep_databases:
+            with MongoClient(os.environ['MONGO_URL']) as mongo:
+                mongo.drop_database(db_name)
+    total = summarize(load_test.recorder, outcome['seconds'])['total']
+    return {'workers': workers, 'failed_users': load_test.failed_users, **total}
+
+
+def print_scaling(runs: list):
+    print(f"{'workers':>8}{'requests':>10}{'err':>6}{'req/s':>10}{'p95 ms':>10}{'speedup':>9}{'efficiency':>12}")
+    base = runs[0]['throughput_rps'] / runs[0]['workers']
+    for run in runs:
+        speedup = run['throughput_rps'] / base if base else 0.0
+        run['speedup'] = round(speedup, 2)
+        run['efficiency'] = round(speedup / run['workers'], 2)
+        print(f"{run['workers']:>8}{run['requests']:>10}{run['errors']:>6}{run['throughput_rps']:>10.1f}"
+              f"{run.get('p95_ms', 0):>10.1f}{run['speedup']:>9.2f}{run['efficiency']:>12.2f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--db-prefix', default='bench_workers')
+    parser.add_argument('--keep-databases', action='store_true')
+    parser.add_argument('--foundations', type=int, default=2, help='foundations per worker')
+    parser.add_argument('--pets', type=int, default=20, help='pets per foundation')
+    parser.add_argument('--adopters', type=int, default=20, help='adopters per worker')
+    parser.add_argument('--swipes', type=int, default=10, help='swipes per adopter')
+    parser.add_argument('--messages', type=int, default=3, help='chat messages per match')
+    parser.add_argument('--accepts', type=int, default=5, help='matches each foundation accepts')
+    parser.add_argument('--concurrency', type=int, default=10, help='simulated users active at once per worker')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--warmup', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=Path, help='write the results as JSON')
+    args = parser.parse_args()
+
+    runs = []
+    for workers in sorted(set(args.workers)):
+        print(f'== {workers} worker(s)')
+        runs.append(await measure(workers, args))
+    print_scaling(runs)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps({
+            'meta': {'commit': git_commit(), 'cpus': os.cpu_count(), 'args': {
+                key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()
+            }},
+            'runs': runs,
+        }, indent=2))
+        print(f'Resultados guardados en {args.output}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
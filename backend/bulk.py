@@ -0,0 +1,213 @@
+"""Streaming row readers for bulk uploads in JSON array, NDJSON or CSV form.
+
+Rows are parsed as the body arrives, so a large upload never has to be held
+in memory whole. Every reader yields `(row, data, error)` tuples: `data` is
+the parsed dict, or `error` says why that row could not be read. `row` is
+the item position for JSON arrays and the line number for NDJSON and CSV,
+which is what a user fixing their file looks for. Problems that make the
+rest of the body unreadable raise BulkFormatError instead.
+
+CSV files start with a header line; dotted column names such as
+`personality_traits.calm` build nested objects and empty cells are left out.
+Quoted values cannot span lines.
+"""
+import codecs
+import csv
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+Row = Tuple[int, Optional[dict], Optional[str]]
+
+FORMATS = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+
+
+class BulkFormatError(ValueError):
+    def __init__(self, row: int, detail: str):
+        super().__init__(detail)
+        self.row = row
+        self.detail = detail
+
+
+def bulk_format(content_type: Optional[str]) -> Optional[str]:
+    """Upload format for a Content-Type header, ignoring parameters like charset"""
+    if not content_type:
+        return None
+    return FORMATS.get(content_type.split(';')[0].strip().lower())
+
+
+async def iter_text(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Incremental so multi-byte characters split across chunks decode correctly
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    try:
+        async for chunk in chunks:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        raise BulkFormatError(0, "El archivo debe estar codificado en UTF-8")
+    if text:
+        yield text
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[str]:
+    pending = ''
+    line_number = 0
+    async for text in iter_text(chunks):
+        lines = (pending + text).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            line_number += 1
+            yield line.rstrip('\r')
+        if len(pending) > max_line_bytes:
+            raise BulkFormatError(line_number + 1, "La línea es demasiado larga")
+    if pending:
+        yield pending.rstrip('\r')
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes], max_row_bytes: int) -> AsyncIterator[Row]:
+    line_number = 0
+    async for line in iter_lines(chunks, max_row_bytes):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield line_number, None, "JSON no válido"
+            continue
+        if isinstance(data, dict):
+            yield line_number, data, None
+        else:
+            yield line_number, None, "La fila debe ser un objeto JSON"
+
+
+def nest(flat: Dict[str, str]) -> dict:
+    """Turn dotted column names into nested objects"""
+    data: dict = {}
+    for key, value in flat.items():
+        target = data
+        *parents, leaf = key.split('.')
+        for parent in parents:
+            target = target.setdefault(parent, {})
+            if not isinstance(target, dict):
+                raise ValueError(key)
+        target[leaf] = value
+    return data
+
+
+async def iter_csv(chunks: AsyncIterator[bytes], max_row_bytes: int) -> AsyncIterator[Row]:
+    header: Optional[List[str]] = None
+    line_number = 0
+    async for line in iter_lines(chunks, max_row_bytes):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            values = next(csv.reader([line]))
+        except csv.Error:
+            if header is None:
+                raise BulkFormatError(line_number, "Encabezado CSV no válido")
+            yield line_number, None, "Línea CSV no válida"
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield line_number, None, f"Se esperaban {len(header)} columnas y hay {len(values)}"
+            continue
+        try:
+            data = nest({name: value.strip() for name, value in zip(header, values) if value.strip()})
+        except ValueError as e:
+            raise BulkFormatError(1, f"Columna en conflicto en el encabezado: {e}")
+        yield line_number, data, None
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes], max_row_bytes: int) -> AsyncIterator[Row]:
+    """Decode the items of a top-level JSON array one at a time"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    state = 'start'  # start -> value <-> separator -> end
+    item = 0
+    incomplete = False
+
+    def drain(final: bool):
+        nonlocal buffer, state, item, incomplete
+        pos = 0
+        incomplete = False
+        try:
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos == len(buffer):
+                    return
+                char = buffer[pos]
+                if state == 'start':
+                    if char != '[':
+                        raise BulkFormatError(0, "El cuerpo debe ser un arreglo JSON")
+                    state = 'first'
+                    pos += 1
+                elif state in ('first', 'value'):
+                    if char == ']' and state == 'first':
+                        state = 'end'
+                        pos += 1
+                        continue
+                    try:
+                        data, end = decoder.raw_decode(buffer, pos)
+                    except ValueError:
+                        if final:
+                            raise BulkFormatError(item + 1, "JSON no válido")
+                        if len(buffer) - pos > max_row_bytes:
+                            raise BulkFormatError(item + 1, "El elemento es demasiado grande")
+                        incomplete = True
+                        return
+                    if end == len(buffer) and not final:
+                        # A number or literal may continue in the next chunk
+                        return
+                    item += 1
+                    pos = end
+                    state = 'separator'
+                    if isinstance(data, dict):
+                        yield item, data, None
+                    else:
+                        yield item, None, "El elemento debe ser un objeto JSON"
+                elif state == 'separator':
+                    if char not in ',]':
+                        raise BulkFormatError(item, "Se esperaba ',' o ']' en el arreglo JSON")
+                    state = 'value' if char == ',' else 'end'
+                    pos += 1
+                else:
+                    raise BulkFormatError(item, "Contenido después del arreglo JSON")
+        finally:
+            buffer = buffer[pos:]
+
+    async for text in iter_text(chunks):
+        buffer += text
+        # An unfinished object cannot decode before its closing brace arrives
+        if incomplete and '}' not in text:
+            if len(buffer) > max_row_bytes:
+                raise BulkFormatError(item + 1, "El elemento es demasiado grande")
+            continue
+        for row in drain(False):
+            yield row
+    for row in drain(True):
+        yield row
+    if state != 'end':
+        raise BulkFormatError(item, "El arreglo JSON está incompleto")
+
+
+READERS = {
+    'json': iter_json_array,
+    'ndjson': iter_ndjson,
+    'csv': iter_csv,
+}
+
+
+def read_rows(chunks: AsyncIterator[bytes], fmt: str, max_row_bytes: int) -> AsyncIterator[Row]:
+    return READERS[fmt](chunks, max_row_bytes)
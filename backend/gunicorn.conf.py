@@ -0,0 +1,36 @@
+"""Gunicorn settings for serving the app with several Uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py server:app
+
+Each worker is a separate process with its own event loop, MongoDB pool and
+in-memory caches. The workers see each other's writes through a shared
+pub/sub backend, PUBSUB_BACKEND=mongo or redis, which carries chat pushes and
+cache invalidations, response cache versions included. With
+PUBSUB_BACKEND=local the in-memory response cache is turned off at startup;
+RESPONSE_CACHE_BACKEND=redis shares the cached responses themselves.
+
+MongoDB sees up to WEB_CONCURRENCY * MONGO_MAX_POOL_SIZE connections, so size
+the pool per worker rather than for the whole server.
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# server.py sizes per-worker pools from this, so make it match when it was left unset
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+# Not preloaded: a MongoDB client must not be shared across fork, so every
+# worker imports the app and opens its own client in the lifespan
+preload_app = False
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+# Recycle workers now and then; the jitter keeps them from restarting together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')  # e.g. '-' for stdout
+errorlog = '-'
@@ -0,0 +1,282 @@
+"""Pet image storage outside MongoDB, deduplicated by content hash.
+
+Run as a script to move base64 images already embedded in pet documents
+(data URLs or bare base64) into the configured store:
+
+    python images.py --migrate
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # Thumbnails are skipped without Pillow
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+}
+DATA_URL_RE = re.compile(r'^data:image/[\w.+-]+;base64,(?P<data>.+)$', re.DOTALL)
+# Bare base64, as older clients sent images; URLs always contain characters outside this alphabet.
+# Plain names and ids can fit it too, so only long enough strings that decode to a known format count
+BASE64_RE = re.compile(r'^[A-Za-z0-9+/\s]+=*\s*$')
+BASE64_MIN_LENGTH = 48  # The smallest well-formed image, a 1x1 GIF, takes 35 bytes
+KEY_RE = re.compile(r'^[0-9a-f]{64}(_thumb)?\.(jpg|png|gif|webp)$')
+
+
+class InvalidImageError(ValueError):
+    pass
+
+
+def sniff_extension(data: bytes) -> Optional[str]:
+    """Detect the image format from its magic bytes"""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def bare_base64_image(value: str) -> Optional[str]:
+    """The base64 payload of a bare base64 image, or None for any other string"""
+    encoded = ''.join(value.split())
+    if len(encoded) < BASE64_MIN_LENGTH or not BASE64_RE.match(encoded):
+        return None
+    try:
+        # 16 characters decode to the 12 bytes sniff_extension looks at
+        head = base64.b64decode(encoded[:16], validate=True)
+    except binascii.Error:
+        return None
+    return encoded if sniff_extension(head) else None
+
+
+def make_thumbnail(data: bytes, size: int) -> Optional[bytes]:
+    if Image is None:
+        return None
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=80, optimize=True)
+        return output.getvalue()
+
+
+class LocalImageStore:
+    """Stores images as files under a directory; the default and the stand-in for tests"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._path(key).exists)
+
+    async def put(self, key: str, data: bytes, content_type: str):
+        def write():
+            path = self._path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write-then-rename so readers never see half-written files; each
+            # writer gets its own temp file, since dedup makes racing writers likely
+            with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'.{key}.', delete=False) as tmp:
+                tmp.write(data)
+            try:
+                os.replace(tmp.name, path)
+            except OSError:
+                os.unlink(tmp.name)
+                raise
+        await asyncio.to_thread(write)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            return await asyncio.to_thread(path.read_bytes)
+        except FileNotFoundError:
+            return None
+
+
+class S3ImageStore:
+    """Stores images in an S3-compatible bucket (AWS, MinIO, ...)"""
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self.bucket = bucket
+        self._client = boto3.client('s3', endpoint_url=endpoint_url)
+        self._client_error = ClientError
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await asyncio.to_thread(self._client.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except self._client_error:
+            return False
+
+    async def put(self, key: str, data: bytes, content_type: str):
+        await asyncio.to_thread(
+            self._client.put_object, Bucket=self.bucket, Key=key, Body=data, ContentType=content_type
+        )
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            obj = await asyncio.to_thread(self._client.get_object, Bucket=self.bucket, Key=key)
+        except self._client_error:
+            return None
+        return await asyncio.to_thread(obj['Body'].read)
+
+
+class ImageService:
+    def __init__(self, store, base_url: str, max_bytes: int, thumbnail_size: int):
+        self.store = store
+        self.base_url = base_url.rstrip('/')
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+
+    def url(self, key: str) -> str:
+        return f'{self.base_url}/{key}'
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        prefix = self.base_url + '/'
+        if url.startswith(prefix) and KEY_RE.match(url[len(prefix):]):
+            return url[len(prefix):]
+        return None
+
+    def thumbnail_url(self, url: str) -> str:
+        """Thumbnail of a stored image; external URLs are their own thumbnail"""
+        key = self.key_from_url(url)
+        if key is None or '_thumb' in key:
+            return url
+        return self.url(key.split('.')[0] + '_thumb.jpg')
+
+    async def save(self, data: bytes) -> dict:
+        """Store an image and its thumbnail once per distinct content"""
+        if len(data) > self.max_bytes:
+            raise InvalidImageError('too_large')
+        extension = sniff_extension(data)
+        if extension is None:
+            raise InvalidImageError('unsupported')
+
+        digest = hashlib.sha256(data).hexdigest()
+        key = f'{digest}.{extension}'
+        thumb_key = f'{digest}_thumb.jpg'
+        if not await self.store.exists(key):
+            try:
+                thumbnail = await asyncio.to_thread(make_thumbnail, data, self.thumbnail_size)
+            except Exception:
+                raise InvalidImageError('unreadable')
+            # Without Pillow the thumbnail falls back to the original bytes
+            await self.store.put(thumb_key, thumbnail or data, CONTENT_TYPES['jpg'] if thumbnail else CONTENT_TYPES[extension])
+            await self.store.put(key, data, CONTENT_TYPES[extension])
+        return {'hash': digest, 'url': self.url(key), 'thumbnail_url': self.url(thumb_key)}
+
+    async def load(self, key: str) -> Optional[Tuple[bytes, str]]:
+        if not KEY_RE.match(key):
+            return None
+        data = await self.store.get(key)
+        if data is None:
+            return None
+        return data, CONTENT_TYPES[key.rsplit('.', 1)[1]]
+
+    async def offload(self, images: List[str]) -> List[str]:
+        """Replace base64 images, as data URLs or bare, with references to stored images; URLs are kept"""
+        result = []
+        for image in images:
+            match = DATA_URL_RE.match(image)
+            if match:
+                encoded = match.group('data')
+            elif image.lower().startswith('data:'):
+                # Any other data URL would still be stored inline
+                raise InvalidImageError('unsupported')
+            else:
+                encoded = bare_base64_image(image)
+                if encoded is None:
+                    # URLs, and names or ids that merely look like base64
+                    result.append(image)
+                    continue
+            try:
+                data = base64.b64decode(''.join(encoded.split()), validate=True)
+            except binascii.Error:
+                raise InvalidImageError('invalid_base64')
+            result.append((await self.save(data))['url'])
+        return result
+
+
+def image_service_from_env() -> ImageService:
+    if os.environ.get('IMAGE_STORE', 'local') == 's3':
+        store = S3ImageStore(os.environ['IMAGE_S3_BUCKET'], os.environ.get('IMAGE_S3_ENDPOINT_URL'))
+    else:
+        store = LocalImageStore(Path(os.environ.get('IMAGE_DIR', Path(__file__).parent / 'uploads')))
+    return ImageService(
+        store,
+        base_url=os.environ.get('IMAGE_BASE_URL', '/api/images'),
+        max_bytes=int(os.environ.get('IMAGE_MAX_BYTES', 5 * 1024 * 1024)),
+        thumbnail_size=int(os.environ.get('IMAGE_THUMBNAIL_SIZE', '400')),
+    )
+
+
+async def migrate_pet_images(db, service: ImageService):
+    """Offload embedded base64 images of existing pets, one pet at a time"""
+    migrated = 0
+    bare = re.compile(rf'^[A-Za-z0-9+/\s]{{{BASE64_MIN_LENGTH},}}=*\s*$')
+    query = {'images': {'$in': [re.compile('^data:'), bare]}}
+    async for pet in db.pets.find(query, {'_id': 0, 'id': 1, 'images': 1}):
+        try:
+            images = await service.offload(pet['images'])
+        except InvalidImageError as e:
+            logger.warning(f"Mascota {pet['id']}: imagen no válida ({e}), se omite")
+            continue
+        if images == pet['images']:
+            # Only values that look like base64 without being images
+            continue
+        await db.pets.update_one({'id': pet['id']}, {'$set': {
+            'images': images,
+            'thumbnails': [service.thumbnail_url(image) for image in images],
+        }})
+        migrated += 1
+    return migrated
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description='Pet image storage maintenance')
+    parser.add_argument('--migrate', action='store_true', help='move embedded base64 images to the image store')
+    args = parser.parse_args()
+    if not args.migrate:
+        parser.print_help()
+        return
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        migrated = await migrate_pet_images(client[os.environ['DB_NAME']], image_service_from_env())
+        print(f'{migrated} mascotas migradas')
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,223 @@
+"""Index declarations for every collection and query shape used by server.py.
+
+Run as a script to compare the declared indexes with the database:
+
+    python indexes.py            # report missing, undeclared and unused indexes, and duplicated unique keys
+    python indexes.py --apply    # create the missing ones
+    python indexes.py --dedupe   # merge documents that share a unique key, then report
+
+Databases written before the unique indexes existed may hold duplicates left
+by concurrent registrations, swipes or chat creations. Startup refuses to
+serve without those indexes, so run --dedupe (then --apply) once first.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+from collections import Counter
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    'users': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+    ],
+    'pets': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        # get_pets keyset pages
+        IndexModel([('foundation_id', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING)],
+                   name='foundation_created'),
+        # Unranked feed keyset pages and ranker loads
+        IndexModel([('status', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING)],
+                   name='status_created'),
+    ],
+    'matches': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        # One swipe per adopter and pet; also serves the adopter's get_matches pages
+        IndexModel([('user_id', ASCENDING), ('pet_id', ASCENDING)], name='user_pet_unique', unique=True),
+        IndexModel([('user_id', ASCENDING), ('is_match', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING)],
+                   name='user_matches_created'),
+        IndexModel([('pet_id', ASCENDING), ('is_match', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING)],
+                   name='pet_matches_created'),
+    ],
+    'appointments': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel([('match_id', ASCENDING), ('date', ASCENDING), ('time', ASCENDING)], name='match_date'),
+    ],
+    'chats': [
+        IndexModel([('match_id', ASCENDING)], name='match_unique', unique=True),
+    ],
+    'messages': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        # get_chat keyset pages in both directions
+        IndexModel([('match_id', ASCENDING), ('timestamp', ASCENDING), ('id', ASCENDING)], name='match_timestamp'),
+    ],
+    'seen_pets': [
+        IndexModel([('user_id', ASCENDING)], name='user_unique', unique=True),
+    ],
+    'recommendations': [
+        IndexModel([('user_id', ASCENDING)], name='user_unique', unique=True),
+        # Adopters holding a changed pet in their top-N
+        IndexModel([('pet_ids', ASCENDING)], name='pet_ids'),
+    ],
+}
+
+
+# Documents that refer to a collection's `id`; when duplicates are merged they
+# are repointed to the document that is kept
+REFERENCES = {
+    'users': [('pets', 'foundation_id'), ('matches', 'user_id'), ('messages', 'sender_id')],
+    'matches': [('appointments', 'match_id'), ('chats', 'match_id'), ('messages', 'match_id')],
+}
+# Per-user documents derived from swipes; they are rebuilt on their next read
+DERIVED = {
+    'users': [('seen_pets', 'user_id'), ('recommendations', 'user_id')],
+}
+# Array fields whose items are moved to the document that is kept (legacy embedded chat messages)
+MERGED_ARRAYS = {
+    'chats': ['messages'],
+}
+
+DUPLICATE_KEY = 11000
+
+
+async def ensure_indexes(db):
+    """Create every declared index; existing ones are left untouched.
+
+    A unique index that cannot be built stops startup: registration and swipes
+    rely on it to reject duplicates. Other failures are only logged.
+    """
+    for collection, models in INDEXES.items():
+        for model in models:
+            name = f"{collection}.{model.document['name']}"
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as e:
+                if model.document.get('unique'):
+                    # Serving without the index would let more duplicates in
+                    message = f"No se pudo crear el índice único {name}: {e}"
+                    if e.code == DUPLICATE_KEY:
+                        groups = await find_duplicates(db, collection, model)
+                        keys = '; '.join(str(group['key']) for group in groups[:5])
+                        message += (
+                            f". {len(groups)} claves duplicadas (p. ej. {keys}); "
+                            "ejecute 'python indexes.py --dedupe' y vuelva a iniciar"
+                        )
+                    raise RuntimeError(message) from e
+                logger.error(f"No se pudo crear el índice {name}: {e}")
+
+
+async def find_duplicates(db, collection: str, model: IndexModel) -> List[dict]:
+    """Groups of documents sharing the key of a unique index, each with its _ids oldest first"""
+    pipeline = [
+        {'$sort': {'created_at': ASCENDING, '_id': ASCENDING}},
+        {'$group': {
+            '_id': {field: f'${field}' for field in model.document['key']},
+            'ids': {'$push': '$_id'},
+            'count': {'$sum': 1},
+        }},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    return [
+        {'key': group['_id'], 'ids': group['ids']}
+        async for group in db[collection].aggregate(pipeline, allowDiskUse=True)
+    ]
+
+
+async def merge_duplicates(db, collection: str, ids: list):
+    """Keep the first of `ids` and fold the others into it"""
+    docs = {doc['_id']: doc async for doc in db[collection].find({'_id': {'$in': ids}})}
+    kept, dropped = docs[ids[0]], [docs[_id] for _id in ids[1:] if _id in docs]
+
+    old_ids = list({doc['id'] for doc in dropped if doc.get('id') and doc['id'] != kept.get('id')})
+    if old_ids:
+        for other, field in REFERENCES.get(collection, []):
+            await db[other].update_many({field: {'$in': old_ids}}, {'$set': {field: kept['id']}})
+        for other, field in DERIVED.get(collection, []):
+            await db[other].delete_many({field: {'$in': [kept['id'], *old_ids]}})
+    for field in MERGED_ARRAYS.get(collection, []):
+        items = [item for doc in dropped for item in doc.get(field, [])]
+        if items:
+            await db[collection].update_one({'_id': kept['_id']}, {'$push': {field: {'$each': items}}})
+    await db[collection].delete_many({'_id': {'$in': [doc['_id'] for doc in dropped]}})
+
+
+async def dedupe(db) -> Dict[str, int]:
+    """Merge documents that share a unique key into the oldest one, so every unique index can be built.
+
+    References to the merged documents' ids are repointed first. Collections
+    are visited in declaration order, so duplicates that repointing creates
+    further down (two swipes of merged users on the same pet) are merged too.
+    """
+    removed: Counter = Counter()
+    for collection, models in INDEXES.items():
+        for model in models:
+            if not model.document.get('unique'):
+                continue
+            for group in await find_duplicates(db, collection, model):
+                await merge_duplicates(db, collection, group['ids'])
+                removed[f"{collection}.{model.document['name']}"] += len(group['ids']) - 1
+    return dict(removed)
+
+
+async def index_report(db) -> Dict[str, dict]:
+    """Compare declared indexes with the database, including usage counters from $indexStats"""
+    report = {}
+    for collection, models in INDEXES.items():
+        declared = {model.document['name'] for model in models}
+        existing = await db[collection].index_information()
+        usage = {}
+        try:
+            async for stat in db[collection].aggregate([{'$indexStats': {}}]):
+                usage[stat['name']] = stat['accesses']['ops']
+        except OperationFailure:
+            pass
+        duplicates = []
+        for model in models:
+            if model.document.get('unique') and model.document['name'] not in existing:
+                for group in await find_duplicates(db, collection, model):
+                    duplicates.append(f"{model.document['name']} {group['key']} x{len(group['ids'])}")
+        report[collection] = {
+            'missing': sorted(declared - set(existing)),
+            'undeclared': sorted(set(existing) - declared - {'_id_'}),
+            'unused': sorted(name for name, ops in usage.items() if ops == 0 and name != '_id_'),
+            'duplicates': duplicates,
+        }
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Check or create the MongoDB indexes used by the API')
+    parser.add_argument('--apply', action='store_true', help='create missing indexes before reporting')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='merge documents that share a unique key before creating or reporting')
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if args.dedupe:
+            for name, count in (await dedupe(db)).items():
+                print(f"{name}: {count} duplicados fusionados")
+        if args.apply:
+            await ensure_indexes(db)
+        for collection, result in (await index_report(db)).items():
+            print(f"{collection}:")
+            for key in ('missing', 'undeclared', 'unused', 'duplicates'):
+                print(f"  {key}: {', '.join(result[key]) or '-'}")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,323 @@
+"""Per-request instrumentation exported in the Prometheus text format.
+
+The middleware times every HTTP request by route template and counts the
+bytes it sends. A pymongo command listener counts Mongo round-trips, and
+`Metrics.timed` measures named sections such as bcrypt. Routes built
+with `timed_route_class` also time FastAPI's Pydantic validation and
+serialization. All of it is attributed to the request that caused them through a
+context variable. Motor copies the caller's context into its executor
+threads, so commands run there are attributed too.
+"""
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+INF_LABEL = 'le="+Inf"'
+
+
+class RequestStats:
+    """What one request spent its time on; updated from executor threads too"""
+
+    __slots__ = ('mongo_commands', 'mongo_seconds', 'timings', 'user_type', '_lock')
+
+    def __init__(self):
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.timings: Dict[str, float] = {}
+        self.user_type: Optional[str] = None  # Set once the request is authenticated
+        self._lock = threading.Lock()
+
+    def add_command(self, seconds: float):
+        with self._lock:
+            self.mongo_commands += 1
+            self.mongo_seconds += seconds
+
+    def add_timing(self, name: str, seconds: float):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        parts = [f'app;dur={total * 1000:.1f}', f'mongo;dur={self.mongo_seconds * 1000:.1f};desc="{self.mongo_commands} cmd"']
+        parts += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.timings.items()]
+        return ', '.join(parts)
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar('current_request', default=None)
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def label_text(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[Tuple, List] = {}  # labels -> [bucket counts, sum, count]
+
+    def observe(self, labels: Tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_labels = label_text(self.labels, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {bucket_count}')
+            lines.append(f'{self.name}_bucket{label_text(self.labels, labels, INF_LABEL)} {count}')
+            lines.append(f'{self.name}_sum{label_text(self.labels, labels)} {total}')
+            lines.append(f'{self.name}_count{label_text(self.labels, labels)} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, labels: Tuple, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        lines += [f'{self.name}{label_text(self.labels, labels)} {value}' for labels, value in sorted(self._values.items())]
+        return lines
+
+
+class Metrics:
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self.request_seconds = Histogram(
+            f'{namespace}_http_request_duration_seconds', 'HTTP request latency by route template',
+            ('method', 'route', 'status'), LATENCY_BUCKETS
+        )
+        self.request_commands = Histogram(
+            f'{namespace}_http_request_mongo_commands', 'Mongo commands issued per HTTP request',
+            ('method', 'route'), COMMAND_BUCKETS
+        )
+        self.response_bytes = Counter(
+            f'{namespace}_http_response_bytes_total', 'Response body bytes sent', ('method', 'route')
+        )
+        self.mongo_commands = Counter(
+            f'{namespace}_mongo_commands_total', 'Mongo commands by name and outcome', ('command', 'outcome')
+        )
+        self.mongo_seconds = Counter(
+            f'{namespace}_mongo_command_seconds_total', 'Mongo round-trip time by command', ('command',)
+        )
+        self.section_seconds = Counter(
+            f'{namespace}_section_seconds_total', 'Time spent in instrumented sections', ('section',)
+        )
+        self.section_calls = Counter(
+            f'{namespace}_section_calls_total', 'Calls to instrumented sections', ('section',)
+        )
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats, sent: int):
+        with self._lock:
+            self.request_seconds.observe((method, route, status), seconds)
+            self.request_commands.observe((method, route), stats.mongo_commands)
+            self.response_bytes.inc((method, route), sent)
+
+    def observe_command(self, command: str, seconds: float, outcome: str):
+        with self._lock:
+            self.mongo_commands.inc((command, outcome))
+            self.mongo_seconds.inc((command,), seconds)
+        stats = current_request.get()
+        if stats is not None:
+            stats.add_command(seconds)
+
+    @contextmanager
+    def timed(self, section: str):
+        """Attribute the time spent in the block, awaits included, to `section`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_section(section, time.perf_counter() - start)
+
+    def add_section(self, section: str, seconds: float):
+        with self._lock:
+            self.section_seconds.inc((section,), seconds)
+            self.section_calls.inc((section,))
+        stats = current_request.get()
+        if stats is not None:
+            stats.add_timing(section, seconds)
+
+    def render(self, gauges: Optional[dict] = None) -> str:
+        """Prometheus text exposition; `gauges` are nested component stats flattened into gauges"""
+        with self._lock:
+            lines = []
+            for metric in (self.request_seconds, self.request_commands, self.response_bytes,
+                           self.mongo_commands, self.mongo_seconds, self.section_seconds, self.section_calls):
+                lines += metric.render()
+        for name, value in flatten(gauges or {}, self.namespace):
+            lines += [f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def flatten(stats: dict, prefix: str):
+    for key, value in stats.items():
+        name = f'{prefix}_{key}'.replace('-', '_').replace('.', '_')
+        if isinstance(value, dict):
+            yield from flatten(value, name)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.metrics.observe_command(event.command_name, event.duration_micros / 1e6, 'ok')
+
+    def failed(self, event):
+        self.metrics.observe_command(event.command_name, event.duration_micros / 1e6, 'error')
+
+
+class InstrumentationMiddleware:
+    """ASGI middleware recording latency, Mongo commands and bytes sent per route template"""
+
+    def __init__(self, app, metrics: Metrics, server_timing: bool = False, profiler=None):
+        self.app = app
+        self.metrics = metrics
+        self.server_timing = server_timing
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+        sent = 0
+        profile = self.profiler.begin(stats, scope['method'], scope['path']) if self.profiler else None
+
+        async def send_wrapper(message):
+            nonlocal status, sent
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if self.server_timing:
+                    MutableHeaders(scope=message).append('Server-Timing', stats.server_timing(time.perf_counter() - start))
+            elif message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            # The router leaves the matched route in the scope; templates keep the label set small
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            self.metrics.observe_request(scope['method'], route, status, time.perf_counter() - start, stats, sent)
+            if profile is not None:
+                self.profiler.finish(profile, route, status)
+
+
+class CallTime:
+    """Seconds a request spent inside its endpoint and dependency functions"""
+
+    __slots__ = ('seconds',)
+
+    def __init__(self):
+        self.seconds = 0.0
+
+
+call_time: ContextVar[Optional[CallTime]] = ContextVar('call_time', default=None)
+
+
+def _add_call_time(seconds: float):
+    spent = call_time.get()
+    if spent is not None:
+        spent.seconds += seconds
+
+
+def timed_call(call: Callable) -> Callable:
+    """Wrap an endpoint or dependency so its run time is counted in `call_time`"""
+    target = call if inspect.isroutine(call) else getattr(call, '__call__', call)
+    if inspect.isgeneratorfunction(target) or inspect.isasyncgenfunction(target):
+        # Dependencies with yield finish after the response; leave them as they are
+        return call
+
+    if inspect.iscoroutinefunction(target):
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                _add_call_time(time.perf_counter() - start)
+    else:
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return call(*args, **kwargs)
+            finally:
+                _add_call_time(time.perf_counter() - start)
+    return timed
+
+
+def time_calls(dependant):
+    for sub_dependant in dependant.dependencies:
+        time_calls(sub_dependant)
+    if dependant.call is not None:
+        dependant.call = timed_call(dependant.call)
+
+
+def timed_route_class(metrics: Metrics) -> type:
+    """Route class that times FastAPI's own work on a request as 'pydantic'.
+
+    That is body parsing and validation plus response_model serialization:
+    the handler's time minus the time spent inside the endpoint and its
+    dependencies. Only routes created with this class are measured.
+    """
+
+    class TimedRoute(APIRoute):
+        def get_route_handler(self):
+            time_calls(self.dependant)
+            handler = super().get_route_handler()
+
+            async def timed_handler(request):
+                spent = CallTime()
+                token = call_time.set(spent)
+                start = time.perf_counter()
+                try:
+                    return await handler(request)
+                finally:
+                    call_time.reset(token)
+                    metrics.add_section('pydantic', max(0.0, time.perf_counter() - start - spent.seconds))
+            return timed_handler
+
+    return TimedRoute
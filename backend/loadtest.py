@@ -0,0 +1,338 @@
+"""Concurrent load test built on the backend_test.py scenarios.
+
+Simulated foundations register and publish pets while simulated adopters
+register, log in, browse, swipe, chat and book appointments, all at once.
+Latency percentiles and throughput are reported per endpoint:
+
+    python loadtest.py                                   # in-process app on MONGO_URL/DB_NAME
+    python loadtest.py --mongomock                       # in-process app on an in-memory stand-in
+    python loadtest.py --base-url http://localhost:8000  # a running server
+    python loadtest.py --output results/HEAD.json --compare results/main.json
+
+Results are stored as JSON so runs from different commits can be compared.
+Use a throwaway database: every run registers new users and pets.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+TRAITS = ['playful', 'calm', 'energetic', 'friendly', 'independent', 'social']
+PASSWORD = 'TestPass123!'
+
+
+class ScenarioError(Exception):
+    pass
+
+
+class Recorder:
+    """Latency samples and unexpected statuses per endpoint"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, path: str,
+                   token: Optional[str] = None, expected: int = 200, **kwargs):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, f'/api{path}', headers=headers, **kwargs)
+        except httpx.HTTPError as e:
+            self.errors[name] += 1
+            raise ScenarioError(f'{name}: {e!r}')
+        self.samples[name].append(time.perf_counter() - start)
+        if response.status_code != expected:
+            self.errors[name] += 1
+            raise ScenarioError(f'{name}: {response.status_code} {response.text[:200]}')
+        return response.json()
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.recorder = Recorder()
+        self.random = random.Random(args.seed)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.foundations: List[dict] = []
+        self.failed_users = 0
+
+    def call(self, *args, **kwargs):
+        return self.recorder.call(self.client, *args, **kwargs)
+
+    def traits(self) -> dict:
+        return {trait: self.random.randint(1, 10) for trait in TRAITS}
+
+    async def register(self, kind: str, index: int, traits: Optional[dict] = None) -> dict:
+        body = {
+            'email': f'{kind}_{self.run_id}_{index}@loadtest.com',
+            'password': PASSWORD,
+            'name': f'{kind} {index}',
+            'age': 30,
+            'user_type': kind,
+        }
+        if traits:
+            body['personality_traits'] = traits
+        response = await self.call('POST /auth/register', 'POST', '/auth/register', json=body)
+        return {'email': body['email'], 'token': response['token'], 'id': response['user']['id']}
+
+    async def run_user(self, scenario, index: int):
+        async with self.semaphore:
+            try:
+                await scenario(index)
+            except ScenarioError as e:
+                self.failed_users += 1
+                logging.debug(f'Usuario {index} interrumpido: {e}')
+
+    async def foundation_setup(self, index: int):
+        foundation = await self.register('foundation', index)
+        for i in range(self.args.pets):
+            await self.call('POST /pets', 'POST', '/pets', foundation['token'], json={
+                'name': f'Mascota {index}-{i}',
+                'breed': self.random.choice(['Mestizo', 'Labrador', 'Siamés', 'Beagle']),
+                'age': self.random.randint(0, 15),
+                'personality_traits': self.traits(),
+                'images': [f'https://example.com/{index}-{i}.jpg'],
+            })
+        self.foundations.append(foundation)
+
+    async def adopter_session(self, index: int):
+        adopter = await self.register('adopter', index, self.traits())
+        login = await self.call('POST /auth/login', 'POST', '/auth/login',
+                                json={'email': adopter['email'], 'password': PASSWORD})
+        token = login['token']
+        await self.call('GET /users/profile', 'GET', '/users/profile', token)
+
+        pets = await self.call('GET /pets/available/list', 'GET', '/pets/available/list', token)
+        await self.call('GET /pets/available/top', 'GET', '/pets/available/top', token)
+        matches = []
+        for pet in pets[:self.args.swipes]:
+            action = 'like' if self.random.random() < 0.7 else 'pass'
+            match = await self.call('POST /matches/like', 'POST', '/matches/like', token,
+                                    json={'pet_id': pet['id'], 'action': action})
+            if match.get('is_match'):
+                matches.append(match)
+        await self.call('GET /matches', 'GET', '/matches', token)
+
+        for match in matches:
+            path = f"/chat/{match['id']}"
+            await self.call('GET /chat/{match_id}', 'GET', path, token)
+            for i in range(self.args.messages):
+                await self.call('POST /chat/{match_id}/messages', 'POST', f'{path}/messages', token,
+                                json={'message': f'Hola {i}'})
+            await self.call('POST /appointments', 'POST', '/appointments', token, json={
+                'match_id': match['id'],
+                'date': f'2030-01-{self.random.randint(1, 28):02d}',
+                'time': f'{self.random.randint(9, 17):02d}:00',
+            })
+        await self.call('GET /appointments', 'GET', '/appointments', token)
+
+    async def foundation_review(self, index: int):
+        token = self.foundations[index]['token']
+        await self.call('GET /pets', 'GET', '/pets', token)
+        matches = await self.call('GET /matches', 'GET', '/matches', token)
+        for match in matches[:self.args.accepts]:
+            path = f"/chat/{match['id']}"
+            await self.call('PUT /matches/{match_id}/accept', 'PUT', f"/matches/{match['id']}/accept", token)
+            await self.call('POST /chat/{match_id}/messages', 'POST', f'{path}/messages', token,
+                            json={'message': 'Gracias por tu interés'})
+            await self.call('GET /chat/{match_id}', 'GET', path, token)
+        await self.call('GET /appointments', 'GET', '/appointments', token)
+
+    async def phase(self, name: str, scenario, count: int) -> dict:
+        start = time.perf_counter()
+        await asyncio.gather(*(self.run_user(scenario, i) for i in range(count)))
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {count} usuarios en {elapsed:.2f} s")
+        return {'users': count, 'seconds': round(elapsed, 3)}
+
+    async def run(self) -> dict:
+        start = time.perf_counter()
+        phases = {
+            'foundation_setup': await self.phase('Fundaciones', self.foundation_setup, self.args.foundations),
+            'adopter_session': await self.phase('Adoptantes', self.adopter_session, self.args.adopters),
+        }
+        phases['foundation_review'] = await self.phase('Revisión', self.foundation_review, len(self.foundations))
+        return {'seconds': time.perf_counter() - start, 'phases': phases}
+
+
+def percentile(sorted_samples: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    return sorted_samples[max(0, math.ceil(p / 100 * len(sorted_samples)) - 1)]
+
+
+def summarize(recorder: Recorder, seconds: float) -> dict:
+    endpoints = {}
+    for name in sorted(set(recorder.samples) | set(recorder.errors)):
+        samples = sorted(recorder.samples[name])
+        stats = {'count': len(samples), 'errors': recorder.errors[name]}
+        if samples:
+            stats.update({
+                'p50_ms': round(percentile(samples, 50) * 1000, 2),
+                'p95_ms': round(percentile(samples, 95) * 1000, 2),
+                'p99_ms': round(percentile(samples, 99) * 1000, 2),
+                'mean_ms': round(statistics.fmean(samples) * 1000, 2),
+                'throughput_rps': round(len(samples) / seconds, 2),
+            })
+        endpoints[name] = stats
+    everything = sorted(sample for samples in recorder.samples.values() for sample in samples)
+    total = {
+        'requests': len(everything),
+        'errors': sum(recorder.errors.values()),
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(len(everything) / seconds, 2),
+    }
+    if everything:
+        total.update({
+            'p50_ms': round(percentile(everything, 50) * 1000, 2),
+            'p95_ms': round(percentile(everything, 95) * 1000, 2),
+            'p99_ms': round(percentile(everything, 99) * 1000, 2),
+        })
+    return {'total': total, 'endpoints': endpoints}
+
+
+def print_report(result: dict, baseline: Optional[dict]):
+    header = f"{'endpoint':<34}{'n':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}"
+    if baseline:
+        header += f"{'Δp95':>9}"
+    print(header)
+    rows = [*result['endpoints'].items(), ('TOTAL', {**result['total'], 'count': result['total']['requests']})]
+    for name, stats in rows:
+        line = f"{name:<34}{stats['count']:>6}{stats['errors']:>5}"
+        line += ''.join(f"{stats.get(key, 0):>9.1f}" for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'))
+        if baseline:
+            before = baseline['total'] if name == 'TOTAL' else baseline['endpoints'].get(name, {})
+            if before.get('p95_ms') and stats.get('p95_ms'):
+                line += f"{(stats['p95_ms'] / before['p95_ms'] - 1) * 100:>+8.0f}%"
+        print(line)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class MongomockSeenCollection:
+    """mongomock has no $bit operator, so apply the seen-pets word updates in Python"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    async def find_one(self, *args, **kwargs):
+        return await self.collection.find_one(*args, **kwargs)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        update = dict(update)
+        bits = update.pop('$bit', None)
+        if bits:
+            doc = await self.collection.find_one(query, {'words': 1}) or {}
+            words = doc.get('words', {})
+            for path, operation in bits.items():
+                index = path.split('.', 1)[1]
+                words[index] = int(words.get(index, 0)) | int(operation['or'])
+            update.setdefault('$set', {})['words'] = words
+        return await self.collection.update_one(query, update, upsert=upsert)
+
+
+def use_mongomock(server):
+    """Point the in-process app at an in-memory database"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    db = AsyncMongoMockClient(tz_aware=True)['loadtest']
+    server.bind_database(db)
+    server.seen_store.collection = MongomockSeenCollection(db.seen_pets)
+
+
+async def run_in_process(args: argparse.Namespace) -> Tuple[LoadTest, dict]:
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ.setdefault('DB_NAME', 'loadtest')
+    if args.mongomock:
+        os.environ['PUBSUB_BACKEND'] = 'local'
+    import server
+
+    if args.mongomock:
+        use_mongomock(server)
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.app.router.lifespan_context(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://loadtest', timeout=args.timeout) as client:
+            load_test = LoadTest(client, args)
+            return load_test, await load_test.run()
+
+
+async def run_remote(args: argparse.Namespace) -> Tuple[LoadTest, dict]:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        load_test = LoadTest(client, args)
+        return load_test, await load_test.run()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', help='load a running server instead of the in-process app')
+    parser.add_argument('--mongomock', action='store_true', help='in-process app on an in-memory database')
+    parser.add_argument('--foundations', type=int, default=5)
+    parser.add_argument('--pets', type=int, default=20, help='pets per foundation')
+    parser.add_argument('--adopters', type=int, default=50)
+    parser.add_argument('--swipes', type=int, default=10, help='swipes per adopter')
+    parser.add_argument('--messages', type=int, default=3, help='chat messages per match')
+    parser.add_argument('--accepts', type=int, default=5, help='matches each foundation accepts')
+    parser.add_argument('--concurrency', type=int, default=20, help='simulated users active at once')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=Path, help='write the results as JSON')
+    parser.add_argument('--compare', type=Path, help='earlier JSON results to compare p95 against')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    started_at = datetime.now(timezone.utc)
+    if args.base_url:
+        load_test, outcome = await run_remote(args)
+    else:
+        load_test, outcome = await run_in_process(args)
+
+    result = {
+        'meta': {
+            'commit': git_commit(),
+            'started_at': started_at.isoformat(),
+            'target': args.base_url or ('in-process/mongomock' if args.mongomock else 'in-process/mongo'),
+            'python': platform.python_version(),
+            'args': {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+            'failed_users': load_test.failed_users,
+            'phases': outcome['phases'],
+        },
+        **summarize(load_test.recorder, outcome['seconds']),
+    }
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(result, baseline)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+        print(f'Resultados guardados en {args.output}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""One-time conversion of ISO-string dates into native BSON datetimes.
+
+Only documents still holding a string date are touched, so the migration
+can be interrupted and re-run at any time:
+
+    python migrate_dates.py            # count what is left to convert
+    python migrate_dates.py --apply    # convert it in batches
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+DATE_FIELDS = {
+    'users': 'created_at',
+    'pets': 'created_at',
+    'matches': 'created_at',
+    'appointments': 'created_at',
+    'chats': 'created_at',
+    'messages': 'timestamp',
+}
+
+
+def parse_date(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def pending_count(collection, field: str) -> int:
+    return await collection.count_documents({field: {'$type': 'string'}})
+
+
+async def migrate_collection(collection, field: str, batch_size: int) -> int:
+    """Convert string dates in `_id` order, one bulk write per batch"""
+    converted = 0
+    last_id = None
+    while True:
+        query = {field: {'$type': 'string'}}
+        if last_id is not None:
+            # Unparsable values stay strings; move past them instead of re-reading them
+            query['_id'] = {'$gt': last_id}
+        batch = await collection.find(query, {field: 1}).sort('_id', 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return converted
+
+        requests = []
+        for doc in batch:
+            try:
+                value = parse_date(doc[field])
+            except ValueError:
+                logger.warning(f"{collection.name} {doc['_id']}: fecha no válida {doc[field]!r}, se omite")
+                continue
+            # Matching the old value leaves documents rewritten since they were read alone
+            requests.append(UpdateOne({'_id': doc['_id'], field: doc[field]}, {'$set': {field: value}}))
+        if requests:
+            result = await collection.bulk_write(requests, ordered=False)
+            converted += result.modified_count
+        last_id = batch[-1]['_id']
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Convert ISO-string dates into BSON datetimes')
+    parser.add_argument('--apply', action='store_true', help='convert the remaining string dates')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        for name, field in DATE_FIELDS.items():
+            if args.apply:
+                converted = await migrate_collection(db[name], field, args.batch_size)
+                print(f"{name}.{field}: {converted} convertidos, {await pending_count(db[name], field)} pendientes")
+            else:
+                print(f"{name}.{field}: {await pending_count(db[name], field)} pendientes")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, TypeVar
+
+T = TypeVar('T')
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the password pool already holds as many jobs as it accepts"""
+
+
+class OperationStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+        self.wait_seconds_total = 0.0
+
+    def record(self, waited: float, elapsed: float, failed: bool):
+        self.count += 1
+        self.errors += int(failed)
+        self.seconds_total += elapsed
+        self.seconds_max = max(self.seconds_max, elapsed)
+        self.wait_seconds_total += waited
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'seconds_total': round(self.seconds_total, 6),
+            'seconds_max': round(self.seconds_max, 6),
+            'avg_ms': round(self.seconds_total / self.count * 1000, 3) if self.count else 0.0,
+            'avg_wait_ms': round(self.wait_seconds_total / self.count * 1000, 3) if self.count else 0.0,
+        }
+
+
+class PasswordPool:
+    """Bounded thread pool for bcrypt work so hashing never blocks the event loop.
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism.
+    At most `workers + max_queue` jobs are accepted at once; beyond that
+    `run` raises PoolSaturatedError so the caller can shed load instead of
+    queueing requests indefinitely.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password')
+        self._pending = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stats: Dict[str, OperationStats] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self._pending - self._active, 0)
+
+    async def run(self, operation: str, func: Callable[..., T], *args) -> T:
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise PoolSaturatedError(operation)
+            self._pending += 1
+
+        try:
+            future = self._executor.submit(self._timed, operation, time.perf_counter(), func, *args)
+        except BaseException:
+            self._release()
+            raise
+        # A job keeps its slot until it finishes or is cancelled before starting,
+        # not until its caller stops waiting (e.g. when the client disconnects)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _timed(self, operation: str, submitted: float, func: Callable[..., T], *args) -> T:
+        started = time.perf_counter()
+        with self._lock:
+            self._active += 1
+        failed = True
+        try:
+            result = func(*args)
+            failed = False
+            return result
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._active -= 1
+                stats = self._stats.setdefault(operation, OperationStats())
+                stats.record(started - submitted, finished - started, failed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            operations = {name: stats.snapshot() for name, stats in self._stats.items()}
+            active = self._active
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'in_flight': self._pending,
+            'active': active,
+            'queue_depth': max(self._pending - active, 0),
+            'rejected': self.rejected,
+            'operations': operations,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,180 @@
+"""Opt-in sampling profiler that keeps stack profiles of slow requests.
+
+A background thread wakes every `interval` seconds and samples every
+in-flight request. If the event loop is executing the request's task at that
+moment, the loop thread's real stack is recorded (`running`). Otherwise the
+request is suspended, and the chain of coroutines it is awaiting is
+recorded (`waiting`), for example a Mongo call or the password pool. Samples
+of requests that finish under the threshold are dropped. The last few slow
+ones are kept in a ring buffer, with stacks folded as `outer;...;inner`
+like flame graph tools expect.
+"""
+import asyncio
+import itertools
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ASYNCIO_DIR = str(Path(asyncio.__file__).parent)
+MAX_STACKS = 500  # Distinct stacks kept per request; the rest count as '(otros)'
+TOP_STACKS = 50
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})'
+
+
+def thread_stack(frame) -> List[str]:
+    """Labels of the loop thread's frames, innermost first, up to the event loop machinery"""
+    labels = []
+    while frame is not None and not frame.f_code.co_filename.startswith(ASYNCIO_DIR):
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return labels[::-1]
+
+
+def await_stack(task: asyncio.Task) -> List[str]:
+    """Labels of the coroutines a suspended task is awaiting, outermost first"""
+    labels = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+        if frame is None:
+            labels.append(type(awaitable).__name__)
+            break
+        labels.append(frame_label(frame))
+        awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+    return labels
+
+
+class RequestProfile:
+    __slots__ = ('id', 'task', 'stats', 'method', 'path', 'started', 'started_at', 'samples', 'stacks')
+
+    def __init__(self, profile_id: int, task: asyncio.Task, stats, method: str, path: str):
+        self.id = profile_id
+        self.task = task
+        self.stats = stats
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self.samples = 0
+        self.stacks: Counter = Counter()
+
+    def add(self, state: str, labels: List[str]):
+        key = (state, ';'.join(labels))
+        if key not in self.stacks and len(self.stacks) >= MAX_STACKS:
+            key = (state, '(otros)')
+        self.stacks[key] += 1
+        self.samples += 1
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold: float, interval: float, capacity: int):
+        self.threshold = threshold
+        self.interval = interval
+        self.profiles: deque = deque(maxlen=capacity)
+        self.profiled = 0
+        self._active: Dict[int, RequestProfile] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+
+    def start(self):
+        """Start sampling the running event loop; call from the loop thread"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='slow-request-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def begin(self, stats, method: str, path: str) -> Optional[RequestProfile]:
+        task = asyncio.current_task()
+        if self._thread is None or task is None:
+            return None
+        profile = RequestProfile(next(self._ids), task, stats, method, path)
+        with self._lock:
+            self._active[profile.id] = profile
+        return profile
+
+    def finish(self, profile: Optional[RequestProfile], route: str, status: int):
+        if profile is None:
+            return
+        with self._lock:
+            self._active.pop(profile.id, None)
+        duration = time.perf_counter() - profile.started
+        if duration < self.threshold:
+            return
+        self.profiled += 1
+        self.profiles.append({
+            'id': profile.id,
+            'method': profile.method,
+            'route': route,
+            'path': profile.path,
+            'status': status,
+            'user_type': profile.stats.user_type,
+            'started_at': profile.started_at,
+            'duration_ms': round(duration * 1000, 1),
+            'mongo_commands': profile.stats.mongo_commands,
+            'mongo_ms': round(profile.stats.mongo_seconds * 1000, 1),
+            'interval_ms': self.interval * 1000,
+            'samples': profile.samples,
+            'stacks': [
+                {'state': state, 'stack': stack, 'count': count}
+                for (state, stack), count in profile.stacks.most_common()
+            ],
+        })
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                if self._active:
+                    self._sample()
+
+    def _sample(self):
+        running = asyncio.current_task(self._loop)
+        frame = sys._current_frames().get(self._loop_thread)
+        for profile in self._active.values():
+            if profile.task is running and frame is not None:
+                profile.add('running', thread_stack(frame))
+            else:
+                profile.add('waiting', await_stack(profile.task))
+
+    def recent(self) -> List[dict]:
+        """Stored profiles, newest first, with their heaviest stacks only"""
+        return [
+            {**profile, 'stacks': profile['stacks'][:TOP_STACKS]}
+            for profile in reversed(self.profiles)
+        ]
+
+    def get(self, profile_id: int) -> Optional[dict]:
+        return next((profile for profile in self.profiles if profile['id'] == profile_id), None)
+
+    def stats(self) -> dict:
+        return {
+            'threshold_ms': self.threshold * 1000,
+            'interval_ms': self.interval * 1000,
+            'capacity': self.profiles.maxlen,
+            'stored': len(self.profiles),
+            'profiled': self.profiled,
+            'in_flight': len(self._active),
+        }
+
+
+def folded(profile: dict) -> str:
+    """Stacks in the folded format read by flamegraph.pl and speedscope"""
+    return ''.join(f"{item['state']};{item['stack']} {item['count']}\n" for item in profile['stacks'])
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import timezone
+from typing import Callable, Dict, List, Optional, Set
+
+from bson import json_util
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[str, dict], None]
+Listener = Callable[[dict], None]
+
+NAMESPACE_EXISTS = 48
+# Events carry BSON types such as datetimes; read them back as UTC-aware like the Mongo client does
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS.with_options(tz_aware=True, tzinfo=timezone.utc)
+
+
+class LocalBackend:
+    """Delivers events to subscribers of this process only"""
+
+    shared = False
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def publish(self, channel: str, data: dict):
+        if self._deliver:
+            self._deliver(channel, data)
+
+    async def stop(self):
+        self._deliver = None
+
+
+class MongoCappedBackend:
+    """Shares events between workers through a capped collection and a tailable cursor.
+
+    Works on a standalone mongod (no replica set needed). Every worker,
+    including the publisher, receives events by tailing the collection, so
+    delivery order is the same everywhere.
+    """
+
+    shared = True
+
+    def __init__(self, db, collection: str = 'events', size_bytes: int = 16 * 1024 * 1024):
+        self.db = db
+        self.collection_name = collection
+        self.size_bytes = size_bytes
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver):
+        try:
+            await self.db.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass
+        except OperationFailure as e:
+            # Another worker created it between the existence check and the create
+            if e.code != NAMESPACE_EXISTS:
+                raise
+        collection = self.db[self.collection_name]
+        # A tailable cursor on an empty capped collection dies at once, so seed it
+        latest = await collection.find_one(sort=[('$natural', -1)])
+        if latest is None:
+            await collection.insert_one({'channel': None})
+            latest = await collection.find_one(sort=[('$natural', -1)])
+        self._task = asyncio.create_task(self._tail(collection, latest['_id'], deliver))
+
+    async def _tail(self, collection, last_id, deliver: Deliver):
+        """Deliver every event inserted after `last_id`, resuming by position when the cursor dies.
+
+        Each worker generates its own ObjectIds, and those are not ordered
+        within a second, so `{'_id': {'$gt': last_id}}` could skip an event
+        another worker inserted with a lower id. The cursor instead walks the
+        collection in insertion ($natural) order and discards events up to
+        and including the last one delivered, which reads the capped
+        collection once from its oldest event on every (re)start.
+        """
+        while True:
+            try:
+                if await collection.find_one({'_id': last_id}, {'_id': 1}) is None:
+                    # The capped collection wrapped past our position; carry on from the end
+                    logger.warning("Se perdió la posición en los eventos de pub/sub; se continúa desde el final")
+                    last_id = (await collection.find_one(sort=[('$natural', -1)]))['_id']
+                skipping = True
+                cursor = collection.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for event in cursor:
+                        if skipping:
+                            skipping = event['_id'] != last_id
+                            continue
+                        last_id = event['_id']
+                        if event.get('channel'):
+                            deliver(event['channel'], event['data'])
+                await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error leyendo eventos de pub/sub, reintentando")
+                await asyncio.sleep(1)
+
+    async def publish(self, channel: str, data: dict):
+        await self.db[self.collection_name].insert_one({'channel': channel, 'data': data})
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+class RedisBackend:
+    """Shares events between workers through Redis pub/sub, without storing them.
+
+    Lower latency than the capped collection and no load on MongoDB, but an
+    event published while a worker is reconnecting is lost to that worker.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = 'tinderpets:events:'):
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _subscribe(self):
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.psubscribe(f'{self.prefix}*')
+
+    async def start(self, deliver: Deliver):
+        # Subscribe before returning so events published right after startup are not missed
+        await self._subscribe()
+        self._task = asyncio.create_task(self._listen(deliver))
+
+    async def _listen(self, deliver: Deliver):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    channel = message['channel'].decode('utf-8')[len(self.prefix):]
+                    deliver(channel, json_util.loads(message['data'], json_options=JSON_OPTIONS))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error leyendo eventos de Redis, reconectando")
+                await asyncio.sleep(1)
+                try:
+                    await self._pubsub.aclose()
+                    await self._subscribe()
+                except Exception:
+                    logger.exception("No se pudo reconectar a Redis")
+
+    async def publish(self, channel: str, data: dict):
+        await self._redis.publish(f'{self.prefix}{channel}', json_util.dumps(data))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+
+class Subscription:
+    def __init__(self, hub: 'PubSubHub', channel: str, maxsize: int):
+        self.hub = hub
+        self.channel = channel
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, data: dict):
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # Slow consumer: flag it so it disconnects and resyncs instead of stalling the hub
+            self.overflowed = True
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+    def close(self):
+        self.hub._unsubscribe(self)
+
+
+class PubSubHub:
+    """Fans out published events to every local subscriber of a channel"""
+
+    def __init__(self, backend, queue_size: int = 100):
+        self.backend = backend
+        self.queue_size = queue_size
+        self.published = 0
+        self.delivered = 0
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._listeners: Dict[str, List[Listener]] = defaultdict(list)
+
+    async def start(self):
+        await self.backend.start(self._deliver)
+
+    async def stop(self):
+        await self.backend.stop()
+
+    async def publish(self, channel: str, data: dict):
+        self.published += 1
+        await self.backend.publish(channel, data)
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(self, channel, self.queue_size)
+        self._subscribers[channel].add(subscription)
+        return subscription
+
+    def listen(self, channel: str, listener: Listener):
+        """Call `listener` with every event on `channel` for as long as the hub runs"""
+        self._listeners[channel].append(listener)
+
+    def _unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.channel]
+
+    def _deliver(self, channel: str, data: dict):
+        for listener in self._listeners.get(channel, ()):
+            try:
+                listener(data)
+            except Exception:
+                logger.exception(f"Error procesando un evento de {channel}")
+        for subscription in tuple(self._subscribers.get(channel, ())):
+            subscription.offer(data)
+            self.delivered += 1
+
+    def stats(self) -> dict:
+        return {
+            'backend': type(self.backend).__name__,
+            'channels': len(self._subscribers),
+            'subscribers': sum(len(subs) for subs in self._subscribers.values()),
+            'published': self.published,
+            'delivered': self.delivered,
+        }
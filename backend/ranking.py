@@ -0,0 +1,253 @@
+import heapq
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+TRAIT_KEYS = ('playful', 'calm', 'energetic', 'friendly', 'independent', 'social')
+MAX_TRAIT_DIFF = 9  # Max difference per trait is 9 (10-1)
+MAX_TOTAL_DIFF = MAX_TRAIT_DIFF * len(TRAIT_KEYS)
+
+
+def traits_vector(traits: dict) -> np.ndarray:
+    """Convert a personality traits dict into a row vector in TRAIT_KEYS order"""
+    return np.array([traits[key] for key in TRAIT_KEYS], dtype=np.int16)
+
+
+def similarity_scores(distances: np.ndarray) -> np.ndarray:
+    """Convert L1 distances into the 0-100 compatibility scale used by calculate_compatibility"""
+    return np.round((1 - distances / MAX_TOTAL_DIFF) * 100, 2)
+
+
+class CompatibilityRanker:
+    """In-memory trait matrix of every available pet, scored in one vectorized pass.
+
+    Rows are kept densely packed: removing a pet swaps the last row into its
+    slot, so inserts, updates and deletes are O(1) and scoring never has to
+    skip holes.
+    """
+
+    def __init__(self, initial_capacity: int = 1024):
+        self._matrix = np.zeros((initial_capacity, len(TRAIT_KEYS)), dtype=np.int16)
+        self._ids = np.empty(initial_capacity, dtype=object)
+        self._ordinals = np.full(initial_capacity, -1, dtype=np.int64)
+        self._rows: Dict[str, int] = {}
+        self.loaded_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, pet_id: str) -> bool:
+        return pet_id in self._rows
+
+    def is_stale(self, max_age: float) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > max_age
+
+    def load(self, pets: Iterable[dict]) -> None:
+        """Replace the whole matrix with the given pets (dicts with id, ordinal and personality_traits)"""
+        self._rows = {}
+        for pet in pets:
+            self.upsert(pet['id'], pet['personality_traits'], pet.get('ordinal'))
+        self.loaded_at = time.monotonic()
+
+    def ordinal_of(self, pet_id: str) -> Optional[int]:
+        row = self._rows.get(pet_id)
+        if row is None or self._ordinals[row] < 0:
+            return None
+        return int(self._ordinals[row])
+
+    def upsert(self, pet_id: str, traits: dict, ordinal: Optional[int] = None) -> None:
+        row = self._rows.get(pet_id)
+        if row is None:
+            row = len(self._rows)
+            if row == self._matrix.shape[0]:
+                capacity = max(row * 2, 1)
+                matrix = np.zeros((capacity, len(TRAIT_KEYS)), dtype=np.int16)
+                matrix[:row] = self._matrix[:row]
+                ids = np.empty(capacity, dtype=object)
+                ids[:row] = self._ids[:row]
+                ordinals = np.full(capacity, -1, dtype=np.int64)
+                ordinals[:row] = self._ordinals[:row]
+                self._matrix, self._ids, self._ordinals = matrix, ids, ordinals
+            self._ids[row] = pet_id
+            self._rows[pet_id] = row
+        self._matrix[row] = traits_vector(traits)
+        self._ordinals[row] = -1 if ordinal is None else ordinal
+
+    def remove(self, pet_id: str) -> None:
+        row = self._rows.pop(pet_id, None)
+        if row is None:
+            return
+        last = len(self._rows)
+        if row != last:
+            moved_id = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            self._ordinals[row] = self._ordinals[last]
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+        self._ids[last] = None
+
+    def vectors(self, pet_ids: Iterable[str]) -> Tuple[List[str], np.ndarray]:
+        """Trait rows of the given pets that are currently ranked, with their ids"""
+        found = [pet_id for pet_id in pet_ids if pet_id in self._rows]
+        return found, self._matrix[[self._rows[pet_id] for pet_id in found]]
+
+    def scores(self, traits: dict) -> np.ndarray:
+        """Compatibility score of the given traits against every pet, in row order"""
+        distances = np.abs(self._matrix[:len(self._rows)] - traits_vector(traits)).sum(axis=1)
+        return similarity_scores(distances)
+
+    def rank(self, traits: dict, seen=None, limit: int = 100,
+             min_score: Optional[float] = None,
+             after: Optional[Tuple[float, str]] = None) -> List[Tuple[str, float]]:
+        """Return up to `limit` (pet_id, score) pairs sorted by descending score, then pet_id.
+
+        `seen` is a SeenBitmap of ordinals to skip. `after` is the
+        (score, pet_id) of the last pet of the previous page; only pets ranked
+        strictly after it are returned.
+        """
+        size = len(self._rows)
+        if not size or limit <= 0:
+            return []
+
+        scores = self.scores(traits)
+        ids = self._ids[:size]
+        mask = np.ones(size, dtype=bool)
+        if min_score is not None:
+            mask &= scores >= min_score
+        if seen is not None:
+            mask &= ~seen.mask(self._ordinals[:size])
+        if after is not None:
+            after_score, after_id = after
+            keep = scores < after_score
+            ties = np.flatnonzero(scores == after_score)
+            keep[ties] = ids[ties] > after_id
+            mask &= keep
+        candidates = np.flatnonzero(mask)
+
+        if len(candidates) > limit:
+            # Partial selection first so sorting cost depends on the page size only;
+            # every pet tied with the boundary score is kept for the id tie-break
+            candidate_scores = scores[candidates]
+            boundary = -np.partition(-candidate_scores, limit - 1)[limit - 1]
+            candidates = candidates[candidate_scores >= boundary]
+        order = np.lexsort((ids[candidates], -scores[candidates]))[:limit]
+        return [(ids[i], float(scores[i])) for i in candidates[order]]
+
+
+def score_for_distance(distance: int) -> float:
+    return round((1 - distance / MAX_TOTAL_DIFF) * 100, 2)
+
+
+def max_distance_for_score(min_score: float) -> int:
+    """Largest L1 distance whose score still reaches min_score"""
+    return int((1 - min_score / 100) * MAX_TOTAL_DIFF + 1e-9)
+
+
+class TraitGridIndex:
+    """Exact nearest-pet index over the 6-D trait lattice.
+
+    Pets with identical traits share a bucket, and buckets are grouped into
+    coarse grid cells of `cell_width` values per trait. A query visits cells
+    in order of their lower-bound distance and stops as soon as the next cell
+    cannot beat the k-th best pet found so far, so only the neighbourhood of
+    the adopter is scanned.
+    """
+
+    def __init__(self, cell_width: int = 3):
+        self.cell_width = cell_width
+        self._vectors: Dict[str, Tuple[int, ...]] = {}
+        self._ordinals: Dict[str, Optional[int]] = {}
+        self._buckets: Dict[Tuple[int, ...], Dict[str, None]] = {}
+        self._cells: Dict[Tuple[int, ...], Set[Tuple[int, ...]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def load(self, pets: Iterable[dict]) -> None:
+        self._vectors = {}
+        self._ordinals = {}
+        self._buckets = {}
+        self._cells = {}
+        for pet in pets:
+            self.upsert(pet['id'], pet['personality_traits'], pet.get('ordinal'))
+
+    def _cell_of(self, vector: Tuple[int, ...]) -> Tuple[int, ...]:
+        return tuple((value - 1) // self.cell_width for value in vector)
+
+    def upsert(self, pet_id: str, traits: dict, ordinal: Optional[int] = None) -> None:
+        vector = tuple(int(traits[key]) for key in TRAIT_KEYS)
+        self._ordinals[pet_id] = ordinal
+        if self._vectors.get(pet_id) == vector:
+            return
+        self.remove(pet_id)
+        self._vectors[pet_id] = vector
+        self._ordinals[pet_id] = ordinal
+        bucket = self._buckets.get(vector)
+        if bucket is None:
+            bucket = self._buckets[vector] = {}
+            self._cells.setdefault(self._cell_of(vector), set()).add(vector)
+        bucket[pet_id] = None
+
+    def remove(self, pet_id: str) -> None:
+        vector = self._vectors.pop(pet_id, None)
+        self._ordinals.pop(pet_id, None)
+        if vector is None:
+            return
+        bucket = self._buckets[vector]
+        del bucket[pet_id]
+        if not bucket:
+            del self._buckets[vector]
+            cell = self._cell_of(vector)
+            self._cells[cell].discard(vector)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+    def _cell_lower_bound(self, cell: Tuple[int, ...], query: Tuple[int, ...]) -> int:
+        bound = 0
+        for index, value in zip(cell, query):
+            low = index * self.cell_width + 1
+            high = low + self.cell_width - 1
+            if value < low:
+                bound += low - value
+            elif value > high:
+                bound += value - high
+        return bound
+
+    def nearest(self, traits: dict, k: int, min_score: float = 0, seen=None) -> List[Tuple[str, float]]:
+        """Return up to k (pet_id, score) pairs scoring at least min_score, best first.
+
+        Pets whose ordinal is in the `seen` bitmap are skipped.
+        """
+        if k <= 0:
+            return []
+        query = tuple(int(traits[key]) for key in TRAIT_KEYS)
+        max_distance = max_distance_for_score(min_score)
+
+        cells = []
+        for cell in self._cells:
+            bound = self._cell_lower_bound(cell, query)
+            if bound <= max_distance:
+                cells.append((bound, cell))
+        cells.sort()
+
+        found: List[Tuple[int, str]] = []
+        for bound, cell in cells:
+            if len(found) >= k:
+                found.sort()
+                del found[k:]
+                if bound > found[-1][0]:
+                    break
+            for vector in self._cells[cell]:
+                distance = sum(abs(a - b) for a, b in zip(vector, query))
+                if distance > max_distance:
+                    continue
+                unseen = (
+                    pet_id for pet_id in self._buckets[vector]
+                    if seen is None or self._ordinals[pet_id] not in seen
+                )
+                # Tied pets are broken by id, as in CompatibilityRanker.rank
+                found.extend((distance, pet_id) for pet_id in heapq.nsmallest(k, unseen))
+
+        found.sort()
+        return [(pet_id, score_for_distance(distance)) for distance, pet_id in found[:k]]
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from pymongo import UpdateOne
+
+from ranking import CompatibilityRanker, similarity_scores, traits_vector
+from seen import SeenBitmap
+
+logger = logging.getLogger(__name__)
+
+SCAN_CHUNK = 5000  # Adopters scored against changed pets per numpy pass
+PET_CHUNK = 256  # Changed pets per pass, so a bulk import keeps each pass small
+WRITE_CHUNK = 1000
+
+
+class RecommendationMaterializer:
+    """Keeps every adopter's top-N compatible pets in a collection.
+
+    Writes only mark adopters or pets as changed. A background task waits
+    `debounce` seconds after the first mark and then handles everything
+    marked meanwhile in a single batch: changed adopters are re-ranked, and
+    changed pets are scored against all adopters at once so only adopters
+    whose list can actually change get re-ranked.
+
+    Each document stores the adopter's trait vector and the score of its
+    last entry (`min_score`), which is all the batch needs to decide that.
+    Lists leave out pets the adopter already swiped, so a rebuild after the
+    swipes used a list up brings in the next pets.
+    """
+
+    def __init__(
+        self,
+        collection,
+        users,
+        ranker: CompatibilityRanker,
+        prepare: Callable[[], Awaitable[None]],
+        seen: Callable[[List[str]], Awaitable[Dict[str, SeenBitmap]]],
+        top_n: int = 100,
+        debounce: float = 2.0
+    ):
+        self.collection = collection
+        self.users = users
+        self.ranker = ranker
+        self.prepare = prepare
+        self.seen = seen
+        self.top_n = top_n
+        self.debounce = debounce
+        self.batches = 0
+        self.recomputed = 0
+        self.last_batch_seconds: Optional[float] = None
+        self._dirty_pets: Set[str] = set()
+        self._dirty_users: Set[str] = set()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def pet_changed(self, pet_id: str):
+        self._dirty_pets.add(pet_id)
+        self._wake.set()
+
+    def user_changed(self, user_id: str):
+        self._dirty_users.add(user_id)
+        self._wake.set()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            # Let a burst of edits accumulate into one batch
+            await asyncio.sleep(self.debounce)
+            self._wake.clear()
+            pet_ids, user_ids = self._dirty_pets, self._dirty_users
+            self._dirty_pets, self._dirty_users = set(), set()
+            try:
+                await self.process(pet_ids, user_ids)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error actualizando recomendaciones, se reintentará")
+                self._dirty_pets |= pet_ids
+                self._dirty_users |= user_ids
+                self._wake.set()
+                await asyncio.sleep(1)
+
+    async def process(self, pet_ids: Set[str], user_ids: Set[str]):
+        started = time.perf_counter()
+        await self.prepare()
+        affected = set(user_ids)
+        if pet_ids:
+            affected |= await self._affected_by_pets(pet_ids)
+        if affected:
+            await self._recompute(affected)
+        self.batches += 1
+        self.last_batch_seconds = round(time.perf_counter() - started, 4)
+
+    async def _affected_by_pets(self, pet_ids: Set[str]) -> Set[str]:
+        """Adopters whose top-N may change because of the given pets"""
+        # Holders: the pet changed, left or got adopted while in their list
+        affected = {
+            doc['user_id']
+            async for doc in self.collection.find({'pet_ids': {'$in': list(pet_ids)}}, {'_id': 0, 'user_id': 1})
+        }
+
+        # Candidates: an available changed pet now scores at least their current cut-off
+        _, vectors = self.ranker.vectors(pet_ids)
+        if not len(vectors):
+            return affected
+        chunk: List[dict] = []
+        async for doc in self.collection.find({}, {'_id': 0, 'user_id': 1, 'traits': 1, 'min_score': 1}):
+            chunk.append(doc)
+            if len(chunk) == SCAN_CHUNK:
+                affected |= self._candidates(chunk, vectors)
+                chunk = []
+        if chunk:
+            affected |= self._candidates(chunk, vectors)
+        return affected
+
+    @staticmethod
+    def _candidates(docs: List[dict], vectors: np.ndarray) -> Set[str]:
+        traits = np.array([doc['traits'] for doc in docs], dtype=np.int16)
+        cutoffs = np.array([doc['min_score'] for doc in docs], dtype=np.float64)
+        hits = np.zeros(len(docs), dtype=bool)
+        for start in range(0, len(vectors), PET_CHUNK):
+            distances = np.abs(traits[:, None, :] - vectors[None, start:start + PET_CHUNK, :]).sum(axis=2)
+            hits |= (similarity_scores(distances) >= cutoffs[:, None]).any(axis=1)
+        return {docs[i]['user_id'] for i in np.flatnonzero(hits)}
+
+    async def _recompute(self, user_ids: Iterable[str]):
+        users = self.users.find(
+            {'id': {'$in': list(user_ids)}, 'user_type': 'adopter', 'personality_traits': {'$ne': None}},
+            {'_id': 0, 'id': 1, 'personality_traits': 1}
+        )
+        chunk: List[dict] = []
+        async for user in users:
+            chunk.append(user)
+            if len(chunk) == WRITE_CHUNK:
+                await self._write(chunk)
+                chunk = []
+        if chunk:
+            await self._write(chunk)
+
+    async def _write(self, users: List[dict]):
+        """Rebuild and store the lists of a chunk of adopters, reading their seen bitmaps together"""
+        seen = await self.seen([user['id'] for user in users])
+        requests = [
+            UpdateOne(
+                {'user_id': user['id']},
+                {'$set': self.build(user['personality_traits'], seen.get(user['id']))},
+                upsert=True
+            )
+            for user in users
+        ]
+        await self.collection.bulk_write(requests, ordered=False)
+        self.recomputed += len(requests)
+
+    def build(self, traits: dict, seen: Optional[SeenBitmap] = None) -> dict:
+        """Recommendation document fields for an adopter with the given traits and swipes"""
+        ranked = self.ranker.rank(traits, seen=seen, limit=self.top_n)
+        return {
+            'traits': traits_vector(traits).tolist(),
+            'pets': [
+                {'id': pet_id, 'score': score, 'ordinal': self.ranker.ordinal_of(pet_id)}
+                for pet_id, score in ranked
+            ],
+            'pet_ids': [pet_id for pet_id, _ in ranked],
+            # A list that is not full takes any new pet
+            'min_score': ranked[-1][1] if len(ranked) == self.top_n else 0.0,
+            'updated_at': datetime.now(timezone.utc),
+        }
+
+    def stats(self) -> dict:
+        return {
+            'top_n': self.top_n,
+            'debounce': self.debounce,
+            'pending_pets': len(self._dirty_pets),
+            'pending_users': len(self._dirty_users),
+            'batches': self.batches,
+            'recomputed': self.recomputed,
+            'last_batch_seconds': self.last_batch_seconds,
+        }
@@ -0,0 +1,150 @@
+"""Versioned response cache for per-user list endpoints.
+
+Every cached list belongs to a scope such as ('pets', foundation_id), and
+each scope has a version. Writes bump the versions of the scopes they
+change. A response is stored under its path, user, scope version and query
+string, and its ETag is derived from the same key. A revalidation whose
+ETag still matches can therefore be answered with 304 after a single
+version lookup, without touching MongoDB. Stale entries are never served
+because a bump changes every key. They simply age out.
+
+Versions start from a nanosecond timestamp rather than zero. A restarted
+process or a flushed Redis therefore never reissues an ETag a client may
+still hold for older data. For the same reason the memory backend may evict
+versions like bodies: a scope that comes back starts from a fresh timestamp.
+"""
+import hashlib
+import math
+import time
+from typing import Optional, Tuple
+
+from cache import TTLCache
+
+Scope = Tuple[str, str]
+
+
+class MemoryCacheBackend:
+    """Per-process versions and bodies; other workers learn of bumps through `ResponseCache.apply_bump`"""
+
+    shared = False
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._versions = TTLCache(maxsize, float('inf'))
+        self._bodies = TTLCache(maxsize, float('inf'))
+
+    async def version(self, key: str) -> int:
+        version = self._versions.get(key)
+        if version is None:
+            version = time.time_ns()
+            self._versions.set(key, version)
+        return version
+
+    async def bump(self, keys):
+        self.bump_now(keys)
+
+    def bump_now(self, keys):
+        for key in keys:
+            version = self._versions.get(key)
+            # An evicted scope already starts over from a fresh timestamp
+            if version is not None:
+                self._versions.set(key, version + 1)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._bodies.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._bodies.set(key, value, ttl)
+
+
+class RedisCacheBackend:
+    """Shares versions and bodies between workers through Redis or any server speaking its protocol"""
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = 'tinderpets:cache:'):
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    async def version(self, key: str) -> int:
+        name = f'{self.prefix}v:{key}'
+        value = await self._redis.get(name)
+        if value is None:
+            await self._redis.set(name, time.time_ns(), nx=True)
+            value = await self._redis.get(name)
+        return int(value)
+
+    async def bump(self, keys):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                name = f'{self.prefix}v:{key}'
+                # Never let a bump restart a missing version from 1
+                pipe.set(name, time.time_ns(), nx=True)
+                pipe.incr(name)
+            await pipe.execute()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._redis.get(f'{self.prefix}r:{key}')
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self._redis.set(f'{self.prefix}r:{key}', value, ex=max(1, math.ceil(ttl)))
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.bumps = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def key(self, scope: Scope, path: str, user_id: str, variant: str) -> str:
+        version = await self.backend.version(':'.join(scope))
+        return f'{path}|{user_id}|{version}|{variant}'
+
+    @staticmethod
+    def etag(key: str) -> str:
+        return '"' + hashlib.sha1(key.encode('utf-8')).hexdigest() + '"'
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        """Cached body and X-Next-Cursor value"""
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Cursors are base64url, so the first newline always ends the header
+        cursor, body = value.split(b'\n', 1)
+        return body, cursor.decode('ascii') or None
+
+    async def set(self, key: str, body: bytes, next_cursor: Optional[str]):
+        await self.backend.set(key, (next_cursor or '').encode('ascii') + b'\n' + body, self.ttl)
+
+    async def bump(self, *scopes: Scope):
+        if self.enabled and scopes:
+            self.bumps += len(scopes)
+            await self.backend.bump({':'.join(scope) for scope in scopes})
+
+    def apply_bump(self, scopes):
+        """Bump versions another worker bumped in its own per-process backend"""
+        if self.enabled and not self.backend.shared:
+            self.backend.bump_now({':'.join(scope) for scope in scopes})
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'bumps': self.bumps,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,140 @@
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from bson.int64 import Int64
+
+from cache import TTLCache
+
+WORD_BITS = 32  # Persisted word size; stored as int64 so $bit never overflows
+
+
+class SeenBitmap:
+    """Compact bitset of the pet ordinals an adopter already swiped.
+
+    Bit `n` lives in byte n >> 3 at position n & 7, i.e. the little-endian
+    layout of the persisted 32-bit words, so loading is a straight copy.
+    """
+
+    __slots__ = ('_bytes',)
+
+    def __init__(self):
+        self._bytes = bytearray()
+
+    def __contains__(self, ordinal) -> bool:
+        if ordinal is None:
+            return False
+        index = ordinal >> 3
+        return index < len(self._bytes) and bool(self._bytes[index] & (1 << (ordinal & 7)))
+
+    def add(self, ordinal: int):
+        index = ordinal >> 3
+        if index >= len(self._bytes):
+            self._bytes.extend(bytes(index + 1 - len(self._bytes)))
+        self._bytes[index] |= 1 << (ordinal & 7)
+
+    def set_word(self, word_index: int, value: int):
+        start = word_index * (WORD_BITS // 8)
+        end = start + WORD_BITS // 8
+        if end > len(self._bytes):
+            self._bytes.extend(bytes(end - len(self._bytes)))
+        chunk = int.from_bytes(self._bytes[start:end], 'little') | (value & 0xFFFFFFFF)
+        self._bytes[start:end] = chunk.to_bytes(WORD_BITS // 8, 'little')
+
+    def mask(self, ordinals: np.ndarray) -> np.ndarray:
+        """Vectorized membership test for an array of ordinals"""
+        bits = np.unpackbits(np.frombuffer(bytes(self._bytes), dtype=np.uint8), bitorder='little')
+        seen = np.zeros(len(ordinals), dtype=bool)
+        # Pets without an ordinal are stored as -1 and never count as seen
+        in_range = (ordinals >= 0) & (ordinals < len(bits))
+        seen[in_range] = bits[ordinals[in_range]].astype(bool)
+        return seen
+
+
+def word_updates(ordinals: Iterable[int]) -> Dict[str, dict]:
+    """Build a $bit update that ORs the given ordinals into the persisted words"""
+    words: Dict[int, int] = {}
+    for ordinal in ordinals:
+        words[ordinal // WORD_BITS] = words.get(ordinal // WORD_BITS, 0) | (1 << (ordinal % WORD_BITS))
+    return {f'words.{index}': {'or': Int64(value)} for index, value in words.items()}
+
+
+class SeenStore:
+    """Per-adopter seen bitmaps, cached in memory and persisted as 32-bit words.
+
+    Swipes OR bits into the persisted document with $bit, so concurrent
+    writers (or other workers) never lose each other's updates. A missing
+    document is rebuilt once from the adopter's swipe history.
+    """
+
+    def __init__(self, collection, maxsize: int, ttl: float):
+        self.collection = collection
+        self.cache = TTLCache(maxsize, ttl)
+
+    async def get(self, user_id: str, history: Callable[[], Awaitable[Iterable[int]]]) -> SeenBitmap:
+        bitmap = self.cache.get(user_id)
+        if bitmap is not None:
+            return bitmap
+
+        doc = await self.collection.find_one({'user_id': user_id}, {'_id': 0, 'words': 1})
+        if doc is not None:
+            bitmap = self._from_doc(doc)
+        else:
+            bitmap = SeenBitmap()
+            ordinals = self._merge(bitmap, await history())
+            update = {'$set': {'user_id': user_id}}
+            if ordinals:
+                update['$bit'] = word_updates(ordinals)
+            await self.collection.update_one({'user_id': user_id}, update, upsert=True)
+            # A swipe recorded between the history read and the upsert found no
+            # document for its $bit (add() never upserts), so read history again
+            late = self._merge(bitmap, await history())
+            if late:
+                await self.collection.update_one({'user_id': user_id}, {'$bit': word_updates(late)})
+
+        self.cache.set(user_id, bitmap)
+        return bitmap
+
+    @staticmethod
+    def _merge(bitmap: SeenBitmap, ordinals: Iterable[Optional[int]]) -> List[int]:
+        """Add the ordinals missing from `bitmap` and return them"""
+        added = []
+        for ordinal in ordinals:
+            if ordinal is not None and ordinal not in bitmap:
+                bitmap.add(ordinal)
+                added.append(ordinal)
+        return added
+
+    async def load_many(self, user_ids: List[str]) -> Dict[str, SeenBitmap]:
+        """Persisted bitmaps of many adopters in one query, bypassing the cache.
+
+        Meant for batch jobs: reading past the cache keeps them from evicting
+        active adopters. Adopters without a persisted bitmap are left out.
+        """
+        return {
+            doc['user_id']: self._from_doc(doc)
+            async for doc in self.collection.find({'user_id': {'$in': user_ids}}, {'_id': 0, 'user_id': 1, 'words': 1})
+        }
+
+    @staticmethod
+    def _from_doc(doc: dict) -> SeenBitmap:
+        bitmap = SeenBitmap()
+        for index, value in doc.get('words', {}).items():
+            bitmap.set_word(int(index), value)
+        return bitmap
+
+    def mark(self, user_id: str, ordinals: Iterable[int]):
+        """Record swipes in the cached bitmap only, e.g. ones another worker already persisted"""
+        bitmap = self.cache.get(user_id)
+        if bitmap is not None:
+            for ordinal in ordinals:
+                bitmap.add(ordinal)
+
+    async def add(self, user_id: str, ordinals: Iterable[int]):
+        ordinals = list(ordinals)
+        if not ordinals:
+            return
+        self.mark(user_id, ordinals)
+        # No upsert: without a persisted document the next get() rebuilds the
+        # bitmap from history, which already includes these swipes (a rebuild
+        # under way reads history again once its upsert is done)
+        await self.collection.update_one({'user_id': user_id}, {'$bit': word_updates(ordinals)})
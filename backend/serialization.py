@@ -0,0 +1,60 @@
+import json
+from datetime import datetime
+from typing import Any, Type
+
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # Falls back to the stdlib encoder
+    orjson = None
+
+
+def _default(value: Any):
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, datetime):
+        # Same format pydantic emits for UTC datetimes
+        return value.isoformat().replace('+00:00', 'Z')
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    """Serializes trusted content directly, without jsonable_encoder or response_model validation"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class TrustedShape:
+    """Shapes documents already trusted from Mongo like a response model, without validating them.
+
+    The projection drops stored fields the model does not expose and the
+    defaults fill fields older documents lack, which is all response_model
+    validation changes on data the API wrote itself.
+    """
+
+    def __init__(self, model: Type[BaseModel]):
+        self.fields = tuple(model.model_fields)
+        self.projection = {'_id': 0, **{name: 1 for name in self.fields}}
+        self.defaults = {
+            name: field.default
+            for name, field in model.model_fields.items()
+            if not field.is_required() and field.default_factory is None
+        }
+
+    def __call__(self, doc: dict) -> dict:
+        # Field order follows the model, like response_model output
+        defaults = self.defaults
+        return {
+            name: doc[name] if name in doc else defaults[name]
+            for name in self.fields
+            if name in doc or name in defaults
+        }
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, Header, Query, Request, Response, UploadFile, WebSocket, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -6,31 +6,173 @@ from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Literal
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Literal, Tuple, Union
 import uuid
+import time
+import base64
+import hashlib
+import hmac
 from datetime import datetime, timezone, timedelta
 import bcrypt
+from bson import ObjectId, json_util
 import jwt
+import asyncio
+
+from ranking import CompatibilityRanker, TraitGridIndex, traits_vector
+from password_pool import PasswordPool, PoolSaturatedError
+from cache import TTLCache
+from seen import SeenBitmap, SeenStore
+from recommendations import RecommendationMaterializer
+from indexes import ensure_indexes
+from pubsub import PubSubHub, LocalBackend, MongoCappedBackend, RedisBackend
+from worker_events import WorkerEvents
+from images import InvalidImageError, image_service_from_env
+from bulk import BulkFormatError, bulk_format, read_rows
+from serialization import FastJSONResponse, TrustedShape, dumps
+from instrumentation import (
+    InstrumentationMiddleware, Metrics, MongoCommandListener, current_request, timed_route_class
+)
+from profiler import SlowRequestProfiler, folded
+from response_cache import MemoryCacheBackend, RedisCacheBackend, ResponseCache
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Request instrumentation: add a Server-Timing header to every response with SERVER_TIMING=1
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+metrics = Metrics('tinderpets')
+# Bearer token Prometheus scrapes /metrics with (its `authorization` setting); unset keeps /metrics closed
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Slow request profiling (0 disables it); profiles are served to requests carrying ADMIN_TOKEN
+PROFILE_SLOW_REQUEST_MS = float(os.environ.get('PROFILE_SLOW_REQUEST_MS', '0'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', '20'))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')  # X-Admin-Token for /api/admin/* and /api/metrics
+profiler = SlowRequestProfiler(
+    PROFILE_SLOW_REQUEST_MS / 1000, PROFILE_INTERVAL_MS / 1000, PROFILE_BUFFER_SIZE
+) if PROFILE_SLOW_REQUEST_MS > 0 else None
+
+# Worker processes serving the app; gunicorn.conf.py and uvicorn --workers read the same variable
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+
+# MongoDB connection, opened by every worker at startup (see bind_database).
+# Pool limits are per worker: MongoDB sees up to WEB_CONCURRENCY * MONGO_MAX_POOL_SIZE connections
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+MONGO_POOL_OPTIONS = {
+    'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+    'connectTimeoutMS': int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '20000')),
+    'serverSelectionTimeoutMS': int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '30000')),
+}
+# Unset means no limit
+for option, variable in (
+    ('maxIdleTimeMS', 'MONGO_MAX_IDLE_TIME_MS'),
+    ('waitQueueTimeoutMS', 'MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+    ('socketTimeoutMS', 'MONGO_SOCKET_TIMEOUT_MS'),
+):
+    if os.environ.get(variable):
+        MONGO_POOL_OPTIONS[option] = int(os.environ[variable])
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
 # JWT configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24 * 7  # 7 days
 
+# Pagination configuration
+# Without ?limit= a page holds as many rows as the lists returned before they were paginated,
+# so clients that never read X-Next-Cursor see everything they used to
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 1000
+CHAT_PAGE_SIZE = 50
+
+# Feed ranking configuration
+FEED_SIZE = 100
+MATCH_THRESHOLD = 70  # Minimum compatibility score for a match
+RANKER_RESYNC_SECONDS = float(os.environ.get('RANKER_RESYNC_SECONDS', '300'))
+
+# Materialized recommendations: top-N pets kept per adopter, refreshed in debounced batches
+RECOMMENDATION_SIZE = int(os.environ.get('RECOMMENDATION_SIZE', '100'))
+RECOMMENDATION_DEBOUNCE_SECONDS = float(os.environ.get('RECOMMENDATION_DEBOUNCE_SECONDS', '2'))
+
+# Password hashing pool configuration; workers share the cores, so each gets its slice
+PASSWORD_POOL_WORKERS = int(os.environ.get(
+    'PASSWORD_POOL_WORKERS', max(1, min(4, (os.cpu_count() or 1) // WEB_CONCURRENCY))
+))
+PASSWORD_POOL_MAX_QUEUE = int(os.environ.get('PASSWORD_POOL_MAX_QUEUE', '64'))
+
+# Authenticated user cache configuration (size 0 disables a cache)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+
+# Match authorization cache configuration
+MATCH_ACCESS_CACHE_SIZE = int(os.environ.get('MATCH_ACCESS_CACHE_SIZE', '10000'))
+MATCH_ACCESS_TTL_SECONDS = float(os.environ.get('MATCH_ACCESS_TTL_SECONDS', '30'))
+
+# Swipe recording: pet traits cached per worker, and the most swipes a client may flush at once
+PET_TRAIT_CACHE_SIZE = int(os.environ.get('PET_TRAIT_CACHE_SIZE', '50000'))
+PET_TRAIT_CACHE_TTL_SECONDS = float(os.environ.get('PET_TRAIT_CACHE_TTL_SECONDS', '300'))
+SWIPE_BATCH_MAX = int(os.environ.get('SWIPE_BATCH_MAX', '100'))
+
+# Pub/sub for chat pushes and worker cache events: 'local' for a single process,
+# 'mongo' or 'redis' to share events between workers
+PUBSUB_BACKEND = os.environ.get('PUBSUB_BACKEND', 'local')
+PUBSUB_REDIS_URL = os.environ.get('PUBSUB_REDIS_URL', 'redis://localhost:6379/0')
+PUBSUB_QUEUE_SIZE = int(os.environ.get('PUBSUB_QUEUE_SIZE', '100'))
+
+# Swiped-pets bitmap cache configuration
+SEEN_CACHE_SIZE = int(os.environ.get('SEEN_CACHE_SIZE', '10000'))
+SEEN_CACHE_TTL_SECONDS = float(os.environ.get('SEEN_CACHE_TTL_SECONDS', '300'))
+
+# Bulk pet import and status update limits
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', '5000'))
+BULK_MAX_ROW_BYTES = int(os.environ.get('BULK_MAX_ROW_BYTES', 8 * 1024 * 1024))  # Room for a few base64 images
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '500'))
+
+# Per-user list response cache: 'memory' (per worker, invalidated through pub/sub), 'redis' (shared) or 'off'
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '10000'))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '300'))
+
 security = HTTPBearer()
+password_pool = PasswordPool(PASSWORD_POOL_WORKERS, PASSWORD_POOL_MAX_QUEUE)
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+token_cache = TTLCache(TOKEN_CACHE_SIZE, JWT_EXPIRATION_HOURS * 3600)
+match_access_cache = TTLCache(MATCH_ACCESS_CACHE_SIZE, MATCH_ACCESS_TTL_SECONDS)
+pet_trait_cache = TTLCache(PET_TRAIT_CACHE_SIZE, PET_TRAIT_CACHE_TTL_SECONDS)
+image_service = image_service_from_env()
+response_cache = ResponseCache(
+    RedisCacheBackend(RESPONSE_CACHE_REDIS_URL) if RESPONSE_CACHE_BACKEND == 'redis'
+    else MemoryCacheBackend(RESPONSE_CACHE_SIZE) if RESPONSE_CACHE_BACKEND == 'memory'
+    else None,
+    RESPONSE_CACHE_TTL_SECONDS
+)
+# The configured backend is attached together with the database in bind_database
+chat_hub = PubSubHub(LocalBackend(), queue_size=PUBSUB_QUEUE_SIZE)
+worker_events = WorkerEvents(chat_hub)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open this worker's database client and background tasks, and close them on shutdown"""
+    await startup_tasks()
+    try:
+        yield
+    finally:
+        await shutdown_tasks()
 
 # Create the main app
-app = FastAPI()
-api_router = APIRouter(prefix="/api")
+app = FastAPI(lifespan=lifespan)
+# Routes time FastAPI's validation and serialization of their requests as 'pydantic'
+api_router = APIRouter(prefix="/api", route_class=timed_route_class(metrics))
 
 # ==================== MODELS ====================
 
@@ -82,7 +224,7 @@ class PetCreate(BaseModel):
     breed: str
     age: int = Field(ge=0)
     personality_traits: PersonalityTraits
-    images: List[str] = []  # URLs or base64
+    images: List[str] = []  # URLs or base64, bare or as data URLs (stored in the image store on write)
 
 class Pet(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -93,9 +235,13 @@ class Pet(BaseModel):
     age: int
     personality_traits: PersonalityTraits
     images: List[str] = []
+    thumbnails: List[str] = []
     status: Literal['available', 'adopted'] = 'available'
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class RankedPet(Pet):
+    match_score: Optional[float] = None
+
 class PetUpdate(BaseModel):
     name: Optional[str] = None
     breed: Optional[str] = None
@@ -104,10 +250,17 @@ class PetUpdate(BaseModel):
     images: Optional[List[str]] = None
     status: Optional[Literal['available', 'adopted']] = None
 
+class PetBulkStatusUpdate(BaseModel):
+    pet_ids: List[str] = Field(min_length=1, max_length=BULK_MAX_ROWS)
+    status: Literal['available', 'adopted']
+
 class MatchCreate(BaseModel):
     pet_id: str
     action: Literal['like', 'pass']
 
+class SwipeBatch(BaseModel):
+    swipes: List[MatchCreate] = Field(min_length=1, max_length=SWIPE_BATCH_MAX)
+
 class Match(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -133,6 +286,10 @@ class Appointment(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ChatMessage(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    # ObjectId strings grow within a process, so messages sharing a
+    # millisecond timestamp still sort in the order they were sent
+    id: str = Field(default_factory=lambda: str(ObjectId()))
     sender_id: str
     sender_type: Literal['user', 'foundation']
     message: str
@@ -148,6 +305,48 @@ class Chat(BaseModel):
     messages: List[ChatMessage] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ChatPage(Chat):
+    before_cursor: Optional[str] = None  # Fetch older messages with ?before=
+    after_cursor: Optional[str] = None  # Poll newer messages with ?after=
+
+# Compact list items returned with ?view=card
+
+class PetCard(BaseModel):
+    id: str
+    name: str
+    breed: str
+    age: int
+    thumbnail: Optional[str] = None
+    match_score: Optional[float] = None
+
+class UserCard(BaseModel):
+    id: str
+    name: str
+    email: str
+
+class MatchCard(BaseModel):
+    id: str
+    pet_id: str
+    user_id: str
+    match_score: float
+    status: str
+    created_at: datetime
+    pet: Optional[PetCard] = None
+    user: Optional[UserCard] = None
+
+class AppointmentCard(BaseModel):
+    id: str
+    match_id: str
+    date: str
+    time: str
+    status: str
+    pet: Optional[PetCard] = None
+    user: Optional[UserCard] = None
+
+# List items of the pet routes: full documents, cards (view=card) or sparse fieldsets (fields=)
+PetListItem = Union[Pet, PetCard, Dict[str, Any]]
+RankedPetListItem = Union[RankedPet, PetCard, Dict[str, Any]]
+
 # ==================== UTILITIES ====================
 
 def hash_password(password: str) -> str:
@@ -156,6 +355,18 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+async def run_password_job(operation: str, func, *args):
+    """Run bcrypt work on the password pool, shedding load with 429 when it is full"""
+    try:
+        with metrics.timed('bcrypt'):
+            return await password_pool.run(operation, func, *args)
+    except PoolSaturatedError:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiadas solicitudes, intenta de nuevo en unos segundos",
+            headers={'Retry-After': '1'}
+        )
+
 def create_token(user_id: str, email: str) -> str:
     payload = {
         'user_id': user_id,
@@ -164,19 +375,43 @@ def create_token(user_id: str, email: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+async def authenticate_token(token: str) -> dict:
+    """Resolve a JWT into its user document, raising 401 when it is not valid"""
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user = await db.users.find_one({'id': payload['user_id']}, {'_id': 0, 'password_hash': 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="Usuario no encontrado")
-        return user
+        payload = token_cache.get(token)
+        if payload is None:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            # Never keep a decoded token past its own expiration
+            token_cache.set(token, payload, ttl=payload['exp'] - time.time())
+        
+        user = user_cache.get(payload['user_id'])
+        if user is None:
+            user = await db.users.find_one({'id': payload['user_id']}, {'_id': 0, 'password_hash': 0})
+            if not user:
+                raise HTTPException(status_code=401, detail="Usuario no encontrado")
+            user_cache.set(payload['user_id'], user)
+        return dict(user)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expirado")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Token inválido")
 
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    user = await authenticate_token(credentials.credentials)
+    stats = current_request.get()
+    if stats is not None:
+        stats.user_type = user['user_type']
+    return user
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="No autorizado")
+
+async def require_metrics_token(authorization: Optional[str] = Header(None)):
+    token = authorization[7:] if authorization and authorization.lower().startswith('bearer ') else None
+    if not METRICS_TOKEN or not token or not hmac.compare_digest(token, METRICS_TOKEN):
+        raise HTTPException(status_code=403, detail="No autorizado")
+
 def calculate_compatibility(traits1: PersonalityTraits, traits2: PersonalityTraits) -> float:
     """Calculate personality compatibility score (0-100)"""
     traits1_dict = traits1.model_dump()
@@ -194,25 +429,433 @@ def calculate_compatibility(traits1: PersonalityTraits, traits2: PersonalityTrai
     similarity = (1 - (total_diff / max_possible_diff)) * 100
     return round(similarity, 2)
 
+# Extended JSON keeps datetime sort keys typed inside cursors
+CURSOR_JSON_OPTIONS = json_util.JSONOptions(tz_aware=True, tzinfo=timezone.utc)
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Decode an opaque cursor back into its sort key values"""
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)), json_options=CURSOR_JSON_OPTIONS)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    # Only plain sort key types; anything else could smuggle BSON types into queries
+    if not all(isinstance(value, (str, int, float, datetime)) and not isinstance(value, bool) for value in values):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return values
+
+def keyset_filter(sort: List[Tuple[str, int]], values: list) -> dict:
+    """Match documents that come strictly after `values` in the given sort order"""
+    clauses = []
+    for position, (field, direction) in enumerate(sort):
+        clause = {prev_field: value for (prev_field, _), value in zip(sort[:position], values)}
+        clause[field] = {'$gt' if direction == 1 else '$lt': values[position]}
+        clauses.append(clause)
+    return {'$or': clauses}
+
+def paginated_query(query: dict, sort: List[Tuple[str, int]], cursor: Optional[str]) -> dict:
+    if not cursor:
+        return query
+    return {'$and': [query, keyset_filter(sort, decode_cursor(cursor, len(sort)))]}
+
+def set_next_cursor(response: Response, docs: list, limit: int, sort: List[Tuple[str, int]]) -> list:
+    """Trim a limit+1 page to `limit` and advertise the cursor of the following page"""
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers['X-Next-Cursor'] = encode_cursor([docs[-1][field] for field, _ in sort])
+    return docs
+
+async def find_by_ids(collection, ids, projection: Optional[dict] = None) -> dict:
+    """Fetch documents for a set of ids in a single $in query, indexed by id"""
+    ids = list(ids)
+    if not ids:
+        return {}
+    docs = await collection.find({'id': {'$in': ids}}, projection or {'_id': 0}).to_list(None)
+    return {doc['id']: doc for doc in docs}
+
+async def offload_images(images: List[str]) -> dict:
+    """Move base64 images to the image store and return the images and thumbnails fields"""
+    try:
+        images = await image_service.offload(images)
+    except InvalidImageError:
+        raise HTTPException(status_code=400, detail="Imagen no válida")
+    return {'images': images, 'thumbnails': [image_service.thumbnail_url(image) for image in images]}
+
+# ==================== LIST VIEWS ====================
+
+PET_CARD_PROJECTION = {
+    '_id': 0, 'id': 1, 'name': 1, 'breed': 1, 'age': 1,
+    'thumbnails': {'$slice': 1}, 'images': {'$slice': 1}
+}
+USER_CARD_PROJECTION = {'_id': 0, 'id': 1, 'name': 1, 'email': 1}
+MATCH_CARD_PROJECTION = {'_id': 0, 'id': 1, 'pet_id': 1, 'user_id': 1, 'match_score': 1, 'status': 1, 'created_at': 1}
+
+def pet_card(pet: dict) -> PetCard:
+    # Pets stored before thumbnails existed fall back to their first image
+    thumbnail = (pet.get('thumbnails') or pet.get('images') or [None])[0]
+    return PetCard(
+        id=pet['id'],
+        name=pet['name'],
+        breed=pet['breed'],
+        age=pet['age'],
+        thumbnail=thumbnail,
+        match_score=pet.get('match_score')
+    )
+
+def user_card(user: Optional[dict]) -> Optional[UserCard]:
+    return UserCard(**user) if user else None
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[List[str]]:
+    """Parse a comma-separated sparse fieldset, rejecting unknown fields"""
+    if fields is None:
+        return None
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(unknown)}")
+    return names
+
+def list_projection(
+    view: str,
+    names: Optional[List[str]],
+    card: dict,
+    full: Optional[dict] = None,
+    keys: Iterable[str] = ()
+) -> dict:
+    """Mongo projection for a list view; `keys` are fields the endpoint itself needs, like sort keys"""
+    if names is not None:
+        projection = {'_id': 0, 'id': 1, **{name: 1 for name in names}}
+    elif view == 'card':
+        projection = dict(card)
+    elif full is not None:
+        projection = dict(full)
+    else:
+        return {'_id': 0}
+    projection.update({key: 1 for key in keys})
+    return projection
+
+def pick_fields(doc: dict, names: List[str]) -> dict:
+    return {name: doc[name] for name in ('id', *names) if name in doc}
+
+def fast_json(response: Response, content) -> FastJSONResponse:
+    """Send trusted content without response_model validation"""
+    # Returning a Response skips the injected one, so carry over its headers
+    return FastJSONResponse(content, headers=dict(response.headers))
+
+def compact_list(
+    response: Response,
+    docs: list,
+    view: str,
+    names: Optional[List[str]],
+    card: Callable
+) -> Optional[FastJSONResponse]:
+    """Build card or sparse-fieldset responses"""
+    if names is not None:
+        items = [pick_fields(doc, names) for doc in docs]
+    elif view == 'card':
+        items = [card(doc) for doc in docs]
+    else:
+        return None
+    return fast_json(response, items)
+
+# Documents written by the API are already valid, so full list views are
+# shaped by projection instead of being validated item by item
+PET_SHAPE = TrustedShape(Pet)
+RANKED_PET_SHAPE = TrustedShape(RankedPet)
+CHAT_SHAPE = TrustedShape(Chat)
+MESSAGE_SHAPE = TrustedShape(ChatMessage)
+
+# ==================== RANKING ====================
+
+pet_ranker = CompatibilityRanker()
+pet_index = TraitGridIndex()
+pet_ranker_lock = asyncio.Lock()
+seen_store: Optional[SeenStore] = None  # Created by bind_database
+
+async def next_pet_ordinals(count: int = 1) -> int:
+    """Reserve `count` consecutive pet ordinals and return the first one"""
+    counter = await db.counters.find_one_and_update(
+        {'_id': 'pet_ordinal'},
+        {'$inc': {'seq': count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter['seq'] - count
+
+async def assign_missing_pet_ordinals():
+    """Give pets created before ordinals existed their small integer id"""
+    missing = await db.pets.find({'ordinal': {'$exists': False}}, {'_id': 0, 'id': 1}).to_list(None)
+    if not missing:
+        return
+    first = await next_pet_ordinals(len(missing))
+    await db.pets.bulk_write([
+        UpdateOne({'id': pet['id'], 'ordinal': {'$exists': False}}, {'$set': {'ordinal': first + offset}})
+        for offset, pet in enumerate(missing)
+    ], ordered=False)
+
+async def ensure_ranker_loaded():
+    """Load the trait matrix on first use and resync it periodically with other workers' writes"""
+    if not pet_ranker.is_stale(RANKER_RESYNC_SECONDS):
+        return
+    async with pet_ranker_lock:
+        if not pet_ranker.is_stale(RANKER_RESYNC_SECONDS):
+            return
+        await assign_missing_pet_ordinals()
+        pets = await db.pets.find(
+            {'status': 'available'},
+            {'_id': 0, 'id': 1, 'ordinal': 1, 'personality_traits': 1}
+        ).to_list(None)
+        pet_ranker.load(pets)
+        pet_index.load(pets)
+        logger.info(f"Ranker cargado con {len(pet_ranker)} mascotas disponibles")
+
+def sync_ranker(pet: dict):
+    """Mirror a pet write into the ranker and the nearest-pet index"""
+    pet_trait_cache.invalidate(pet['id'])
+    if pet.get('status', 'available') == 'available':
+        pet_ranker.upsert(pet['id'], pet['personality_traits'], pet.get('ordinal'))
+        pet_index.upsert(pet['id'], pet['personality_traits'], pet.get('ordinal'))
+    else:
+        unindex_pet(pet['id'])
+
+def unindex_pet(pet_id: str):
+    pet_trait_cache.invalidate(pet_id)
+    pet_ranker.remove(pet_id)
+    pet_index.remove(pet_id)
+
+async def get_seen_pets(user_id: str):
+    """Bitmap of the pet ordinals this adopter already liked or passed"""
+    async def history():
+        pet_ids = {m['pet_id'] async for m in db.matches.find({'user_id': user_id}, {'_id': 0, 'pet_id': 1})}
+        pets = await find_by_ids(db.pets, pet_ids, {'_id': 0, 'id': 1, 'ordinal': 1})
+        return [pet.get('ordinal') for pet in pets.values()]
+    
+    await ensure_ranker_loaded()
+    return await seen_store.get(user_id, history)
+
+async def get_seen_pets_batch(user_ids: List[str]) -> Dict[str, SeenBitmap]:
+    """Seen bitmaps of many adopters from one query, for the recommendation batches"""
+    bitmaps = await seen_store.load_many(user_ids)
+    # Adopters that never had a bitmap persisted get theirs rebuilt from history, once
+    for user_id in user_ids:
+        if user_id not in bitmaps:
+            bitmaps[user_id] = await get_seen_pets(user_id)
+    return bitmaps
+
+# ==================== RECOMMENDATIONS ====================
+
+recommender: Optional[RecommendationMaterializer] = None  # Created by bind_database
+
+async def recommended_for(user: dict, seen, limit: int) -> List[Tuple[str, float]]:
+    """Top unseen pets from the materialized list, ranked live while it is missing or stale"""
+    traits = user['personality_traits']
+    doc = await db.recommendations.find_one({'user_id': user['id']}, {'_id': 0, 'traits': 1, 'pets': 1})
+    if doc is not None and doc['traits'] == traits_vector(traits).tolist():
+        unseen = [(pet['id'], pet['score']) for pet in doc['pets'] if pet['ordinal'] not in seen]
+        # Only a full list can have been emptied below `limit` by swipes
+        if len(unseen) >= limit or len(doc['pets']) < RECOMMENDATION_SIZE:
+            return unseen[:limit]
+        if limit <= RECOMMENDATION_SIZE:
+            # Swipes used the list up; the rebuild leaves them out and brings in the next pets
+            recommender.user_changed(user['id'])
+    else:
+        recommender.user_changed(user['id'])
+    
+    await ensure_ranker_loaded()
+    return pet_ranker.rank(traits, seen=seen, limit=limit)
+
+# ==================== RESPONSE CACHE ====================
+
+async def cached_list(
+    request: Request,
+    scope: Tuple[str, str],
+    user_id: str,
+    if_none_match: Optional[str],
+    build: Callable[[], Awaitable[Response]]
+) -> Response:
+    """Serve a per-user list from the response cache, or 304 while the client's copy is current"""
+    if not response_cache.enabled:
+        return await build()
+    
+    variant = urlencode(sorted(request.query_params.multi_items()))
+    key = await response_cache.key(scope, request.url.path, user_id, variant)
+    headers = {'ETag': response_cache.etag(key), 'Cache-Control': 'private, no-cache'}
+    if etag_matches(if_none_match, headers['ETag']):
+        response_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    
+    cached = await response_cache.get(key)
+    if cached is not None:
+        body, next_cursor = cached
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+        return Response(content=body, media_type='application/json', headers=headers)
+    
+    response = await build()
+    await response_cache.set(key, response.body, response.headers.get('X-Next-Cursor'))
+    response.headers.update(headers)
+    return response
+
+async def bump_lists(*scopes: Tuple[str, str]):
+    """Bump list scopes here and, while versions live in each worker, in the other workers too"""
+    await response_cache.bump(*scopes)
+    if response_cache.enabled and scopes and not response_cache.backend.shared:
+        await worker_events.broadcast('response_cache', scopes=[list(scope) for scope in scopes])
+
+async def invalidate_pet_lists(foundation_id: str, pet_ids: Iterable[str] = ()):
+    """Bump a foundation's pet lists and, for existing pets, the match lists that embed them"""
+    scopes = [('pets', foundation_id)]
+    pet_ids = list(pet_ids)
+    if pet_ids and response_cache.enabled:
+        adopter_ids = await db.matches.distinct('user_id', {'pet_id': {'$in': pet_ids}, 'is_match': True})
+        scopes += [('matches', foundation_id), *(('matches', adopter_id) for adopter_id in adopter_ids)]
+    await bump_lists(*scopes)
+
+async def invalidate_adopter_lists(user_id: str):
+    """Bump the match lists that embed an adopter's profile"""
+    if not response_cache.enabled:
+        return
+    pet_ids = await db.matches.distinct('pet_id', {'user_id': user_id, 'is_match': True})
+    foundation_ids = await db.pets.distinct('foundation_id', {'id': {'$in': pet_ids}}) if pet_ids else []
+    await bump_lists(('matches', user_id), *(('matches', foundation_id) for foundation_id in foundation_ids))
+
+# ==================== WORKER STATE ====================
+
+def pubsub_backend(database):
+    if PUBSUB_BACKEND == 'mongo':
+        return MongoCappedBackend(database)
+    if PUBSUB_BACKEND == 'redis':
+        return RedisBackend(PUBSUB_REDIS_URL)
+    return LocalBackend()
+
+def bind_database(database):
+    """Attach the app and every component that keeps collections to `database`"""
+    global db, seen_store, recommender
+    db = database
+    seen_store = SeenStore(db.seen_pets, SEEN_CACHE_SIZE, SEEN_CACHE_TTL_SECONDS)
+    recommender = RecommendationMaterializer(
+        db.recommendations,
+        db.users,
+        pet_ranker,
+        prepare=ensure_ranker_loaded,
+        seen=get_seen_pets_batch,
+        top_n=RECOMMENDATION_SIZE,
+        debounce=RECOMMENDATION_DEBOUNCE_SECONDS
+    )
+    chat_hub.backend = pubsub_backend(db)
+
+def check_worker_backends():
+    """Several workers need shared pub/sub, or each one sees only its own writes"""
+    if WEB_CONCURRENCY <= 1:
+        return
+    if not chat_hub.backend.shared:
+        logger.warning(
+            f"PUBSUB_BACKEND={PUBSUB_BACKEND} con {WEB_CONCURRENCY} workers: los mensajes de chat y las "
+            "invalidaciones de caché no llegan a los demás workers; use 'mongo' o 'redis'"
+        )
+        if response_cache.enabled and not response_cache.backend.shared:
+            # Bumps could not reach the other workers, which would answer 304 for stale lists indefinitely
+            response_cache.backend = None
+            logger.warning("Caché de respuestas desactivada: sin pub/sub compartido no se puede invalidar en todos los workers")
+
+async def share_pet_changes(pets: Iterable[dict] = (), removed: Iterable[str] = ()):
+    """Mirror pet writes into the other workers' rankers"""
+    await worker_events.broadcast('pets', pets=[
+        {
+            'id': pet['id'],
+            'ordinal': pet.get('ordinal'),
+            'personality_traits': pet['personality_traits'],
+            'status': pet.get('status', 'available'),
+        }
+        for pet in pets
+    ], removed=list(removed))
+
+def apply_pet_changes(event: dict):
+    for pet in event['pets']:
+        sync_ranker(pet)
+    for pet_id in event['removed']:
+        unindex_pet(pet_id)
+
+def apply_match_access_changes(event: dict):
+    for match_id in event['match_ids']:
+        match_access_cache.invalidate(match_id)
+
+worker_events.on('pets', apply_pet_changes)
+worker_events.on('match_access', apply_match_access_changes)
+worker_events.on('user', lambda event: user_cache.invalidate(event['user_id']))
+worker_events.on('response_cache', lambda event: response_cache.apply_bump(event['scopes']))
+worker_events.on('seen', lambda event: seen_store.mark(event['user_id'], event['ordinals']))
+
+# ==================== MATCH ACCESS ====================
+
+async def resolve_match_access(match_id: str) -> Optional[dict]:
+    """Resolve who takes part in a match (adopter and owning foundation), memoized per match"""
+    access = match_access_cache.get(match_id)
+    if access is not None:
+        return access
+    
+    match = await db.matches.find_one({'id': match_id}, {'_id': 0, 'pet_id': 1, 'user_id': 1})
+    if not match:
+        return None
+    pet = await db.pets.find_one({'id': match['pet_id']}, {'_id': 0, 'foundation_id': 1})
+    access = {
+        'match_id': match_id,
+        'pet_id': match['pet_id'],
+        'adopter_id': match['user_id'],
+        'foundation_id': pet['foundation_id'] if pet else None
+    }
+    match_access_cache.set(match_id, access)
+    return access
+
+async def authorize_match(match_id: str, current_user: dict) -> Tuple[str, dict]:
+    """Verify the user takes part in the match and return their role and the resolved access"""
+    access = await resolve_match_access(match_id)
+    if not access:
+        raise HTTPException(status_code=404, detail="Match no encontrado")
+    
+    if current_user['user_type'] == 'adopter' and access['adopter_id'] == current_user['id']:
+        return 'user', access
+    if current_user['user_type'] == 'foundation' and access['foundation_id'] == current_user['id']:
+        return 'foundation', access
+    
+    raise HTTPException(status_code=403, detail="No autorizado")
+
+async def require_match_access(match_id: str, current_user: dict) -> str:
+    """Verify the user takes part in the match and return their role ('user' or 'foundation')"""
+    role, _ = await authorize_match(match_id, current_user)
+    return role
+
+async def invalidate_pet_access(pet_id: str):
+    """Drop memoized access for every match of a pet that was deleted or changed owner"""
+    match_ids = [match['id'] async for match in db.matches.find({'pet_id': pet_id}, {'_id': 0, 'id': 1})]
+    for match_id in match_ids:
+        match_access_cache.invalidate(match_id)
+    if match_ids:
+        await worker_events.broadcast('match_access', match_ids=match_ids)
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register")
 async def register(user_data: UserRegister):
-    # Check if user exists
-    existing = await db.users.find_one({'email': user_data.email})
-    if existing:
-        raise HTTPException(status_code=400, detail="El email ya está registrado")
-    
     # Create user
     user_dict = user_data.model_dump()
     password = user_dict.pop('password')
-    user_dict['password_hash'] = hash_password(password)
     user_obj = User(**user_dict)
     
     doc = user_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    doc['password_hash'] = await run_password_job('hash', hash_password, password)
     
-    await db.users.insert_one(doc)
+    # The unique email index rejects existing users atomically
+    try:
+        await db.users.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="El email ya está registrado")
+    if user_obj.user_type == 'adopter' and user_obj.personality_traits:
+        recommender.user_changed(user_obj.id)
     
     token = create_token(user_obj.id, user_obj.email)
     
@@ -234,7 +877,7 @@ async def login(credentials: UserLogin):
     if not user:
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
     
-    if not verify_password(credentials.password, user['password_hash']):
+    if not await run_password_job('verify', verify_password, credentials.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
     
     token = create_token(user['id'], user['email'])
@@ -263,6 +906,12 @@ async def update_profile(update_data: UserProfileUpdate, current_user: dict = De
     
     if update_dict:
         await db.users.update_one({'id': current_user['id']}, {'$set': update_dict})
+        user_cache.invalidate(current_user['id'])
+        await worker_events.broadcast('user', user_id=current_user['id'])
+        if current_user['user_type'] == 'adopter':
+            if 'personality_traits' in update_dict:
+                recommender.user_changed(current_user['id'])
+            await invalidate_adopter_lists(current_user['id'])
     
     updated_user = await db.users.find_one({'id': current_user['id']}, {'_id': 0, 'password_hash': 0})
     return UserProfile(**updated_user)
@@ -276,37 +925,192 @@ async def create_pet(pet_data: PetCreate, current_user: dict = Depends(get_curre
     
     pet_dict = pet_data.model_dump()
     pet_dict['foundation_id'] = current_user['id']
+    pet_dict.update(await offload_images(pet_dict['images']))
     pet_obj = Pet(**pet_dict)
     
     doc = pet_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    doc['ordinal'] = await next_pet_ordinals()
     
     await db.pets.insert_one(doc)
-    return pet_obj
+    sync_ranker(doc)
+    await share_pet_changes([doc])
+    recommender.pet_changed(doc['id'])
+    await invalidate_pet_lists(current_user['id'])
+    return FastJSONResponse(pet_obj)
+
+# Bulk routes are registered before /pets/{pet_id} so 'bulk' is never taken for a pet id
 
-@api_router.get("/pets", response_model=List[Pet])
-async def get_pets(current_user: dict = Depends(get_current_user)):
+def validation_detail(error: ValidationError) -> str:
+    return '; '.join(
+        f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" if e['loc'] else e['msg']
+        for e in error.errors()
+    )
+
+def csv_pet_row(row: dict) -> dict:
+    # A CSV cell holds several images separated by '|'
+    if isinstance(row.get('images'), str):
+        row['images'] = [image.strip() for image in row['images'].split('|') if image.strip()]
+    return row
+
+async def insert_pet_chunk(rows: List[Tuple[int, PetCreate]], foundation_id: str, errors: List[dict]) -> List[str]:
+    """Insert validated rows with a single insert_many and return the new pet ids"""
+    numbers, docs = [], []
+    for number, pet_data in rows:
+        pet_dict = pet_data.model_dump()
+        pet_dict['foundation_id'] = foundation_id
+        try:
+            pet_dict.update(await offload_images(pet_dict['images']))
+        except HTTPException as e:
+            errors.append({'row': number, 'detail': e.detail})
+            continue
+        numbers.append(number)
+        docs.append(Pet(**pet_dict).model_dump())
+    if not docs:
+        return []
+    
+    first = await next_pet_ordinals(len(docs))
+    for offset, doc in enumerate(docs):
+        doc['ordinal'] = first + offset
+    
+    failed = set()
+    try:
+        await db.pets.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        failed = {error['index'] for error in e.details['writeErrors']}
+        for index in sorted(failed):
+            errors.append({'row': numbers[index], 'detail': "No se pudo guardar la mascota"})
+    
+    created = [doc for index, doc in enumerate(docs) if index not in failed]
+    for doc in created:
+        sync_ranker(doc)
+        recommender.pet_changed(doc['id'])
+    await share_pet_changes(created)
+    return [doc['id'] for doc in created]
+
+@api_router.post("/pets/bulk")
+async def bulk_create_pets(request: Request, current_user: dict = Depends(get_current_user)):
+    """Create pets from a JSON array, NDJSON or CSV body, read and inserted in chunks as it streams in"""
+    if current_user['user_type'] != 'foundation':
+        raise HTTPException(status_code=403, detail="Solo las fundaciones pueden crear mascotas")
+    
+    fmt = bulk_format(request.headers.get('content-type'))
+    if fmt is None:
+        raise HTTPException(
+            status_code=415,
+            detail="Formato no soportado: usa application/json, application/x-ndjson o text/csv"
+        )
+    
+    created: List[str] = []
+    errors: List[dict] = []
+    chunk: List[Tuple[int, PetCreate]] = []
+    rows = 0
+    try:
+        async for number, row, error in read_rows(request.stream(), fmt, BULK_MAX_ROW_BYTES):
+            rows += 1
+            if rows > BULK_MAX_ROWS:
+                errors.append({'row': number, 'detail': f"Se superó el límite de {BULK_MAX_ROWS} filas"})
+                break
+            if error:
+                errors.append({'row': number, 'detail': error})
+                continue
+            if fmt == 'csv':
+                row = csv_pet_row(row)
+            try:
+                chunk.append((number, PetCreate.model_validate(row)))
+            except ValidationError as e:
+                errors.append({'row': number, 'detail': validation_detail(e)})
+                continue
+            if len(chunk) == BULK_CHUNK_SIZE:
+                created += await insert_pet_chunk(chunk, current_user['id'], errors)
+                chunk = []
+    except BulkFormatError as e:
+        # Rows before the malformed part are still imported
+        errors.append({'row': e.row, 'detail': e.detail})
+    if chunk:
+        created += await insert_pet_chunk(chunk, current_user['id'], errors)
+    if created:
+        await invalidate_pet_lists(current_user['id'])
+    
+    errors.sort(key=lambda error: error['row'])
+    return {'created': len(created), 'ids': created, 'errors': errors}
+
+@api_router.put("/pets/bulk")
+async def bulk_update_pet_status(update_data: PetBulkStatusUpdate, current_user: dict = Depends(get_current_user)):
+    """Set the status of many pets of the foundation with one update_many"""
+    if current_user['user_type'] != 'foundation':
+        raise HTTPException(status_code=403, detail="Solo las fundaciones pueden actualizar mascotas")
+    
+    pet_ids = list(dict.fromkeys(update_data.pet_ids))
+    pets = await db.pets.find(
+        {'id': {'$in': pet_ids}, 'foundation_id': current_user['id']},
+        {'_id': 0, 'id': 1, 'ordinal': 1, 'personality_traits': 1, 'status': 1}
+    ).to_list(len(pet_ids))
+    changed = [pet for pet in pets if pet.get('status', 'available') != update_data.status]
+    if changed:
+        await db.pets.update_many(
+            {'id': {'$in': [pet['id'] for pet in changed]}, 'foundation_id': current_user['id']},
+            {'$set': {'status': update_data.status}}
+        )
+    for pet in changed:
+        pet['status'] = update_data.status
+        sync_ranker(pet)
+        recommender.pet_changed(pet['id'])
+    await share_pet_changes(changed)
+    if changed:
+        await invalidate_pet_lists(current_user['id'], [pet['id'] for pet in changed])
+    
+    found = {pet['id'] for pet in pets}
+    return {
+        'updated': len(changed),
+        'unchanged': len(pets) - len(changed),
+        'not_found': [pet_id for pet_id in pet_ids if pet_id not in found]
+    }
+
+PETS_SORT = [('created_at', -1), ('id', -1)]
+
+@api_router.get("/pets", response_model=List[PetListItem])
+async def get_pets(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    view: Literal['full', 'card'] = 'full',
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     if current_user['user_type'] != 'foundation':
         raise HTTPException(status_code=403, detail="Solo las fundaciones pueden ver sus mascotas")
     
-    pets = await db.pets.find({'foundation_id': current_user['id']}, {'_id': 0}).to_list(1000)
+    names = parse_fields(fields, Pet.model_fields)
     
-    for pet in pets:
-        if isinstance(pet['created_at'], str):
-            pet['created_at'] = datetime.fromisoformat(pet['created_at'])
+    async def build():
+        projection = list_projection(
+            view,
+            names,
+            PET_CARD_PROJECTION,
+            PET_SHAPE.projection,
+            keys=[field for field, _ in PETS_SORT]
+        )
+        query = paginated_query({'foundation_id': current_user['id']}, PETS_SORT, cursor)
+        pets = await db.pets.find(query, projection).sort(PETS_SORT).to_list(limit + 1)
+        pets = set_next_cursor(response, pets, limit, PETS_SORT)
+        
+        compact = compact_list(response, pets, view, names, pet_card)
+        if compact is not None:
+            return compact
+        
+        return fast_json(response, [PET_SHAPE(pet) for pet in pets])
     
-    return pets
+    return await cached_list(request, ('pets', current_user['id']), current_user['id'], if_none_match, build)
 
 @api_router.get("/pets/{pet_id}", response_model=Pet)
 async def get_pet(pet_id: str, current_user: dict = Depends(get_current_user)):
-    pet = await db.pets.find_one({'id': pet_id}, {'_id': 0})
+    pet = await db.pets.find_one({'id': pet_id}, PET_SHAPE.projection)
     if not pet:
         raise HTTPException(status_code=404, detail="Mascota no encontrada")
     
-    if isinstance(pet['created_at'], str):
-        pet['created_at'] = datetime.fromisoformat(pet['created_at'])
-    
-    return Pet(**pet)
+    return FastJSONResponse(PET_SHAPE(pet))
 
 @api_router.put("/pets/{pet_id}", response_model=Pet)
 async def update_pet(pet_id: str, update_data: PetUpdate, current_user: dict = Depends(get_current_user)):
@@ -318,15 +1122,21 @@ async def update_pet(pet_id: str, update_data: PetUpdate, current_user: dict = D
         raise HTTPException(status_code=404, detail="Mascota no encontrada")
     
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
+    if 'images' in update_dict:
+        update_dict.update(await offload_images(update_dict['images']))
     
     if update_dict:
         await db.pets.update_one({'id': pet_id}, {'$set': update_dict})
     
     updated_pet = await db.pets.find_one({'id': pet_id}, {'_id': 0})
-    if isinstance(updated_pet['created_at'], str):
-        updated_pet['created_at'] = datetime.fromisoformat(updated_pet['created_at'])
+    sync_ranker(updated_pet)
+    if update_dict.keys() & {'personality_traits', 'status'}:
+        recommender.pet_changed(pet_id)
+        await share_pet_changes([updated_pet])
+    if update_dict:
+        await invalidate_pet_lists(current_user['id'], [pet_id])
     
-    return Pet(**updated_pet)
+    return FastJSONResponse(PET_SHAPE(updated_pet))
 
 @api_router.delete("/pets/{pet_id}")
 async def delete_pet(pet_id: str, current_user: dict = Depends(get_current_user)):
@@ -337,121 +1147,400 @@ async def delete_pet(pet_id: str, current_user: dict = Depends(get_current_user)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Mascota no encontrada")
     
+    unindex_pet(pet_id)
+    await share_pet_changes(removed=[pet_id])
+    recommender.pet_changed(pet_id)
+    await invalidate_pet_access(pet_id)
+    await invalidate_pet_lists(current_user['id'], [pet_id])
     return {'message': 'Mascota eliminada exitosamente'}
 
+# ==================== IMAGE ROUTES ====================
+
+@api_router.post("/images")
+async def upload_image(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    if current_user['user_type'] != 'foundation':
+        raise HTTPException(status_code=403, detail="Solo las fundaciones pueden subir imágenes")
+    
+    # Read one byte past the limit to detect oversized uploads without buffering them whole
+    data = await file.read(image_service.max_bytes + 1)
+    if len(data) > image_service.max_bytes:
+        raise HTTPException(status_code=413, detail="La imagen es demasiado grande")
+    try:
+        return await image_service.save(data)
+    except InvalidImageError:
+        raise HTTPException(status_code=400, detail="Imagen no válida")
+
+@api_router.get("/images/{key}")
+async def get_image(key: str, if_none_match: Optional[str] = Header(None)):
+    # Keys are content hashes, so a stored image never changes
+    headers = {'Cache-Control': 'public, max-age=31536000, immutable', 'ETag': f'"{key}"'}
+    if etag_matches(if_none_match, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    
+    image = await image_service.load(key)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    data, content_type = image
+    return Response(content=data, media_type=content_type, headers=headers)
+
 # ==================== MATCHING ROUTES ====================
 
-@api_router.get("/pets/available/list", response_model=List[Pet])
-async def get_available_pets(current_user: dict = Depends(get_current_user)):
+@api_router.get("/pets/available/list", response_model=List[RankedPetListItem])
+async def get_available_pets(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(FEED_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    view: Literal['full', 'card'] = 'full',
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     if current_user['user_type'] != 'adopter':
         raise HTTPException(status_code=403, detail="Solo los adoptantes pueden ver mascotas disponibles")
     
-    # Get pets not yet liked/passed by this user
-    user_interactions = await db.matches.find({'user_id': current_user['id']}, {'pet_id': 1, '_id': 0}).to_list(1000)
-    interacted_pet_ids = [m['pet_id'] for m in user_interactions]
+    names = parse_fields(fields, RankedPet.model_fields)
+    
+    # Pets already liked/passed by this user
+    seen = await get_seen_pets(current_user['id'])
+    
+    if current_user.get('personality_traits'):
+        after = None
+        if cursor:
+            after_score, after_id = decode_cursor(cursor, 2)
+            if not isinstance(after_score, (int, float)) or not isinstance(after_id, str):
+                raise HTTPException(status_code=400, detail="Cursor inválido")
+            after = (after_score, after_id)
+        
+        await ensure_ranker_loaded()
+        ranked = pet_ranker.rank(
+            current_user['personality_traits'],
+            seen=seen,
+            limit=limit + 1,
+            after=after
+        )
+        if len(ranked) > limit:
+            ranked = ranked[:limit]
+            last_id, last_score = ranked[-1]
+            response.headers['X-Next-Cursor'] = encode_cursor([last_score, last_id])
+        return await ranked_pets_response(response, ranked, view, names)
+    
+    # Nothing to rank against yet: walk the newest pets, skipping seen ones
+    projection = list_projection(
+        view,
+        names and [name for name in names if name != 'match_score'],
+        PET_CARD_PROJECTION,
+        RANKED_PET_SHAPE.projection,
+        keys=['ordinal', *(field for field, _ in PETS_SORT)]
+    )
+    pets = []
+    while True:
+        query = paginated_query({'status': 'available'}, PETS_SORT, cursor)
+        batch = await db.pets.find(query, projection).sort(PETS_SORT).to_list(limit + 1)
+        pets += [pet for pet in batch if pet.get('ordinal') not in seen]
+        if len(pets) > limit or len(batch) <= limit:
+            break
+        cursor = encode_cursor([batch[-1][field] for field, _ in PETS_SORT])
+    pets = set_next_cursor(response, pets, limit, PETS_SORT)
+    
+    compact = compact_list(response, pets, view, names, pet_card)
+    if compact is not None:
+        return compact
+    
+    return fast_json(response, [RANKED_PET_SHAPE(pet) for pet in pets])
+
+async def ranked_pets_response(
+    response: Response,
+    ranked: List[Tuple[str, float]],
+    view: str,
+    names: Optional[List[str]]
+):
+    """Fetch still-available pets for (pet_id, score) pairs, keeping their order"""
+    if not ranked:
+        return []
+    
+    scores = dict(ranked)
+    projection = list_projection(
+        view,
+        names and [name for name in names if name != 'match_score'],
+        PET_CARD_PROJECTION,
+        RANKED_PET_SHAPE.projection
+    )
+    found = await db.pets.find({
+        'id': {'$in': list(scores)},
+        'status': 'available'
+    }, projection).to_list(len(scores))
+    pets_by_id = {pet['id']: pet for pet in found}
     
-    pets = await db.pets.find({
-        'status': 'available',
-        'id': {'$nin': interacted_pet_ids}
-    }, {'_id': 0}).to_list(100)
+    pets = []
+    for pet_id, score in ranked:
+        pet = pets_by_id.get(pet_id)
+        if pet:
+            pet['match_score'] = score
+            pets.append(pet)
     
-    for pet in pets:
-        if isinstance(pet['created_at'], str):
-            pet['created_at'] = datetime.fromisoformat(pet['created_at'])
+    compact = compact_list(response, pets, view, names, pet_card)
+    if compact is not None:
+        return compact
     
-    return pets
+    return fast_json(response, [RANKED_PET_SHAPE(pet) for pet in pets])
 
-@api_router.post("/matches/like", response_model=Match)
-async def create_match(match_data: MatchCreate, current_user: dict = Depends(get_current_user)):
+@api_router.get("/pets/available/top", response_model=List[RankedPetListItem])
+async def get_top_pets(
+    response: Response,
+    k: int = Query(10, ge=1, le=FEED_SIZE),
+    view: Literal['full', 'card'] = 'full',
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     if current_user['user_type'] != 'adopter':
-        raise HTTPException(status_code=403, detail="Solo los adoptantes pueden dar like")
+        raise HTTPException(status_code=403, detail="Solo los adoptantes pueden ver mascotas disponibles")
+    
+    names = parse_fields(fields, RankedPet.model_fields)
     
     if not current_user.get('personality_traits'):
         raise HTTPException(status_code=400, detail="Debes completar tu perfil de personalidad primero")
     
-    # Check if already interacted
-    existing = await db.matches.find_one({'user_id': current_user['id'], 'pet_id': match_data.pet_id})
-    if existing:
-        raise HTTPException(status_code=400, detail="Ya interactuaste con esta mascota")
+    seen = await get_seen_pets(current_user['id'])
+    nearest = pet_index.nearest(
+        current_user['personality_traits'],
+        k=k,
+        min_score=MATCH_THRESHOLD,
+        seen=seen
+    )
+    return await ranked_pets_response(response, nearest, view, names)
+
+@api_router.get("/pets/available/recommended", response_model=List[RankedPetListItem])
+async def get_recommended_pets(
+    response: Response,
+    limit: int = Query(20, ge=1, le=RECOMMENDATION_SIZE),
+    view: Literal['full', 'card'] = 'full',
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['user_type'] != 'adopter':
+        raise HTTPException(status_code=403, detail="Solo los adoptantes pueden ver mascotas disponibles")
+    
+    names = parse_fields(fields, RankedPet.model_fields)
     
-    if match_data.action == 'pass':
+    if not current_user.get('personality_traits'):
+        raise HTTPException(status_code=400, detail="Debes completar tu perfil de personalidad primero")
+    
+    seen = await get_seen_pets(current_user['id'])
+    ranked = await recommended_for(current_user, seen, limit)
+    return await ranked_pets_response(response, ranked, view, names)
+
+PET_TRAIT_FIELDS = {'_id': 0, 'id': 1, 'ordinal': 1, 'personality_traits': 1, 'foundation_id': 1}
+
+async def pet_traits_for(pet_ids: Iterable[str]) -> dict:
+    """Traits, ordinal and owner of the given pets, from the trait cache or a single $in query"""
+    found, missing = {}, []
+    for pet_id in pet_ids:
+        pet = pet_trait_cache.get(pet_id)
+        if pet is None:
+            missing.append(pet_id)
+        else:
+            found[pet_id] = pet
+    for pet_id, pet in (await find_by_ids(db.pets, missing, PET_TRAIT_FIELDS)).items():
+        pet_trait_cache.set(pet_id, pet)
+        found[pet_id] = pet
+    return found
+
+def check_can_swipe(user: dict):
+    if user['user_type'] != 'adopter':
+        raise HTTPException(status_code=403, detail="Solo los adoptantes pueden dar like")
+    if not user.get('personality_traits'):
+        raise HTTPException(status_code=400, detail="Debes completar tu perfil de personalidad primero")
+
+def swipe_match(user: dict, swipe: MatchCreate, pet: Optional[dict]) -> Match:
+    if swipe.action == 'pass':
         # Just record the pass, no match
-        match_obj = Match(
-            user_id=current_user['id'],
-            pet_id=match_data.pet_id,
-            match_score=0,
-            is_match=False,
-            status='rejected'
-        )
-    else:
-        # Calculate compatibility
-        pet = await db.pets.find_one({'id': match_data.pet_id})
-        if not pet:
-            raise HTTPException(status_code=404, detail="Mascota no encontrada")
-        
-        user_traits = PersonalityTraits(**current_user['personality_traits'])
-        pet_traits = PersonalityTraits(**pet['personality_traits'])
-        
-        score = calculate_compatibility(user_traits, pet_traits)
-        is_match = score >= 70  # 70% threshold
-        
-        match_obj = Match(
-            user_id=current_user['id'],
-            pet_id=match_data.pet_id,
-            match_score=score,
-            is_match=is_match,
-            status='pending' if is_match else 'rejected'
-        )
+        return Match(user_id=user['id'], pet_id=swipe.pet_id, match_score=0, is_match=False, status='rejected')
     
-    doc = match_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    score = calculate_compatibility(
+        PersonalityTraits(**user['personality_traits']),
+        PersonalityTraits(**pet['personality_traits'])
+    )
+    is_match = score >= MATCH_THRESHOLD
+    return Match(
+        user_id=user['id'],
+        pet_id=swipe.pet_id,
+        match_score=score,
+        is_match=is_match,
+        status='pending' if is_match else 'rejected'
+    )
+
+def swipe_update(match: Match) -> Tuple[dict, dict]:
+    """Upsert filter and update that insert the swipe unless the adopter already swiped the pet"""
+    doc = match.model_dump()
+    key = {'user_id': doc.pop('user_id'), 'pet_id': doc.pop('pet_id')}  # Backed by the unique index
+    return key, {'$setOnInsert': doc}
+
+async def record_seen(user_id: str, ordinals: Iterable[Optional[int]]):
+    ordinals = [ordinal for ordinal in ordinals if ordinal is not None]
+    if ordinals:
+        await seen_store.add(user_id, ordinals)
+        await worker_events.broadcast('seen', user_id=user_id, ordinals=ordinals)
+
+async def bump_match_lists(user_id: str, matches: List[Match], pets: dict):
+    foundation_ids = {pets[match.pet_id]['foundation_id'] for match in matches if match.is_match}
+    if foundation_ids:
+        await bump_lists(('matches', user_id), *(('matches', foundation_id) for foundation_id in foundation_ids))
+
+@api_router.post("/matches/like", response_model=Match)
+async def create_match(match_data: MatchCreate, current_user: dict = Depends(get_current_user)):
+    check_can_swipe(current_user)
+    
+    pets = await pet_traits_for([match_data.pet_id])
+    pet = pets.get(match_data.pet_id)
+    if pet is None and match_data.action == 'like':
+        raise HTTPException(status_code=404, detail="Mascota no encontrada")
+    match_obj = swipe_match(current_user, match_data, pet)
+    
+    # A repeated swipe matches the existing document and inserts nothing, in
+    # the same round-trip; two racing upserts still meet the unique index
+    try:
+        result = await db.matches.update_one(*swipe_update(match_obj), upsert=True)
+    except DuplicateKeyError:
+        result = None
+    if result is None or result.upserted_id is None:
+        raise HTTPException(status_code=400, detail="Ya interactuaste con esta mascota")
     
-    await db.matches.insert_one(doc)
+    await record_seen(current_user['id'], [pet.get('ordinal')] if pet else [])
+    await bump_match_lists(current_user['id'], [match_obj], pets)
     return match_obj
 
+@api_router.post("/matches/swipes")
+async def create_swipes(batch: SwipeBatch, current_user: dict = Depends(get_current_user)):
+    """Record a client's queued swipes in one round-trip; repeats are reported instead of failing the batch"""
+    check_can_swipe(current_user)
+    
+    swipes, duplicates = {}, []
+    for swipe in batch.swipes:
+        if swipe.pet_id in swipes:
+            duplicates.append(swipe.pet_id)
+        else:
+            swipes[swipe.pet_id] = swipe
+    
+    pets = await pet_traits_for(swipes)
+    not_found = [pet_id for pet_id, swipe in swipes.items() if swipe.action == 'like' and pet_id not in pets]
+    missing = set(not_found)
+    matches = [swipe_match(current_user, swipe, pets.get(pet_id)) for pet_id, swipe in swipes.items() if pet_id not in missing]
+    
+    upserted = {}
+    if matches:
+        try:
+            result = await db.matches.bulk_write([UpdateOne(*swipe_update(match), upsert=True) for match in matches], ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            # Only a concurrent request recording the same swipe is expected here
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+            upserted = {item['index']: item['_id'] for item in e.details['upserted']}
+    recorded = [match for index, match in enumerate(matches) if index in upserted]
+    duplicates += [match.pet_id for index, match in enumerate(matches) if index not in upserted]
+    
+    await record_seen(current_user['id'], [pets[match.pet_id].get('ordinal') for match in recorded if match.pet_id in pets])
+    await bump_match_lists(current_user['id'], recorded, pets)
+    return {'recorded': recorded, 'duplicates': duplicates, 'not_found': not_found}
+
+MATCHES_SORT = [('created_at', -1), ('id', -1)]
+
 @api_router.get("/matches", response_model=List[dict])
-async def get_matches(current_user: dict = Depends(get_current_user)):
-    if current_user['user_type'] == 'adopter':
-        matches = await db.matches.find({
-            'user_id': current_user['id'],
-            'is_match': True
-        }, {'_id': 0}).to_list(1000)
-    else:
-        # Foundation sees matches for their pets
-        pets = await db.pets.find({'foundation_id': current_user['id']}, {'id': 1, '_id': 0}).to_list(1000)
-        pet_ids = [p['id'] for p in pets]
-        matches = await db.matches.find({
-            'pet_id': {'$in': pet_ids},
-            'is_match': True
-        }, {'_id': 0}).to_list(1000)
-    
-    # Enrich with pet and user data
-    result = []
-    for match in matches:
-        if isinstance(match['created_at'], str):
-            match['created_at'] = datetime.fromisoformat(match['created_at'])
+async def get_matches(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    view: Literal['full', 'card'] = 'full',
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    names = parse_fields(fields, [*Match.model_fields, 'pet', 'user'])
+    
+    async def build():
+        if current_user['user_type'] == 'adopter':
+            query = {
+                'user_id': current_user['id'],
+                'is_match': True
+            }
+        else:
+            # Foundation sees matches for their pets
+            pets = await db.pets.find({'foundation_id': current_user['id']}, {'id': 1, '_id': 0}).to_list(None)
+            pet_ids = [p['id'] for p in pets]
+            query = {
+                'pet_id': {'$in': pet_ids},
+                'is_match': True
+            }
         
-        pet = await db.pets.find_one({'id': match['pet_id']}, {'_id': 0})
-        user = await db.users.find_one({'id': match['user_id']}, {'_id': 0, 'password_hash': 0})
+        # Sparse fieldsets only join the pet and adopter when asked for them
+        want_pet = names is None or 'pet' in names
+        want_user = names is None or 'user' in names
+        keys = [field for field, _ in MATCHES_SORT]
+        if want_pet:
+            keys.append('pet_id')
+        if want_user:
+            keys.append('user_id')
+        projection = list_projection(
+            view,
+            names and [name for name in names if name not in ('pet', 'user')],
+            MATCH_CARD_PROJECTION,
+            keys=keys
+        )
+        
+        query = paginated_query(query, MATCHES_SORT, cursor)
+        matches = await db.matches.find(query, projection).sort(MATCHES_SORT).to_list(limit + 1)
+        matches = set_next_cursor(response, matches, limit, MATCHES_SORT)
+        
+        # Enrich with pet and user data using one batched query per collection
+        card = view == 'card' and names is None
+        pets_by_id, users_by_id = await asyncio.gather(
+            find_by_ids(
+                db.pets,
+                {m['pet_id'] for m in matches} if want_pet else (),
+                # Embedded pets keep the Pet shape, without internal fields such as the ordinal
+                PET_CARD_PROJECTION if card else PET_SHAPE.projection
+            ),
+            find_by_ids(
+                db.users,
+                {m['user_id'] for m in matches} if want_user else (),
+                USER_CARD_PROJECTION if card else {'_id': 0, 'password_hash': 0}
+            )
+        )
+        
+        if names is not None or card:
+            for match in matches:
+                if want_pet:
+                    match['pet'] = pets_by_id.get(match['pet_id'])
+                if want_user:
+                    match['user'] = users_by_id.get(match['user_id'])
         
-        result.append({
-            **match,
-            'pet': pet,
-            'user': user
-        })
+            def match_card(match: dict) -> MatchCard:
+                pet = match['pet']
+                return MatchCard(**{**match, 'pet': pet_card(pet) if pet else None, 'user': user_card(match['user'])})
+        
+            return compact_list(response, matches, view, names, match_card)
+        
+        result = []
+        for match in matches:
+            result.append({
+                **match,
+                'pet': pets_by_id.get(match['pet_id']),
+                'user': users_by_id.get(match['user_id'])
+            })
+        
+        return fast_json(response, result)
     
-    return result
+    return await cached_list(request, ('matches', current_user['id']), current_user['id'], if_none_match, build)
 
 @api_router.put("/matches/{match_id}/accept")
 async def accept_match(match_id: str, current_user: dict = Depends(get_current_user)):
-    match = await db.matches.find_one({'id': match_id})
-    if not match:
-        raise HTTPException(status_code=404, detail="Match no encontrado")
-    
-    if current_user['user_type'] == 'adopter' and match['user_id'] != current_user['id']:
-        raise HTTPException(status_code=403, detail="No autorizado")
+    _, access = await authorize_match(match_id, current_user)
     
     await db.matches.update_one({'id': match_id}, {'$set': {'status': 'accepted'}})
+    # A match whose pet was deleted has no foundation left
+    await bump_lists(*(
+        ('matches', user_id) for user_id in (access['adopter_id'], access['foundation_id']) if user_id is not None
+    ))
     
     return {'message': 'Match aceptado. Puedes proceder con el chat para coordinar la adopción.'}
 
@@ -459,112 +1548,257 @@ async def accept_match(match_id: str, current_user: dict = Depends(get_current_u
 
 @api_router.post("/appointments", response_model=Appointment)
 async def create_appointment(appointment_data: AppointmentCreate, current_user: dict = Depends(get_current_user)):
-    match = await db.matches.find_one({'id': appointment_data.match_id})
-    if not match:
-        raise HTTPException(status_code=404, detail="Match no encontrado")
-    
-    # Verify authorization
-    if current_user['user_type'] == 'adopter' and match['user_id'] != current_user['id']:
-        raise HTTPException(status_code=403, detail="No autorizado")
-    
-    if current_user['user_type'] == 'foundation':
-        pet = await db.pets.find_one({'id': match['pet_id'], 'foundation_id': current_user['id']})
-        if not pet:
-            raise HTTPException(status_code=403, detail="No autorizado")
+    await require_match_access(appointment_data.match_id, current_user)
     
     appointment_obj = Appointment(**appointment_data.model_dump())
     
     doc = appointment_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     
     await db.appointments.insert_one(doc)
     return appointment_obj
 
+APPOINTMENT_CARD_STAGES = [
+    # Keep only the first thumbnail/image so card pages never carry whole galleries
+    {'$addFields': {
+        'pet.thumbnails': {'$slice': ['$pet.thumbnails', 1]},
+        'pet.images': {'$slice': ['$pet.images', 1]},
+    }},
+    {'$project': {
+        '_id': 0, 'id': 1, 'match_id': 1, 'date': 1, 'time': 1, 'status': 1,
+        'pet.id': 1, 'pet.name': 1, 'pet.breed': 1, 'pet.age': 1, 'pet.thumbnails': 1, 'pet.images': 1,
+        'user.id': 1, 'user.name': 1, 'user.email': 1,
+    }},
+]
+
+def appointment_join_stages(view: str = 'full') -> list:
+    """Aggregation stages that attach match, pet and adopter to each appointment"""
+    if view == 'card':
+        shape = APPOINTMENT_CARD_STAGES
+    else:
+        # Embedded pets leave out internal fields such as the ordinal, like PET_SHAPE does
+        shape = [{'$project': {
+            '_id': 0, 'match._id': 0, 'pet._id': 0, 'pet.ordinal': 0, 'user._id': 0, 'user.password_hash': 0
+        }}]
+    return [
+        {'$lookup': {'from': 'matches', 'localField': 'match_id', 'foreignField': 'id', 'as': 'match'}},
+        {'$unwind': {'path': '$match', 'preserveNullAndEmptyArrays': True}},
+        {'$lookup': {'from': 'pets', 'localField': 'match.pet_id', 'foreignField': 'id', 'as': 'pet'}},
+        {'$unwind': {'path': '$pet', 'preserveNullAndEmptyArrays': True}},
+        {'$lookup': {'from': 'users', 'localField': 'match.user_id', 'foreignField': 'id', 'as': 'user'}},
+        {'$unwind': {'path': '$user', 'preserveNullAndEmptyArrays': True}},
+        *shape,
+    ]
+
+APPOINTMENTS_SORT = [('date', 1), ('time', 1), ('id', 1)]
+
 @api_router.get("/appointments", response_model=List[dict])
-async def get_appointments(current_user: dict = Depends(get_current_user)):
+async def get_appointments(
+    response: Response,
+    date_from: Optional[str] = Query(None, pattern=r'^\d{4}-\d{2}-\d{2}$'),
+    date_to: Optional[str] = Query(None, pattern=r'^\d{4}-\d{2}-\d{2}$'),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    view: Literal['full', 'card'] = 'full',
+    current_user: dict = Depends(get_current_user)
+):
+    # Walk from the user's own documents to their appointments so the scan
+    # only touches appointments that belong to them
     if current_user['user_type'] == 'adopter':
-        matches = await db.matches.find({'user_id': current_user['id']}, {'id': 1, '_id': 0}).to_list(1000)
+        collection = db.matches
+        pipeline = [
+            {'$match': {'user_id': current_user['id']}},
+            {'$project': {'_id': 0, 'id': 1}},
+            {'$lookup': {'from': 'appointments', 'localField': 'id', 'foreignField': 'match_id', 'as': 'appointment'}},
+        ]
     else:
-        pets = await db.pets.find({'foundation_id': current_user['id']}, {'id': 1, '_id': 0}).to_list(1000)
-        pet_ids = [p['id'] for p in pets]
-        matches = await db.matches.find({'pet_id': {'$in': pet_ids}}, {'id': 1, '_id': 0}).to_list(1000)
+        collection = db.pets
+        pipeline = [
+            {'$match': {'foundation_id': current_user['id']}},
+            {'$project': {'_id': 0, 'id': 1}},
+            {'$lookup': {'from': 'matches', 'localField': 'id', 'foreignField': 'pet_id', 'as': 'match'}},
+            {'$unwind': '$match'},
+            {'$lookup': {'from': 'appointments', 'localField': 'match.id', 'foreignField': 'match_id', 'as': 'appointment'}},
+        ]
+    pipeline += [
+        {'$unwind': '$appointment'},
+        {'$replaceRoot': {'newRoot': '$appointment'}},
+    ]
     
-    match_ids = [m['id'] for m in matches]
-    appointments = await db.appointments.find({'match_id': {'$in': match_ids}}, {'_id': 0}).to_list(1000)
+    date_filter = {}
+    if date_from:
+        date_filter['$gte'] = date_from
+    if date_to:
+        date_filter['$lte'] = date_to
+    query = {'date': date_filter} if date_filter else {}
+    query = paginated_query(query, APPOINTMENTS_SORT, cursor)
+    if query:
+        pipeline.append({'$match': query})
     
-    result = []
-    for apt in appointments:
-        if isinstance(apt['created_at'], str):
-            apt['created_at'] = datetime.fromisoformat(apt['created_at'])
-        
-        match = await db.matches.find_one({'id': apt['match_id']}, {'_id': 0})
-        pet = await db.pets.find_one({'id': match['pet_id']}, {'_id': 0})
-        user = await db.users.find_one({'id': match['user_id']}, {'_id': 0, 'password_hash': 0})
+    # Only the requested page gets joined with its match, pet and adopter
+    pipeline += [
+        {'$sort': dict(APPOINTMENTS_SORT)},
+        {'$limit': limit + 1},
+        *appointment_join_stages(view),
+    ]
+    
+    appointments = await collection.aggregate(pipeline).to_list(limit + 1)
+    appointments = set_next_cursor(response, appointments, limit, APPOINTMENTS_SORT)
+    
+    if view == 'card':
+        def appointment_card(apt: dict) -> AppointmentCard:
+            # A $lookup miss leaves at most the sliced arrays behind
+            pet, user = apt.get('pet') or {}, apt.get('user') or {}
+            return AppointmentCard(**{
+                **apt,
+                'pet': pet_card(pet) if 'id' in pet else None,
+                'user': user_card(user) if 'id' in user else None
+            })
         
-        result.append({
-            **apt,
-            'match': match,
-            'pet': pet,
-            'user': user
-        })
+        return compact_list(response, appointments, view, None, appointment_card)
+    
+    for apt in appointments:
+        for key in ('match', 'pet', 'user'):
+            apt.setdefault(key, None)
     
-    return result
+    return fast_json(response, appointments)
 
 # ==================== CHAT ROUTES ====================
 
-@api_router.get("/chat/{match_id}", response_model=Chat)
-async def get_chat(match_id: str, current_user: dict = Depends(get_current_user)):
-    match = await db.matches.find_one({'id': match_id})
-    if not match:
-        raise HTTPException(status_code=404, detail="Match no encontrado")
+MESSAGES_SORT = [('timestamp', 1), ('id', 1)]
+
+async def migrate_embedded_messages(chat: dict):
+    """Move messages embedded in a legacy chat document into the messages collection"""
+    docs = []
+    for position, msg in enumerate(chat.get('messages', [])):
+        # Deterministic ids make concurrent migrations of the same chat idempotent
+        doc = {**msg, 'id': msg.get('id') or f"{chat['id']}-{position}", 'match_id': chat['match_id']}
+        if isinstance(doc.get('timestamp'), str):
+            doc['timestamp'] = datetime.fromisoformat(doc['timestamp'])
+        docs.append(doc)
+    if docs:
+        try:
+            await db.messages.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(error['code'] != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+    await db.chats.update_one({'match_id': chat['match_id']}, {'$unset': {'messages': ''}})
+
+async def get_or_create_chat(match_id: str) -> dict:
+    chat_obj = Chat(match_id=match_id)
+    doc = chat_obj.model_dump(exclude={'messages'})
     
-    # Verify authorization
-    authorized = False
-    if current_user['user_type'] == 'adopter' and match['user_id'] == current_user['id']:
-        authorized = True
-    elif current_user['user_type'] == 'foundation':
-        pet = await db.pets.find_one({'id': match['pet_id'], 'foundation_id': current_user['id']})
-        if pet:
-            authorized = True
+    # Plain read on the hot path; only the first visit pays for the upsert
+    chat = await db.chats.find_one({'match_id': match_id}, {'_id': 0})
+    if chat is None:
+        try:
+            chat = await db.chats.find_one_and_update(
+                {'match_id': match_id},
+                {'$setOnInsert': doc},
+                projection={'_id': 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Lost the upsert race against another request creating the same chat
+            chat = await db.chats.find_one({'match_id': match_id}, {'_id': 0})
     
-    if not authorized:
-        raise HTTPException(status_code=403, detail="No autorizado")
+    # Chats created by the old upserting send_message lack id and created_at
+    missing = {key: value for key, value in doc.items() if key not in chat}
+    if missing:
+        await db.chats.update_one({'match_id': match_id}, {'$set': missing})
+        chat.update(missing)
     
-    chat = await db.chats.find_one({'match_id': match_id}, {'_id': 0})
+    if 'messages' in chat:
+        await migrate_embedded_messages(chat)
+        del chat['messages']
+    return chat
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in candidates or etag in candidates
+
+async def since_filter(match_id: str, since: str) -> dict:
+    """Build the filter for messages after a message id or an ISO timestamp.
+
+    Both resume the (timestamp, id) keyset. A timestamp stands for the position
+    before every message sent at that instant, so messages sharing the client's
+    last millisecond are returned again instead of skipped; clients drop the
+    ones they already have by id.
+    """
+    try:
+        since_time = datetime.fromisoformat(since)
+    except ValueError:
+        since_time = None
+    
+    if since_time is not None:
+        if since_time.tzinfo is None:
+            raise HTTPException(status_code=400, detail="since debe incluir la zona horaria")
+        # '' sorts before every message id
+        return keyset_filter(MESSAGES_SORT, [since_time, ''])
+    
+    msg = await db.messages.find_one({'id': since, 'match_id': match_id}, {'_id': 0, 'id': 1, 'timestamp': 1})
+    if not msg:
+        raise HTTPException(status_code=404, detail="Mensaje no encontrado")
+    return keyset_filter(MESSAGES_SORT, [msg[field] for field, _ in MESSAGES_SORT])
+
+@api_router.get("/chat/{match_id}", response_model=ChatPage)
+async def get_chat(
+    match_id: str,
+    response: Response,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[str] = None,
+    limit: int = Query(CHAT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    await require_match_access(match_id, current_user)
+    
+    if sum(1 for cursor in (before, after, since) if cursor) > 1:
+        raise HTTPException(status_code=400, detail="Usa solo uno de before, after o since")
     
-    if not chat:
-        chat_obj = Chat(match_id=match_id)
-        doc = chat_obj.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        await db.chats.insert_one(doc)
-        return chat_obj
+    # Messages are append-only, so the newest one identifies the chat's state.
+    # Unchanged chats are answered with 304 before any page is read.
+    newest_first = [(field, -direction) for field, direction in MESSAGES_SORT]
+    latest = await db.messages.find_one({'match_id': match_id}, {'_id': 0, 'id': 1}, sort=newest_first)
+    state = f"{match_id}|{latest['id'] if latest else ''}|{before}|{after}|{since}|{limit}"
+    etag = '"' + hashlib.sha1(state.encode('utf-8')).hexdigest() + '"'
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    response.headers['ETag'] = etag
     
-    if isinstance(chat['created_at'], str):
-        chat['created_at'] = datetime.fromisoformat(chat['created_at'])
+    chat = await get_or_create_chat(match_id)
     
-    for msg in chat['messages']:
-        if isinstance(msg['timestamp'], str):
-            msg['timestamp'] = datetime.fromisoformat(msg['timestamp'])
+    if after or since:
+        # Polling: oldest new messages first
+        if after:
+            query = paginated_query({'match_id': match_id}, MESSAGES_SORT, after)
+        else:
+            query = {'$and': [{'match_id': match_id}, await since_filter(match_id, since)]}
+        messages = await db.messages.find(query, MESSAGE_SHAPE.projection).sort(MESSAGES_SORT).to_list(limit)
+        has_older = False
+    else:
+        # Latest page, or the page just before a cursor, returned in chronological order
+        query = paginated_query({'match_id': match_id}, newest_first, before)
+        messages = await db.messages.find(query, MESSAGE_SHAPE.projection).sort(newest_first).to_list(limit + 1)
+        has_older = len(messages) > limit
+        messages = messages[:limit][::-1]
+    
+    def message_cursor(msg: dict) -> str:
+        return encode_cursor([msg[field] for field, _ in MESSAGES_SORT])
     
-    return Chat(**chat)
+    return fast_json(response, {
+        **CHAT_SHAPE(chat),
+        'messages': messages,
+        'before_cursor': message_cursor(messages[0]) if has_older else None,
+        'after_cursor': message_cursor(messages[-1]) if messages else after
+    })
 
 @api_router.post("/chat/{match_id}/messages")
 async def send_message(match_id: str, message_data: ChatMessageCreate, current_user: dict = Depends(get_current_user)):
-    match = await db.matches.find_one({'id': match_id})
-    if not match:
-        raise HTTPException(status_code=404, detail="Match no encontrado")
-    
-    # Verify authorization and determine sender type
-    sender_type = None
-    if current_user['user_type'] == 'adopter' and match['user_id'] == current_user['id']:
-        sender_type = 'user'
-    elif current_user['user_type'] == 'foundation':
-        pet = await db.pets.find_one({'id': match['pet_id'], 'foundation_id': current_user['id']})
-        if pet:
-            sender_type = 'foundation'
-    
-    if not sender_type:
-        raise HTTPException(status_code=403, detail="No autorizado")
+    sender_type = await require_match_access(match_id, current_user)
     
     message = ChatMessage(
         sender_id=current_user['id'],
@@ -573,16 +1807,112 @@ async def send_message(match_id: str, message_data: ChatMessageCreate, current_u
     )
     
     message_doc = message.model_dump()
-    message_doc['timestamp'] = message_doc['timestamp'].isoformat()
+    message_doc['match_id'] = match_id
     
-    await db.chats.update_one(
-        {'match_id': match_id},
-        {'$push': {'messages': message_doc}},
-        upsert=True
-    )
+    await db.messages.insert_one(message_doc)
+    message_doc.pop('_id', None)
+    await chat_hub.publish(f'chat:{match_id}', message_doc)
     
     return {'message': 'Mensaje enviado exitosamente'}
 
+@api_router.websocket("/chat/{match_id}/ws")
+async def chat_socket(websocket: WebSocket, match_id: str):
+    """Push new chat messages as they are sent.
+
+    Authenticates once on connect with ?token=<jwt> (browsers cannot set
+    headers on WebSockets) or a Bearer Authorization header.
+    """
+    token = websocket.query_params.get('token')
+    authorization = websocket.headers.get('authorization', '')
+    if not token and authorization.lower().startswith('bearer '):
+        token = authorization[7:]
+    
+    await websocket.accept()
+    try:
+        if not token:
+            raise HTTPException(status_code=401, detail="Token requerido")
+        current_user = await authenticate_token(token)
+        await require_match_access(match_id, current_user)
+    except HTTPException as e:
+        # 4xxx close codes mirror the HTTP status the REST endpoints would return
+        await websocket.close(code=4000 + e.status_code, reason=e.detail)
+        return
+    
+    subscription = chat_hub.subscribe(f'chat:{match_id}')
+    
+    async def forward():
+        while True:
+            message = await subscription.get()
+            if subscription.overflowed:
+                # The client fell behind; it should reconnect and catch up with ?after=
+                await websocket.close(code=1013)
+                return
+            await websocket.send_text(dumps(message).decode('utf-8'))
+    
+    async def drain():
+        # Incoming frames are ignored; receiving only notices the client leaving
+        while True:
+            await websocket.receive_text()
+    
+    forward_task = asyncio.create_task(forward())
+    drain_task = asyncio.create_task(drain())
+    try:
+        await asyncio.wait({forward_task, drain_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        forward_task.cancel()
+        drain_task.cancel()
+        subscription.close()
+
+# ==================== METRICS ROUTES ====================
+
+def component_stats() -> dict:
+    return {
+        'password_pool': password_pool.stats(),
+        'user_cache': user_cache.stats(),
+        'token_cache': token_cache.stats(),
+        'match_access_cache': match_access_cache.stats(),
+        'pet_trait_cache': pet_trait_cache.stats(),
+        'chat_hub': chat_hub.stats(),
+        'worker_events': worker_events.stats(),
+        'response_cache': response_cache.stats(),
+        # Not bound until startup has a database
+        **({'recommender': recommender.stats()} if recommender else {}),
+        **({'profiler': profiler.stats()} if profiler else {})
+    }
+
+@api_router.get("/metrics", dependencies=[Depends(require_admin)])
+async def get_metrics():
+    return component_stats()
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+async def get_prometheus_metrics():
+    """Request, Mongo and component metrics in the Prometheus text format"""
+    return Response(
+        content=metrics.render(component_stats()),
+        media_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+# ==================== ADMIN ROUTES ====================
+
+def require_profiler() -> SlowRequestProfiler:
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="El perfilador de solicitudes lentas está desactivado")
+    return profiler
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def get_slow_request_profiles():
+    """Latest slow request profiles, newest first"""
+    return FastJSONResponse(require_profiler().recent())
+
+@api_router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_slow_request_profile(profile_id: int, format: Literal['json', 'folded'] = 'json'):
+    profile = require_profiler().get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    if format == 'folded':
+        return Response(content=folded(profile), media_type='text/plain; charset=utf-8')
+    return FastJSONResponse(profile)
+
 # ==================== MAIN ====================
 
 app.include_router(api_router)
@@ -593,14 +1923,40 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
 )
 
+# Outermost, so timings include CORS and error handling
+app.add_middleware(InstrumentationMiddleware, metrics=metrics, server_timing=SERVER_TIMING, profiler=profiler)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def startup_tasks():
+    global client
+    # Tests and tools may bind their own database before startup
+    if db is None:
+        # Dates are stored as BSON datetimes and read back as UTC-aware values
+        client = AsyncIOMotorClient(
+            mongo_url, tz_aware=True, event_listeners=[MongoCommandListener(metrics)], **MONGO_POOL_OPTIONS
+        )
+        bind_database(client[os.environ['DB_NAME']])
+    check_worker_backends()
+    await ensure_indexes(db)
+    await chat_hub.start()
+    await recommender.start()
+    if profiler:
+        profiler.start()
+
+async def shutdown_tasks():
+    await chat_hub.stop()
+    if recommender is not None:
+        await recommender.stop()
+    if profiler:
+        profiler.stop()
+    if client is not None:
+        client.close()
+    password_pool.shutdown()
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""Keeps per-worker caches and indexes in step when several workers serve the app.
+
+Each worker has its own user, match access and seen-pets caches, its own
+ranker and, with the memory backend, its own response cache versions. A
+write is applied to the local copies right away, then broadcast through the
+pub/sub hub so the other workers apply it as well. A worker ignores its own
+broadcasts. With a hub that only reaches this process there is nobody to
+tell, so nothing is published.
+"""
+import uuid
+from typing import Callable, Dict
+
+CHANNEL = 'worker-events'
+
+Handler = Callable[[dict], None]
+
+
+class WorkerEvents:
+    def __init__(self, hub, channel: str = CHANNEL):
+        self.hub = hub
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self.sent = 0
+        self.received = 0
+        self._handlers: Dict[str, Handler] = {}
+        hub.listen(channel, self._receive)
+
+    @property
+    def shared(self) -> bool:
+        return self.hub.backend.shared
+
+    def on(self, kind: str, handler: Handler):
+        self._handlers[kind] = handler
+
+    async def broadcast(self, kind: str, **data):
+        if not self.shared:
+            return
+        self.sent += 1
+        await self.hub.publish(self.channel, {'origin': self.origin, 'kind': kind, **data})
+
+    def _receive(self, event: dict):
+        if event.get('origin') == self.origin:
+            return
+        handler = self._handlers.get(event.get('kind'))
+        if handler is not None:
+            self.received += 1
+            handler(event)
+
+    def stats(self) -> dict:
+        return {'shared': self.shared, 'sent': self.sent, 'received': self.received}
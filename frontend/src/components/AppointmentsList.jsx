@@ -30,7 +30,8 @@ const AppointmentsList = () => {
   const fetchAppointments = async () => {
     try {
       const response = await axios.get(`${API}/appointments`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { view: 'card' }
       });
       setAppointments(response.data);
     } catch (error) {
@@ -43,7 +44,8 @@ const AppointmentsList = () => {
   const fetchMatches = async () => {
     try {
       const response = await axios.get(`${API}/matches`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { view: 'card' }
       });
       setMatches(response.data.filter(m => m.status === 'accepted'));
     } catch (error) {
@@ -18,7 +18,8 @@ const MatchesList = () => {
   const fetchMatches = async () => {
     try {
       const response = await axios.get(`${API}/matches`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { view: 'card' }
       });
       setMatches(response.data);
     } catch (error) {
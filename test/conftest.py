@@ -0,0 +1,128 @@
+import os
+import sys
+import uuid
+from collections import Counter
+from functools import partial
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+# server.py reads these at import; no connection is opened until startup
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test_database')
+
+TRAITS = {'playful': 5, 'calm': 5, 'energetic': 5, 'friendly': 5, 'independent': 5, 'social': 5}
+
+
+def bulk_write_by_request(bulk_write):
+    """mongomock numbers bulk upserts among themselves; MongoDB reports each at its request's index"""
+    from pymongo.errors import BulkWriteError
+    from pymongo.results import BulkWriteResult
+
+    def wrapper(self, requests, ordered=True, **kwargs):
+        counts, upserted, errors = Counter(), [], []
+        for index, request in enumerate(requests):
+            try:
+                result = bulk_write(self, [request], **kwargs).bulk_api_result
+            except BulkWriteError as e:
+                errors += [{**error, 'index': index} for error in e.details['writeErrors']]
+                if ordered:
+                    break
+                continue
+            counts.update({key: value for key, value in result.items() if isinstance(value, int)})
+            upserted += [{**item, 'index': index} for item in result['upserted']]
+        details = {**counts, 'upserted': upserted, 'writeErrors': errors, 'writeConcernErrors': []}
+        if errors:
+            raise BulkWriteError(details)
+        return BulkWriteResult(details, True)
+    return wrapper
+
+
+class MongomockSeenCollection:
+    """mongomock has no $bit operator, so apply the seen-pets word updates in Python"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    async def find_one(self, *args, **kwargs):
+        return await self.collection.find_one(*args, **kwargs)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        update = dict(update)
+        bits = update.pop('$bit', None)
+        if bits:
+            doc = await self.collection.find_one(query, {'words': 1}) or {}
+            words = doc.get('words', {})
+            for path, operation in bits.items():
+                index = path.split('.', 1)[1]
+                words[index] = int(words.get(index, 0)) | int(operation['or'])
+            update.setdefault('$set', {})['words'] = words
+        return await self.collection.update_one(query, update, upsert=upsert)
+
+
+def use_mongomock(server):
+    """Point the app at a fresh in-memory database"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    db = AsyncMongoMockClient(tz_aware=True)['test_database']
+    server.bind_database(db)
+    server.seen_store.collection = MongomockSeenCollection(db.seen_pets)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """The app on a fresh in-memory database, with empty per-worker caches and indexes"""
+    import bcrypt
+    import mongomock
+    from fastapi.testclient import TestClient
+
+    import server
+    from cache import TTLCache
+    from password_pool import PasswordPool
+    from ranking import CompatibilityRanker, TraitGridIndex
+    from response_cache import MemoryCacheBackend, ResponseCache
+
+    # Shutdown closes the password pool, so every app gets its own
+    monkeypatch.setattr(server, 'password_pool', PasswordPool(2, 8))
+    monkeypatch.setattr(bcrypt, 'gensalt', partial(bcrypt.gensalt, rounds=4))
+    monkeypatch.setattr(server, 'pet_ranker', CompatibilityRanker())
+    monkeypatch.setattr(server, 'pet_index', TraitGridIndex())
+    for name in ('user_cache', 'token_cache', 'match_access_cache', 'pet_trait_cache'):
+        cache = getattr(server, name)
+        monkeypatch.setattr(server, name, TTLCache(cache.maxsize, cache.ttl))
+    monkeypatch.setattr(server, 'response_cache', ResponseCache(MemoryCacheBackend(1000), 300))
+    monkeypatch.setattr(server, 'db', None)
+    monkeypatch.setattr(
+        mongomock.collection.Collection, 'bulk_write', bulk_write_by_request(mongomock.collection.Collection.bulk_write)
+    )
+    use_mongomock(server)
+
+    with TestClient(server.app) as client:
+        yield client
+
+
+def register(client, user_type: str, **fields) -> dict:
+    """Register a user and return its Authorization header"""
+    body = {
+        'email': f'{uuid.uuid4().hex}@example.com',
+        'password': 'TestPass123!',
+        'name': user_type.capitalize(),
+        'age': 30,
+        'user_type': user_type,
+        **fields,
+    }
+    response = client.post('/api/auth/register', json=body)
+    assert response.status_code == 200, response.text
+    return {'Authorization': f"Bearer {response.json()['token']}"}
+
+
+def create_pet(client, headers: dict, **fields) -> dict:
+    body = {'name': 'Luna', 'breed': 'Mestiza', 'age': 2, 'personality_traits': TRAITS, **fields}
+    response = client.post('/api/pets', json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
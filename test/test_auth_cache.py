@@ -0,0 +1,70 @@
+import time
+
+import jwt
+
+import server
+
+from .conftest import TRAITS, register
+
+
+def profile(api, headers: dict) -> dict:
+    response = api.get('/api/users/profile', headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_repeated_requests_are_served_from_the_token_and_user_caches(api):
+    headers = register(api, 'adopter', personality_traits=TRAITS)
+    user = profile(api, headers)
+    tokens, users = server.token_cache.stats(), server.user_cache.stats()
+
+    # A change made behind the app's back is not seen while the cached user lives
+    api.portal.call(server.db.users.update_one, {'id': user['id']}, {'$set': {'name': 'Otra'}})
+    assert profile(api, headers)['name'] == user['name']
+    assert server.token_cache.stats()['hits'] == tokens['hits'] + 1
+    assert server.user_cache.stats()['hits'] == users['hits'] + 1
+
+    # Another worker announcing the change drops the cached user
+    server.worker_events._receive({'origin': 'other', 'kind': 'user', 'user_id': user['id']})
+    assert profile(api, headers)['name'] == 'Otra'
+
+
+def test_profile_update_invalidates_the_cached_user(api):
+    headers = register(api, 'adopter', personality_traits=TRAITS)
+    user = profile(api, headers)
+
+    response = api.put('/api/users/profile', json={'name': 'Ana', 'personality_traits': {**TRAITS, 'calm': 9}},
+                       headers=headers)
+    assert response.status_code == 200
+
+    updated = profile(api, headers)
+    assert updated['name'] == 'Ana' and updated['personality_traits']['calm'] == 9
+    # Every route reads the same cached user, not only the profile
+    assert server.user_cache.get(user['id'])['name'] == 'Ana'
+
+
+def test_cached_token_stops_working_when_it_expires(api):
+    user = profile(api, register(api, 'adopter'))
+    expires = int(time.time()) + 2
+    token = jwt.encode({'user_id': user['id'], 'email': user['email'], 'exp': expires},
+                       server.JWT_SECRET, algorithm=server.JWT_ALGORITHM)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    assert profile(api, headers)['id'] == user['id']
+    assert server.token_cache.get(token) is not None
+    time.sleep(max(0.0, expires - time.time()) + 0.05)
+
+    response = api.get('/api/users/profile', headers=headers)
+    assert response.status_code == 401 and response.json()['detail'] == 'Token expirado'
+    assert server.token_cache.get(token) is None
+
+
+def test_deleted_user_is_rejected_once_the_cached_copy_is_gone(api):
+    headers = register(api, 'foundation')
+    user = profile(api, headers)
+
+    api.portal.call(server.db.users.delete_one, {'id': user['id']})
+    server.user_cache.invalidate(user['id'])
+
+    response = api.get('/api/users/profile', headers=headers)
+    assert response.status_code == 401 and response.json()['detail'] == 'Usuario no encontrado'
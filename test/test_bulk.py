@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from bulk import BulkFormatError, bulk_format, read_rows
+
+MAX_ROW_BYTES = 1024
+
+
+async def one_byte_chunks(body: bytes):
+    for i in range(len(body)):
+        yield body[i:i + 1]
+
+
+def rows(body: str, fmt: str, max_row_bytes: int = MAX_ROW_BYTES) -> list:
+    """Read `body` fed one byte at a time, so every state boundary is crossed mid-token"""
+    async def collect():
+        return [row async for row in read_rows(one_byte_chunks(body.encode('utf-8')), fmt, max_row_bytes)]
+    return asyncio.run(collect())
+
+
+def format_error(body: str, fmt: str, max_row_bytes: int = MAX_ROW_BYTES) -> BulkFormatError:
+    with pytest.raises(BulkFormatError) as error:
+        rows(body, fmt, max_row_bytes)
+    return error.value
+
+
+def test_bulk_format_ignores_parameters():
+    assert bulk_format('application/json; charset=utf-8') == 'json'
+    assert bulk_format('TEXT/CSV') == 'csv'
+    assert bulk_format('application/x-ndjson') == 'ndjson'
+    assert bulk_format('text/plain') is None
+    assert bulk_format(None) is None
+
+
+def test_json_array_items_and_per_row_errors():
+    body = ' [ {"name": "Ñandú", "age": 2}, 7, {"tags": ["a", "}"]}, "x" , {"n": 1.5e3} ] \n'
+    assert rows(body, 'json') == [
+        (1, {'name': 'Ñandú', 'age': 2}, None),
+        (2, None, "El elemento debe ser un objeto JSON"),
+        (3, {'tags': ['a', '}']}, None),
+        (4, None, "El elemento debe ser un objeto JSON"),
+        (5, {'n': 1500.0}, None),
+    ]
+
+
+def test_json_empty_array():
+    assert rows('[]', 'json') == []
+
+
+def test_json_truncated_array():
+    assert format_error('[{"a": 1}, {"b": 2}', 'json').detail == "El arreglo JSON está incompleto"
+    assert format_error('[{"a": 1}, {"b": ', 'json').row == 2
+
+
+def test_json_trailing_content():
+    error = format_error('[{"a": 1}] {"b": 2}', 'json')
+    assert error.detail == "Contenido después del arreglo JSON"
+
+
+def test_json_requires_an_array_and_separators():
+    assert format_error('{"a": 1}', 'json').detail == "El cuerpo debe ser un arreglo JSON"
+    assert format_error('[{"a": 1} {"b": 2}]', 'json').detail == "Se esperaba ',' o ']' en el arreglo JSON"
+
+
+def test_json_oversized_item():
+    error = format_error('[{"a": "' + 'x' * 200 + '"}]', 'json', max_row_bytes=50)
+    assert (error.row, error.detail) == (1, "El elemento es demasiado grande")
+
+
+def test_ndjson_rows_and_errors_use_line_numbers():
+    body = '{"a": 1}\r\n\nnot json\n[1]\n{"b": 2}'
+    assert rows(body, 'ndjson') == [
+        (1, {'a': 1}, None),
+        (3, None, "JSON no válido"),
+        (4, None, "La fila debe ser un objeto JSON"),
+        (5, {'b': 2}, None),
+    ]
+
+
+def test_csv_dotted_headers_build_nested_objects():
+    body = (
+        '\ufeffname,personality_traits.calm,personality_traits.social,images\n'
+        'Luna, 7 ,3,a.jpg|b.jpg\n'
+        '\n'
+        '"Max, Jr.",5,,\n'
+        'Solo,1\n'
+    )
+    assert rows(body, 'csv') == [
+        (2, {'name': 'Luna', 'personality_traits': {'calm': '7', 'social': '3'}, 'images': 'a.jpg|b.jpg'}, None),
+        (4, {'name': 'Max, Jr.', 'personality_traits': {'calm': '5'}}, None),
+        (5, None, "Se esperaban 4 columnas y hay 2"),
+    ]
+
+
+def test_csv_conflicting_header():
+    error = format_error('a,a.b\n1,2\n', 'csv')
+    assert error.detail.startswith("Columna en conflicto en el encabezado")
+
+
+def test_csv_line_too_long():
+    error = format_error('name\n' + 'x' * 100, 'csv', max_row_bytes=50)
+    assert (error.row, error.detail) == (2, "La línea es demasiado larga")
+
+
+def test_invalid_utf8():
+    async def collect():
+        return [row async for row in read_rows(one_byte_chunks(b'name\n\xff\xfe\n'), 'csv', MAX_ROW_BYTES)]
+    with pytest.raises(BulkFormatError) as error:
+        asyncio.run(collect())
+    assert error.value.detail == "El archivo debe estar codificado en UTF-8"
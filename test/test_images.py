@@ -0,0 +1,115 @@
+import asyncio
+import base64
+import io
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from PIL import Image
+
+import server
+from images import ImageService, InvalidImageError, LocalImageStore, migrate_pet_images
+
+from .conftest import create_pet, register
+
+THUMBNAIL_SIZE = 64
+
+
+def png(width: int = 300, height: int = 150, color: str = 'red') -> bytes:
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(output, format='PNG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def service(tmp_path):
+    return ImageService(LocalImageStore(tmp_path), '/api/images', max_bytes=64 * 1024, thumbnail_size=THUMBNAIL_SIZE)
+
+
+def stored_files(service) -> list:
+    return sorted(path.name for path in service.store.root.rglob('*') if path.is_file())
+
+
+def test_same_content_is_stored_once(service):
+    data = png()
+    encoded = base64.b64encode(data).decode('ascii')
+
+    async def run():
+        saved = await service.save(data)
+        return saved, await service.offload([f'data:image/png;base64,{encoded}', encoded, saved['url']])
+
+    saved, images = asyncio.run(run())
+    assert images == [saved['url']] * 3
+    assert stored_files(service) == sorted([f"{saved['hash']}.png", f"{saved['hash']}_thumb.jpg"])
+    assert service.thumbnail_url(saved['url']) == saved['thumbnail_url']
+
+
+def test_thumbnail_is_a_scaled_down_jpeg(service):
+    saved = asyncio.run(service.save(png(300, 150)))
+
+    data, content_type = asyncio.run(service.load(saved['thumbnail_url'].rsplit('/', 1)[1]))
+    assert content_type == 'image/jpeg'
+    with Image.open(io.BytesIO(data)) as thumbnail:
+        assert (thumbnail.format, thumbnail.size) == ('JPEG', (THUMBNAIL_SIZE, THUMBNAIL_SIZE // 2))
+
+
+@pytest.mark.parametrize('image, reason', [
+    (base64.b64encode(png()[:16] + b'x' * 64 * 1024).decode('ascii'), 'too_large'),
+    ('data:image/png;base64,' + base64.b64encode(b'BM not really a bitmap').decode('ascii'), 'unsupported'),
+    ('data:text/html;base64,PGI+aGk8L2I+', 'unsupported'),
+    ('data:image/png;base64,not*base64', 'invalid_base64'),
+    # Starts like a bare PNG but has lost its padding
+    (base64.b64encode(png()).decode('ascii').rstrip('=')[:-1], 'invalid_base64'),
+])
+def test_offload_rejects_oversized_unsupported_and_malformed_images(service, image, reason):
+    with pytest.raises(InvalidImageError) as error:
+        asyncio.run(service.offload([image]))
+    assert str(error.value) == reason
+    assert stored_files(service) == []
+
+
+def test_urls_are_kept_as_they_are(service):
+    urls = ['https://example.com/luna.jpg', '/api/images/luna.png', 'http://example.com/a b.png']
+    assert asyncio.run(service.offload(urls)) == urls
+
+
+def test_names_and_ids_that_look_like_base64_are_kept_as_they_are(service):
+    values = [
+        'perro123',
+        'iVBORw0KGgo',
+        '5f3a9c2e8b1d4e7fa0c6b9d2e1f4a7c3',
+        'fotos/luna/perfil/principal/version/2024/original',
+        base64.b64encode(b'BM not really a bitmap, just long enough text').decode('ascii'),
+    ]
+    assert asyncio.run(service.offload(values)) == values
+    assert stored_files(service) == []
+
+
+def test_migration_offloads_bare_base64_and_leaves_other_values(service):
+    encoded = base64.b64encode(png()).decode('ascii')
+    names = ['5f3a9c2e8b1d4e7fa0c6b9d2e1f4a7c3d8e2b6a1f0c9d3e7']
+
+    async def run():
+        db = AsyncMongoMockClient()['images']
+        await db.pets.insert_many([
+            {'id': 'luna', 'images': [encoded, 'https://example.com/luna.jpg']},
+            {'id': 'max', 'images': names, 'thumbnails': names},
+        ])
+        migrated = await migrate_pet_images(db, service)
+        return migrated, {pet['id']: pet async for pet in db.pets.find({}, {'_id': 0})}
+
+    migrated, pets = asyncio.run(run())
+    assert migrated == 1
+    assert pets['luna']['images'][0].startswith('/api/images/') and pets['luna']['images'][1] == 'https://example.com/luna.jpg'
+    assert pets['max'] == {'id': 'max', 'images': names, 'thumbnails': names}
+
+
+def test_pet_routes_offload_bare_base64_and_reject_other_values(api, monkeypatch, service):
+    monkeypatch.setattr(server, 'image_service', service)
+    foundation = register(api, 'foundation')
+
+    pet = create_pet(api, foundation, images=[base64.b64encode(png()).decode('ascii')])
+    assert pet['images'][0].startswith('/api/images/') and pet['thumbnails'][0].endswith('_thumb.jpg')
+    assert api.get(pet['images'][0]).content == png()
+
+    response = api.put(f"/api/pets/{pet['id']}", json={'images': ['data:text/plain;base64,aG9sYQ==']}, headers=foundation)
+    assert response.status_code == 400
@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from indexes import INDEXES, dedupe, ensure_indexes, find_duplicates
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def at(minutes: int) -> datetime:
+    return START + timedelta(minutes=minutes)
+
+
+async def seed(db):
+    """Duplicates the check-then-insert races used to leave behind"""
+    await db.users.insert_many([
+        {'id': 'u2', 'email': 'ana@example.com', 'created_at': at(1)},
+        {'id': 'u1', 'email': 'ana@example.com', 'created_at': at(0)},
+        {'id': 'f1', 'email': 'fundacion@example.com', 'created_at': at(0)},
+    ])
+    await db.pets.insert_one({'id': 'p1', 'foundation_id': 'f1', 'created_at': at(0)})
+    await db.matches.insert_many([
+        # Both accounts swiped the same pet, which becomes a duplicate once they are merged
+        {'id': 'm1', 'user_id': 'u1', 'pet_id': 'p1', 'created_at': at(2)},
+        {'id': 'm2', 'user_id': 'u2', 'pet_id': 'p1', 'created_at': at(3)},
+    ])
+    await db.appointments.insert_one({'id': 'a1', 'match_id': 'm2', 'date': '2024-02-01', 'time': '10:00'})
+    await db.chats.insert_many([
+        {'id': 'c1', 'match_id': 'm1', 'created_at': at(4)},
+        {'id': 'c2', 'match_id': 'm2', 'created_at': at(5), 'messages': [{'id': 'x', 'message': 'hola'}]},
+    ])
+    await db.messages.insert_one({'id': 'msg1', 'match_id': 'm2', 'sender_id': 'u2'})
+    await db.seen_pets.insert_many([{'user_id': 'u1', 'words': {}}, {'user_id': 'u2', 'words': {}}])
+
+
+def test_unique_index_failure_names_the_duplicates():
+    async def run():
+        db = AsyncMongoMockClient()['indexes']
+        await seed(db)
+        with pytest.raises(RuntimeError) as error:
+            await ensure_indexes(db)
+        email_unique = next(model for model in INDEXES['users'] if model.document['name'] == 'email_unique')
+        return str(error.value), await find_duplicates(db, 'users', email_unique)
+
+    message, duplicates = asyncio.run(run())
+    assert 'ana@example.com' in message and '--dedupe' in message
+    assert len(duplicates) == 1 and duplicates[0]['key'] == {'email': 'ana@example.com'}
+
+
+def test_dedupe_merges_into_the_oldest_document_and_repoints_references():
+    async def run():
+        db = AsyncMongoMockClient()['indexes']
+        await seed(db)
+        removed = await dedupe(db)
+        await ensure_indexes(db)
+        found = {
+            collection: await db[collection].find({}, {'_id': 0}).to_list(None)
+            for collection in INDEXES
+        }
+        return removed, found
+
+    removed, found = asyncio.run(run())
+    assert removed == {'users.email_unique': 1, 'matches.user_pet_unique': 1, 'chats.match_unique': 1}
+    assert [user['id'] for user in found['users']] == ['u1', 'f1']
+    assert [(match['id'], match['user_id']) for match in found['matches']] == [('m1', 'u1')]
+    assert [appointment['match_id'] for appointment in found['appointments']] == ['m1']
+    assert [(chat['id'], chat['messages']) for chat in found['chats']] == [('c1', [{'id': 'x', 'message': 'hola'}])]
+    assert [(msg['match_id'], msg['sender_id']) for msg in found['messages']] == [('m1', 'u1')]
+    # Rebuilt from the merged swipe history on the next read
+    assert found['seen_pets'] == []
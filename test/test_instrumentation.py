@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+import server
+from instrumentation import InstrumentationMiddleware, Metrics, MongoCommandListener, timed_route_class
+
+from .conftest import create_pet, register
+
+
+def sample(exposition: str, series: str) -> float:
+    """Value of one series in a Prometheus text exposition, 0 when it is absent"""
+    for line in exposition.splitlines():
+        if line.startswith(series + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0.0
+
+
+def scrape(api, monkeypatch) -> str:
+    monkeypatch.setattr(server, 'METRICS_TOKEN', 'raspado')
+    response = api.get('/metrics', headers={'Authorization': 'Bearer raspado'})
+    assert response.status_code == 200
+    return response.text
+
+
+def test_metrics_have_series_per_route_template_and_section(api, monkeypatch):
+    foundation = register(api, 'foundation')
+    pets = [create_pet(api, foundation, name=name) for name in ('Luna', 'Max')]
+    route = 'tinderpets_http_request_duration_seconds_count{method="GET",route="/api/pets/{pet_id}",status="200"}'
+    commands = 'tinderpets_http_request_mongo_commands_count{method="GET",route="/api/pets/{pet_id}"}'
+    missing = 'tinderpets_http_request_duration_seconds_count{method="GET",route="/api/pets/{pet_id}",status="404"}'
+    sections = [f'tinderpets_section_calls_total{{section="{name}"}}' for name in ('bcrypt', 'pydantic')]
+    before = scrape(api, monkeypatch)
+
+    register(api, 'adopter')
+    for pet in pets:
+        api.get(f"/api/pets/{pet['id']}", headers=foundation)
+    api.get('/api/pets/missing', headers=foundation)
+    after = scrape(api, monkeypatch)
+
+    # Labelled by the route template, so every pet id lands in the same series
+    assert sample(after, route) - sample(before, route) == 2
+    assert sample(after, missing) - sample(before, missing) == 1
+    # Commands per request are observed whatever the status
+    assert sample(after, commands) - sample(before, commands) == 3
+    assert all(sample(after, series) > sample(before, series) for series in sections)
+    assert 'tinderpets_password_pool_workers 2' in after
+
+
+def test_mongo_commands_are_counted_and_attributed_to_their_request():
+    metrics = Metrics('test')
+    listener = MongoCommandListener(metrics)
+    router = APIRouter(route_class=timed_route_class(metrics))
+
+    @router.get('/items/{item_id}')
+    async def get_item(item_id: str):
+        # What the listener hears for a find and a failed getMore
+        listener.succeeded(SimpleNamespace(command_name='find', duration_micros=1500))
+        listener.failed(SimpleNamespace(command_name='getMore', duration_micros=500))
+        return {'id': item_id}
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(InstrumentationMiddleware, metrics=metrics, server_timing=True)
+    with TestClient(app) as client:
+        response = client.get('/items/1')
+        client.get('/items/2')
+
+    assert 'mongo;dur=2.0;desc="2 cmd"' in response.headers['Server-Timing']
+    exposition = metrics.render()
+    assert sample(exposition, 'test_mongo_commands_total{command="find",outcome="ok"}') == 2
+    assert sample(exposition, 'test_mongo_commands_total{command="getMore",outcome="error"}') == 2
+    assert sample(exposition, 'test_mongo_command_seconds_total{command="find"}') == 0.003
+    assert sample(exposition, 'test_http_request_mongo_commands_sum{method="GET",route="/items/{item_id}"}') == 4
+    assert sample(exposition, 'test_http_request_mongo_commands_bucket{method="GET",route="/items/{item_id}",le="2"}') == 2
+    assert sample(exposition, 'test_section_calls_total{section="pydantic"}') == 2
@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from migrate_dates import migrate_collection, pending_count
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedAfter:
+    """A collection whose bulk writes fail after the first `batches`, like a run killed halfway"""
+
+    def __init__(self, collection, batches: int):
+        self.collection = collection
+        self.batches = batches
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def bulk_write(self, requests, **kwargs):
+        if self.batches == 0:
+            raise Interrupted()
+        self.batches -= 1
+        return await self.collection.bulk_write(requests, **kwargs)
+
+
+def test_migration_resumes_and_leaves_converted_and_unparsable_dates():
+    async def run():
+        messages = AsyncMongoMockClient(tz_aware=True)['migrate'].messages
+        await messages.insert_many([
+            {'_id': 1, 'timestamp': START.isoformat()},
+            {'_id': 2, 'timestamp': START + timedelta(minutes=1)},  # Already converted
+            {'_id': 3, 'timestamp': 'ayer'},
+            {'_id': 4, 'timestamp': '2024-01-01T00:03:00'},  # Written without a time zone
+            {'_id': 5, 'timestamp': '2024-01-01T02:04:00+02:00'},
+            {'_id': 6, 'timestamp': (START + timedelta(minutes=5)).isoformat()},
+            {'_id': 7, 'timestamp': (START + timedelta(minutes=6)).isoformat()},
+        ])
+
+        # Batches of two: {1, 3}, {4, 5}, {6, 7}; the run dies writing the second
+        with pytest.raises(Interrupted):
+            await migrate_collection(InterruptedAfter(messages, batches=1), 'timestamp', batch_size=2)
+        interrupted = await pending_count(messages, 'timestamp')
+
+        resumed = await migrate_collection(messages, 'timestamp', batch_size=2)
+        again = await migrate_collection(messages, 'timestamp', batch_size=2)
+        docs = await messages.find({}).sort('_id', 1).to_list(None)
+        return interrupted, resumed, again, await pending_count(messages, 'timestamp'), docs
+
+    interrupted, resumed, again, pending, docs = asyncio.run(run())
+    assert interrupted == 5  # 'ayer' plus the four strings after the first batch
+    assert (resumed, again, pending) == (4, 0, 1)
+    assert [doc['timestamp'] for doc in docs] == [
+        START, START + timedelta(minutes=1), 'ayer',
+        *(START + timedelta(minutes=minutes) for minutes in (3, 4, 5, 6)),
+    ]
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import pytest
+from fastapi import HTTPException
+
+from server import decode_cursor, encode_cursor, keyset_filter
+
+SORT = [('created_at', -1), ('id', -1)]
+
+
+@pytest.fixture
+def collection():
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    docs = [
+        # Every third document shares its timestamp with the next, so ties fall back to the id
+        {'id': f'{i:03d}', 'created_at': start + timedelta(milliseconds=i // 3 * 3), 'n': i % 4}
+        for i in range(40)
+    ]
+    collection = mongomock.MongoClient(tz_aware=True).db.items
+    collection.insert_many(docs)
+    return collection
+
+
+def test_cursor_round_trip_keeps_sort_key_types():
+    values = [datetime(2024, 5, 6, 7, 8, 9, 123000, tzinfo=timezone.utc), 'abc', 7, 2.5]
+    cursor = encode_cursor(values)
+    assert '=' not in cursor
+    assert decode_cursor(cursor, len(values)) == values
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', encode_cursor(['a']), encode_cursor([{'$gt': ''}, 'x']),
+                                    encode_cursor([True, 'x'])])
+def test_decode_cursor_rejects_invalid_cursors(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, 2)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize('page_size', [1, 3, 7, 40])
+def test_keyset_pages_cover_the_sorted_result_once(collection, page_size):
+    query = {'n': {'$ne': 0}}
+    expected = [doc['id'] for doc in collection.find(query).sort(SORT)]
+
+    seen, cursor = [], None
+    while True:
+        page_query = query if cursor is None else {'$and': [query, keyset_filter(SORT, decode_cursor(cursor, len(SORT)))]}
+        page = list(collection.find(page_query).sort(SORT).limit(page_size))
+        seen += [doc['id'] for doc in page]
+        if len(page) < page_size:
+            break
+        cursor = encode_cursor([page[-1][field] for field, _ in SORT])
+
+    assert seen == expected
+
+
+def test_keyset_filter_ascending_and_descending_fields():
+    assert keyset_filter([('score', -1), ('id', 1)], [80, 'b']) == {'$or': [
+        {'score': {'$lt': 80}},
+        {'score': 80, 'id': {'$gt': 'b'}},
+    ]}
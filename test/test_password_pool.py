@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+import pytest
+
+import server
+from password_pool import PasswordPool, PoolSaturatedError
+
+from .conftest import register
+
+
+def test_pool_rejects_jobs_beyond_workers_and_queue():
+    async def run():
+        pool = PasswordPool(workers=1, max_queue=1)
+        release = threading.Event()
+        blocked = [asyncio.create_task(pool.run('hash', release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolSaturatedError):
+            await pool.run('hash', lambda: None)
+        release.set()
+        await asyncio.gather(*blocked)
+        # Capacity comes back once the jobs finish
+        assert await pool.run('verify', lambda: True)
+        pool.shutdown()
+        return pool.stats()
+
+    stats = asyncio.run(run())
+    assert stats['rejected'] == 1
+    assert stats['operations']['hash']['count'] == 2 and stats['in_flight'] == 0
+
+
+def test_cancelled_callers_keep_their_slot_until_the_job_is_done():
+    async def run():
+        pool = PasswordPool(workers=1, max_queue=1)
+        release = threading.Event()
+        running, queued = (asyncio.create_task(pool.run('hash', release.wait)) for _ in range(2))
+        await asyncio.sleep(0.05)
+        # The running job's caller went away, but the job still holds its worker
+        running.cancel()
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolSaturatedError):
+            await asyncio.wait_for(pool.run('hash', lambda: None), 1)
+        assert pool.stats()['in_flight'] == 2
+
+        # A queued job cancelled before it starts gives its slot back right away
+        queued.cancel()
+        await asyncio.sleep(0.05)
+        assert pool.stats()['in_flight'] == 1
+        release.set()
+        await asyncio.sleep(0.05)
+        stats = pool.stats()
+        pool.shutdown()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats['in_flight'] == 0 and stats['operations']['hash']['count'] == 1
+
+
+def test_saturated_pool_answers_429(api):
+    pool = server.password_pool
+    release = threading.Event()
+    for _ in range(pool.workers + pool.max_queue):
+        api.portal.start_task_soon(pool.run, 'hash', release.wait)
+    try:
+        response = api.post('/api/auth/register', json={
+            'email': 'ana@example.com', 'password': 'TestPass123!', 'name': 'Ana', 'age': 30, 'user_type': 'adopter'
+        })
+    finally:
+        release.set()
+
+    assert response.status_code == 429 and response.headers['Retry-After'] == '1'
+    assert pool.stats()['rejected'] == 1
+    # The rejected registration stored nothing, so the email is still free
+    register(api, 'adopter', email='ana@example.com')
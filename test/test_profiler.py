@@ -0,0 +1,70 @@
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+import server
+from instrumentation import InstrumentationMiddleware, Metrics, MongoCommandListener, current_request
+from profiler import SlowRequestProfiler
+
+
+def profiled_app(profiler: SlowRequestProfiler) -> FastAPI:
+    """An app whose /slow route authenticates, runs three Mongo commands and then waits on I/O"""
+    metrics = Metrics('test')
+    listener = MongoCommandListener(metrics)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        profiler.start()
+        yield
+        profiler.stop()
+
+    async def current_user():
+        # What get_current_user leaves behind for the instrumentation
+        current_request.get().user_type = 'foundation'
+
+    async def wait_for_database():
+        await asyncio.sleep(0.1)
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.get('/slow/{item_id}', dependencies=[Depends(current_user)])
+    async def slow(item_id: str):
+        for _ in range(3):
+            listener.succeeded(SimpleNamespace(command_name='find', duration_micros=100))
+        await wait_for_database()
+        return {'id': item_id}
+
+    @app.get('/fast')
+    async def fast():
+        return {}
+
+    app.add_middleware(InstrumentationMiddleware, metrics=metrics, profiler=profiler)
+    return app
+
+
+def test_slow_request_is_profiled_with_route_user_type_and_query_count(api, monkeypatch):
+    profiler = SlowRequestProfiler(threshold=0.05, interval=0.002, capacity=5)
+    with TestClient(profiled_app(profiler)) as client:
+        assert client.get('/fast').status_code == 200
+        assert client.get('/slow/1').status_code == 200
+
+    [profile] = profiler.recent()
+    assert (profile['method'], profile['route'], profile['path'], profile['status']) == ('GET', '/slow/{item_id}', '/slow/1', 200)
+    assert profile['user_type'] == 'foundation' and profile['mongo_commands'] == 3
+    assert profile['duration_ms'] >= 100 and profile['samples'] > 0
+    # Most samples find the request suspended in the route's await
+    waiting = [item for item in profile['stacks'] if item['state'] == 'waiting']
+    assert any('slow (test_profiler.py' in item['stack'] and 'wait_for_database' in item['stack'] for item in waiting)
+
+    # The admin routes serve it, folded stacks included
+    monkeypatch.setattr(server, 'profiler', profiler)
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', 'secreto')
+    admin = {'X-Admin-Token': 'secreto'}
+    assert api.get('/api/admin/profiles').status_code == 403
+    assert [item['id'] for item in api.get('/api/admin/profiles', headers=admin).json()] == [profile['id']]
+    folded = api.get(f"/api/admin/profiles/{profile['id']}", params={'format': 'folded'}, headers=admin).text
+    assert folded.splitlines()[0].startswith(('waiting;', 'running;'))
+    assert api.get('/api/admin/profiles/999', headers=admin).status_code == 404
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import time
+
+import pytest
+from bson import ObjectId
+from starlette.websockets import WebSocketDisconnect
+
+import server
+from pubsub import MongoCappedBackend
+
+from .conftest import TRAITS, create_pet, register
+
+
+class TailableCursor:
+    """Walks a capped collection's documents in insertion order and waits at the end"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.position = 0
+        self.alive = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        if self.collection.kill_cursors:
+            self.collection.kill_cursors = False
+            self.alive = False
+        if not self.alive or self.position >= len(self.collection.docs):
+            raise StopAsyncIteration
+        self.position += 1
+        return self.collection.docs[self.position - 1]
+
+
+class CappedCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.kill_cursors = False
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        if sort:
+            return self.docs[-1]
+        return next((doc for doc in self.docs if doc['_id'] == query['_id']), None)
+
+    def find(self, query, cursor_type):
+        assert query == {}, 'tailing must not filter on _id'
+        return TailableCursor(self)
+
+
+def event(oid: str, channel: str = 'chat') -> dict:
+    return {'_id': ObjectId(oid), 'channel': channel, 'data': {'n': oid[-1]}}
+
+
+def test_tail_delivers_events_with_lower_ids_from_other_workers_once():
+    async def run():
+        seed = event('65000000' + 'b' * 16, channel=None)
+        collection = CappedCollection([event('65000000' + 'a' * 15 + '1'), seed])
+        delivered = []
+        backend = MongoCappedBackend(db=None)
+        task = asyncio.create_task(backend._tail(collection, seed['_id'], lambda channel, data: delivered.append(data['n'])))
+
+        # Same second, another process: its ObjectId sorts before the seed
+        collection.docs += [event('65000000' + 'a' * 15 + '2'), event('65000000' + 'c' * 15 + '3')]
+        for _ in range(10):
+            await asyncio.sleep(0)
+        # A dead cursor resumes after the last delivered event without repeating it
+        collection.kill_cursors = True
+        await asyncio.sleep(0.2)
+        collection.docs.append(event('65000000' + '0' * 15 + '4'))
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        task.cancel()
+        return delivered
+
+    assert asyncio.run(run()) == ['2', '3', '4']
+
+
+def test_chat_socket_rejects_missing_invalid_and_foreign_tokens(api):
+    foundation = register(api, 'foundation')
+    adopter = register(api, 'adopter', personality_traits=TRAITS)
+    outsider = register(api, 'adopter', personality_traits=TRAITS)
+    pet = create_pet(api, foundation)
+    match = api.post('/api/matches/like', json={'pet_id': pet['id'], 'action': 'like'}, headers=adopter).json()
+
+    # Close codes are 4000 plus the status the REST routes answer with
+    for path, headers, code in [
+        (f"/api/chat/{match['id']}/ws", {}, 4401),
+        (f"/api/chat/{match['id']}/ws?token=nope", {}, 4401),
+        (f"/api/chat/{match['id']}/ws", outsider, 4403),
+        ('/api/chat/missing/ws', adopter, 4404),
+    ]:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            with api.websocket_connect(path, headers=headers) as socket:
+                socket.receive_text()
+        assert closed.value.code == code, path
+
+
+def test_chat_socket_pushes_messages_to_both_sides(api):
+    foundation = register(api, 'foundation')
+    adopter = register(api, 'adopter', personality_traits=TRAITS)
+    pet = create_pet(api, foundation)
+    match = api.post('/api/matches/like', json={'pet_id': pet['id'], 'action': 'like'}, headers=adopter).json()
+    token = foundation['Authorization'].split()[1]
+
+    with api.websocket_connect(f"/api/chat/{match['id']}/ws", headers=adopter) as adopter_socket, \
+            api.websocket_connect(f"/api/chat/{match['id']}/ws?token={token}") as foundation_socket:
+        # Sockets subscribe after authenticating, which may still be running once connected
+        deadline = time.monotonic() + 5
+        while server.chat_hub.stats()['subscribers'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        api.post(f"/api/chat/{match['id']}/messages", json={'message': 'hola'}, headers=adopter)
+        pushed = [json.loads(socket.receive_text()) for socket in (adopter_socket, foundation_socket)]
+
+    assert pushed[0] == pushed[1]
+    assert (pushed[0]['message'], pushed[0]['sender_type'], pushed[0]['match_id']) == ('hola', 'user', match['id'])
+    assert pushed[0]['id'] in [msg['id'] for msg in api.get(f"/api/chat/{match['id']}", headers=foundation).json()['messages']]
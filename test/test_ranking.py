@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from ranking import CompatibilityRanker, TraitGridIndex
+from seen import SeenBitmap
+
+TRAITS = ['playful', 'calm', 'energetic', 'friendly', 'independent', 'social']
+
+
+def random_traits(rng: random.Random) -> dict:
+    return {trait: rng.randint(1, 10) for trait in TRAITS}
+
+
+def exact_top(ranker: CompatibilityRanker, traits: dict, k: int, seen: SeenBitmap):
+    return ranker.rank(traits, seen=seen, limit=k, min_score=70)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_nearest_matches_exhaustive_ranking_through_writes(seed):
+    rng = random.Random(seed)
+    ranker, index = CompatibilityRanker(), TraitGridIndex()
+    pets = {}
+    next_ordinal = 0
+    seen = SeenBitmap()
+
+    for step in range(600):
+        roll = rng.random()
+        if roll < 0.6 or not pets:
+            # Random ids, so insertion order says nothing about the id tie-break
+            pet_id = f'pet-{rng.getrandbits(32):08x}'
+            pets[pet_id] = next_ordinal
+            next_ordinal += 1
+        elif roll < 0.85:
+            pet_id = rng.choice(sorted(pets))
+        else:
+            pet_id = rng.choice(sorted(pets))
+            del pets[pet_id]
+            ranker.remove(pet_id)
+            index.remove(pet_id)
+            continue
+        traits = random_traits(rng)
+        ranker.upsert(pet_id, traits, pets[pet_id])
+        index.upsert(pet_id, traits, pets[pet_id])
+        if rng.random() < 0.1:
+            seen.add(pets[pet_id])
+
+        if step % 50 == 49:
+            query = random_traits(rng)
+            for k in (1, 5, 20):
+                assert index.nearest(query, k, min_score=70, seen=seen) == exact_top(ranker, query, k, seen)
+
+
+def test_nearest_respects_min_score_and_seen():
+    ranker, index = CompatibilityRanker(), TraitGridIndex()
+    same = dict.fromkeys(TRAITS, 5)
+    far = dict.fromkeys(TRAITS, 10)
+    for ordinal, (pet_id, traits) in enumerate([('a', same), ('b', same), ('c', far)]):
+        ranker.upsert(pet_id, traits, ordinal)
+        index.upsert(pet_id, traits, ordinal)
+    seen = SeenBitmap()
+    seen.add(0)
+
+    assert index.nearest(same, 10, min_score=70, seen=seen) == [('b', 100.0)]
+    assert index.nearest(same, 10, min_score=70, seen=seen) == exact_top(ranker, same, 10, seen)
+
+
+def test_nearest_breaks_ties_by_id_regardless_of_insertion_order():
+    ranker, index = CompatibilityRanker(), TraitGridIndex()
+    same = dict.fromkeys(TRAITS, 5)
+    for ordinal, pet_id in enumerate(['d', 'b', 'e', 'a', 'c']):
+        ranker.upsert(pet_id, same, ordinal)
+        index.upsert(pet_id, same, ordinal)
+    seen = SeenBitmap()
+    seen.add(3)  # 'a'
+
+    assert index.nearest(same, 1, min_score=70) == [('a', 100.0)]
+    assert index.nearest(same, 2, min_score=70, seen=seen) == [('b', 100.0), ('c', 100.0)]
+    for k in (1, 2, 5):
+        assert index.nearest(same, k, min_score=70, seen=seen) == exact_top(ranker, same, k, seen)
@@ -0,0 +1,23 @@
+import server
+
+from .conftest import TRAITS, create_pet, register
+
+
+def test_batch_leaves_out_swiped_pets_without_touching_the_seen_cache(api):
+    foundation = register(api, 'foundation')
+    pets = [create_pet(api, foundation, name=f'Mascota {n}') for n in range(4)]
+    adopters = [register(api, 'adopter', personality_traits=TRAITS) for _ in range(3)]
+    for adopter, pet in zip(adopters, pets):
+        api.get('/api/pets/available/list', headers=adopter)
+        api.post('/api/matches/like', json={'pet_id': pet['id'], 'action': 'pass'}, headers=adopter)
+    user_ids = [api.get('/api/users/profile', headers=adopter).json()['id'] for adopter in adopters]
+    # The last adopter's bitmap was never persisted and is rebuilt from its swipes
+    api.portal.call(server.db.seen_pets.delete_one, {'user_id': user_ids[-1]})
+    server.seen_store.cache.clear()
+
+    api.portal.call(server.recommender.process, set(), set(user_ids))
+
+    for user_id, pet in zip(user_ids, pets):
+        doc = api.portal.call(server.db.recommendations.find_one, {'user_id': user_id})
+        assert sorted(doc['pet_ids']) == sorted(other['id'] for other in pets if other is not pet)
+    assert list(server.seen_store.cache._data) == [user_ids[-1]]
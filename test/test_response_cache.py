@@ -0,0 +1,96 @@
+import server
+
+from .conftest import TRAITS, create_pet, register
+
+
+def revalidate(api, path: str, headers: dict, etag: str):
+    return api.get(path, headers={**headers, 'If-None-Match': etag})
+
+
+def test_matching_etag_is_answered_with_304(api):
+    foundation = register(api, 'foundation')
+    create_pet(api, foundation)
+
+    first = api.get('/api/pets', headers=foundation)
+    assert first.status_code == 200 and first.headers['Cache-Control'] == 'private, no-cache'
+
+    again = revalidate(api, '/api/pets', foundation, first.headers['ETag'])
+    assert again.status_code == 304 and again.headers['ETag'] == first.headers['ETag']
+    # Weak and listed ETags match too
+    assert revalidate(api, '/api/pets', foundation, f'"x", W/{first.headers["ETag"]}').status_code == 304
+
+    # Another query string is another cached variant
+    assert revalidate(api, '/api/pets?view=card', foundation, first.headers['ETag']).status_code == 200
+
+    cached = api.get('/api/pets', headers=foundation)
+    assert cached.content == first.content
+    assert server.response_cache.hits == 1
+
+
+def test_pet_update_invalidates_pet_and_match_lists(api):
+    foundation = register(api, 'foundation')
+    adopter = register(api, 'adopter', personality_traits=TRAITS)
+    pet = create_pet(api, foundation)
+    api.post('/api/matches/like', json={'pet_id': pet['id'], 'action': 'like'}, headers=adopter)
+
+    etags = {
+        (path, who): api.get(path, headers=headers).headers['ETag']
+        for path in ('/api/pets', '/api/matches')
+        for who, headers in (('foundation', foundation), ('adopter', adopter))
+        if (path, who) != ('/api/pets', 'adopter')
+    }
+    api.put(f"/api/pets/{pet['id']}", json={'name': 'Nube'}, headers=foundation)
+
+    for (path, who), etag in etags.items():
+        response = revalidate(api, path, foundation if who == 'foundation' else adopter, etag)
+        assert response.status_code == 200, (path, who)
+    assert api.get('/api/matches', headers=adopter).json()[0]['pet']['name'] == 'Nube'
+
+
+def test_swipe_invalidates_both_sides_match_lists(api):
+    foundation = register(api, 'foundation')
+    adopter = register(api, 'adopter', personality_traits=TRAITS)
+    pet = create_pet(api, foundation)
+    foundation_etag = api.get('/api/matches', headers=foundation).headers['ETag']
+    adopter_etag = api.get('/api/matches', headers=adopter).headers['ETag']
+
+    # A pass is no match, so nobody's list changes
+    other = create_pet(api, foundation, name='Max')
+    api.post('/api/matches/like', json={'pet_id': other['id'], 'action': 'pass'}, headers=adopter)
+    assert revalidate(api, '/api/matches', adopter, adopter_etag).status_code == 304
+
+    api.post('/api/matches/like', json={'pet_id': pet['id'], 'action': 'like'}, headers=adopter)
+    assert revalidate(api, '/api/matches', foundation, foundation_etag).status_code == 200
+    response = revalidate(api, '/api/matches', adopter, adopter_etag)
+    assert response.status_code == 200 and [match['pet_id'] for match in response.json()] == [pet['id']]
+
+
+def test_accepting_a_match_invalidates_both_sides_match_lists(api):
+    foundation = register(api, 'foundation')
+    adopter = register(api, 'adopter', personality_traits=TRAITS)
+    pet = create_pet(api, foundation)
+    match = api.post('/api/matches/like', json={'pet_id': pet['id'], 'action': 'like'}, headers=adopter).json()
+    foundation_etag = api.get('/api/matches', headers=foundation).headers['ETag']
+    adopter_etag = api.get('/api/matches', headers=adopter).headers['ETag']
+
+    assert api.put(f"/api/matches/{match['id']}/accept", headers=foundation).status_code == 200
+
+    assert revalidate(api, '/api/matches', foundation, foundation_etag).status_code == 200
+    response = revalidate(api, '/api/matches', adopter, adopter_etag)
+    assert response.status_code == 200 and response.json()[0]['status'] == 'accepted'
+
+
+def test_bump_from_another_worker_invalidates_the_local_versions(api):
+    foundation = register(api, 'foundation')
+    pet = create_pet(api, foundation)
+    etag = api.get('/api/pets', headers=foundation).headers['ETag']
+
+    # This worker ignores its own events, and events for other scopes change nothing
+    server.worker_events._receive({
+        'origin': server.worker_events.origin, 'kind': 'response_cache', 'scopes': [['pets', pet['foundation_id']]]
+    })
+    server.worker_events._receive({'origin': 'other', 'kind': 'response_cache', 'scopes': [['pets', 'someone']]})
+    assert revalidate(api, '/api/pets', foundation, etag).status_code == 304
+
+    server.worker_events._receive({'origin': 'other', 'kind': 'response_cache', 'scopes': [['pets', pet['foundation_id']]]})
+    assert revalidate(api, '/api/pets', foundation, etag).status_code == 200
@@ -0,0 +1,241 @@
+from datetime import datetime, timezone
+
+import server
+
+from .conftest import TRAITS, create_pet, register
+
+
+def keys_in(value) -> set:
+    """Every object key anywhere in a JSON value"""
+    if isinstance(value, dict):
+        return set(value).union(*(keys_in(item) for item in value.values()))
+    if isinstance(value, list):
+        return set().union(*(keys_in(item) for item in value))
+    return set()
+
+
+def test_no_route_returns_the_pet_ordinal(api):
+    foundation = register(api, 'foundation')
+    adopter = register(api, 'adopter', personality_traits=TRAITS)
+    newcomer = register(api, 'adopter')
+    pet = create_pet(api, foundation)
+    create_pet(api, foundation, name='Max')
+    match = api.post('/api/matches/like', json={'pet_id': pet['id'], 'action': 'like'}, headers=adopter).json()
+    api.post('/api/appointments', json={'match_id': match['id'], 'date': '2025-01-01', 'time': '10:00'}, headers=adopter)
+
+    responses = [
+        api.put(f"/api/pets/{pet['id']}", json={'age': 3}, headers=foundation),
+        api.get(f"/api/pets/{pet['id']}", headers=adopter),
+        api.post('/api/matches/swipes', json={'swipes': [{'pet_id': pet['id'], 'action': 'pass'}]}, headers=adopter),
+    ]
+    for view in ('full', 'card'):
+        params = {'view': view}
+        responses += [
+            api.get('/api/pets', params=params, headers=foundation),
+            api.get('/api/pets/available/list', params=params, headers=adopter),
+            api.get('/api/pets/available/list', params=params, headers=newcomer),
+            api.get('/api/pets/available/top', params=params, headers=adopter),
+            api.get('/api/pets/available/recommended', params=params, headers=adopter),
+            api.get('/api/matches', params=params, headers=foundation),
+            api.get('/api/matches', params=params, headers=adopter),
+            api.get('/api/appointments', params=params, headers=foundation),
+            api.get('/api/appointments', params=params, headers=adopter),
+        ]
+
+    for response in responses:
+        assert response.status_code == 200, (response.url, response.text)
+        assert 'ordinal' not in keys_in(response.json()), response.url
+    # The appointment and match lists did embed the pet
+    assert responses[-1].json()[0]['pet']['id'] == pet['id']
+
+
+def test_component_metrics_require_the_admin_token(api, monkeypatch):
+    assert api.get('/api/metrics').status_code == 403
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', 'secreto')
+    assert api.get('/api/metrics', headers={'X-Admin-Token': 'otro'}).status_code == 403
+
+    response = api.get('/api/metrics', headers={'X-Admin-Token': 'secreto'})
+    assert response.status_code == 200 and 'password_pool' in response.json()
+
+
+def test_prometheus_metrics_require_the_scrape_token(api, monkeypatch):
+    assert api.get('/metrics').status_code == 403
+    monkeypatch.setattr(server, 'METRICS_TOKEN', 'raspado')
+    assert api.get('/metrics').status_code == 403
+    assert api.get('/metrics', headers={'Authorization': 'Bearer otro'}).status_code == 403
+    # The admin token is for people, not scrapers
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', 'secreto')
+    assert api.get('/metrics', headers={'X-Admin-Token': 'secreto'}).status_code == 403
+
+    response = api.get('/metrics', headers={'Authorization': 'Bearer raspado'})
+    assert response.status_code == 200 and 'password_pool' in response.text
+
+
+def test_ranked_feed_pages_cover_every_unseen_pet_once(api):
+    foundation = register(api, 'foundation')
+    adopter = register(api, 'adopter', personality_traits=TRAITS)
+    pets = [create_pet(api, foundation, name=f'Mascota {n}', personality_traits={**TRAITS, 'calm': n + 1})
+            for n in range(5)]
+    api.post('/api/matches/like', json={'pet_id': pets[0]['id'], 'action': 'pass'}, headers=adopter)
+
+    for params in ({}, {'view': 'card'}, {'fields': 'name'}):
+        seen, cursor = [], None
+        while True:
+            response = api.get('/api/pets/available/list', headers=adopter,
+                               params={**params, 'limit': 2, **({'cursor': cursor} if cursor else {})})
+            assert response.status_code == 200
+            seen += response.json()
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor is None:
+                break
+        # Ranked by how far each pet's calm is from the adopter's 5; the passed pet is left out
+        assert [pet['name'] for pet in seen] == [f'Mascota {n}' for n in (4, 3, 2, 1)], params
+        if 'fields' in params:
+            assert all(set(pet) == {'id', 'name'} for pet in seen)
+        else:
+            assert [pet['match_score'] for pet in seen] == sorted((pet['match_score'] for pet in seen), reverse=True)
+
+
+def chat_match(api) -> tuple:
+    """A match between a new adopter and foundation, with both sides' headers"""
+    foundation = register(api, 'foundation')
+    adopter = register(api, 'adopter', personality_traits=TRAITS)
+    pet = create_pet(api, foundation)
+    match = api.post('/api/matches/like', json={'pet_id': pet['id'], 'action': 'like'}, headers=adopter).json()
+    return match['id'], adopter, foundation
+
+
+def insert_messages(api, match_id: str, *stamps: tuple):
+    """Store messages with chosen (timestamp, id) keys, as sends within one millisecond leave them"""
+    api.portal.call(server.db.messages.insert_many, [
+        {'id': message_id, 'match_id': match_id, 'sender_id': 'x', 'sender_type': 'user',
+         'message': message_id, 'timestamp': timestamp}
+        for timestamp, message_id in stamps
+    ])
+
+
+def message_ids(response) -> list:
+    assert response.status_code == 200, response.text
+    return [msg['id'] for msg in response.json()['messages']]
+
+
+def test_chat_since_resumes_after_a_message_id_or_a_timestamp(api):
+    match_id, adopter, _ = chat_match(api)
+    first, second = datetime(2024, 1, 1, 12, tzinfo=timezone.utc), datetime(2024, 1, 1, 12, 0, 1, tzinfo=timezone.utc)
+    insert_messages(api, match_id, (first, 'a'), (second, 'b'), (second, 'c'))
+    path = f'/api/chat/{match_id}'
+
+    assert message_ids(api.get(path, params={'since': 'b'}, headers=adopter)) == ['c']
+    assert message_ids(api.get(path, params={'since': 'c'}, headers=adopter)) == []
+    # A timestamp keeps every message sent at that instant, however their ids sort
+    assert message_ids(api.get(path, params={'since': second.isoformat()}, headers=adopter)) == ['b', 'c']
+    assert message_ids(api.get(path, params={'since': first.isoformat()}, headers=adopter)) == ['a', 'b', 'c']
+
+    assert api.get(path, params={'since': '2024-01-01T12:00:00'}, headers=adopter).status_code == 400
+    assert api.get(path, params={'since': 'missing'}, headers=adopter).status_code == 404
+    assert api.get(path, params={'since': 'b', 'after': 'b'}, headers=adopter).status_code == 400
+
+
+def test_chat_before_and_after_cursors_page_through_the_messages(api):
+    match_id, adopter, foundation = chat_match(api)
+    path = f'/api/chat/{match_id}'
+    for n in range(5):
+        api.post(f'{path}/messages', json={'message': f'hola {n}'}, headers=adopter if n % 2 else foundation)
+
+    latest = api.get(path, params={'limit': 2}, headers=adopter).json()
+    assert [msg['message'] for msg in latest['messages']] == ['hola 3', 'hola 4']
+    older = api.get(path, params={'limit': 2, 'before': latest['before_cursor']}, headers=adopter).json()
+    assert [msg['message'] for msg in older['messages']] == ['hola 1', 'hola 2']
+
+    api.post(f'{path}/messages', json={'message': 'hola 5'}, headers=foundation)
+    newer = api.get(path, params={'after': latest['after_cursor']}, headers=adopter).json()
+    assert [(msg['message'], msg['sender_type']) for msg in newer['messages']] == [('hola 5', 'foundation')]
+    # Nothing new keeps the cursor where it was
+    idle = api.get(path, params={'after': newer['after_cursor']}, headers=adopter).json()
+    assert idle['messages'] == [] and idle['after_cursor'] == newer['after_cursor']
+    assert api.get(path, params={'before': 'not a cursor'}, headers=adopter).status_code == 400
+
+
+def test_unchanged_chat_is_answered_with_304(api):
+    match_id, adopter, foundation = chat_match(api)
+    path = f'/api/chat/{match_id}'
+    api.post(f'{path}/messages', json={'message': 'hola'}, headers=adopter)
+
+    etag = api.get(path, headers=adopter).headers['ETag']
+    again = api.get(path, headers={**adopter, 'If-None-Match': etag})
+    assert again.status_code == 304 and again.headers['ETag'] == etag
+    # The ETag covers the page asked for, not just the chat
+    assert api.get(path, params={'limit': 1}, headers={**adopter, 'If-None-Match': etag}).status_code == 200
+
+    api.post(f'{path}/messages', json={'message': '¿cómo estás?'}, headers=foundation)
+    changed = api.get(path, headers={**adopter, 'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert [msg['message'] for msg in changed.json()['messages']] == ['hola', '¿cómo estás?']
+
+
+def test_chat_pages_neither_overlap_nor_skip_messages(api):
+    match_id, adopter, _ = chat_match(api)
+    moment = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+    # Three messages per instant, so pages split runs of equal timestamps
+    expected = [f'{second:02d}-{n}' for second in range(4) for n in range(3)]
+    insert_messages(api, match_id, *((moment.replace(second=int(key[:2])), key) for key in expected))
+    path = f'/api/chat/{match_id}'
+
+    pages, params = [], {'limit': 5}
+    while True:
+        page = api.get(path, params=params, headers=adopter).json()
+        pages.insert(0, [msg['id'] for msg in page['messages']])
+        if page['before_cursor'] is None:
+            break
+        params = {'limit': 5, 'before': page['before_cursor']}
+    assert [len(page) for page in pages] == [2, 5, 5]
+    assert [key for page in pages for key in page] == expected
+
+    # Polling forward from the oldest message walks the same keyset the other way
+    polled, params = [expected[0]], {'limit': 5, 'since': expected[0]}
+    while True:
+        page = api.get(path, params=params, headers=adopter).json()
+        if not page['messages']:
+            break
+        polled += [msg['id'] for msg in page['messages']]
+        params = {'limit': 5, 'after': page['after_cursor']}
+    assert polled == expected
+
+
+def test_match_routes_reject_a_foreign_foundation(api):
+    match_id, adopter, _ = chat_match(api)
+    stranger = register(api, 'foundation')
+    outsider = register(api, 'adopter')
+
+    for headers in (stranger, outsider):
+        assert api.get(f'/api/chat/{match_id}', headers=headers).status_code == 403
+        assert api.post(f'/api/chat/{match_id}/messages', json={'message': 'hola'}, headers=headers).status_code == 403
+        appointment = {'match_id': match_id, 'date': '2025-01-01', 'time': '10:00'}
+        assert api.post('/api/appointments', json=appointment, headers=headers).status_code == 403
+    assert api.put(f'/api/matches/{match_id}/accept', headers=stranger).status_code == 403
+    assert api.get('/api/chat/missing', headers=adopter).status_code == 404
+
+
+def test_match_access_is_revoked_as_soon_as_the_pet_is_deleted(api):
+    match_id, adopter, foundation = chat_match(api)
+    pet_id = api.get('/api/matches', headers=adopter).json()[0]['pet_id']
+    # Warm the cached access before the pet goes away
+    assert api.get(f'/api/chat/{match_id}', headers=foundation).status_code == 200
+
+    assert api.delete(f'/api/pets/{pet_id}', headers=foundation).status_code == 200
+    assert api.get(f'/api/chat/{match_id}', headers=foundation).status_code == 403
+    assert api.post(f'/api/chat/{match_id}/messages', json={'message': 'hola'}, headers=foundation).status_code == 403
+
+
+def test_match_access_follows_an_owner_change_from_another_worker(api):
+    match_id, adopter, foundation = chat_match(api)
+    new_owner = register(api, 'foundation')
+    pet_id = api.get('/api/matches', headers=adopter).json()[0]['pet_id']
+    new_owner_id = api.get('/api/users/profile', headers=new_owner).json()['id']
+    assert api.get(f'/api/chat/{match_id}', headers=foundation).status_code == 200
+
+    api.portal.call(server.db.pets.update_one, {'id': pet_id}, {'$set': {'foundation_id': new_owner_id}})
+    server.worker_events._receive({'origin': 'other', 'kind': 'match_access', 'match_ids': [match_id]})
+
+    assert api.get(f'/api/chat/{match_id}', headers=foundation).status_code == 403
+    assert api.get(f'/api/chat/{match_id}', headers=new_owner).status_code == 200
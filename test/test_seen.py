@@ -0,0 +1,94 @@
+import asyncio
+
+import numpy as np
+from mongomock_motor import AsyncMongoMockClient
+
+from seen import SeenBitmap, SeenStore, WORD_BITS, word_updates
+
+from .conftest import MongomockSeenCollection
+
+
+def test_add_and_contains():
+    bitmap = SeenBitmap()
+    for ordinal in (0, 7, 8, 1000):
+        bitmap.add(ordinal)
+
+    assert all(ordinal in bitmap for ordinal in (0, 7, 8, 1000))
+    assert not any(ordinal in bitmap for ordinal in (1, 9, 999, 1001, 10 ** 6))
+    assert None not in bitmap
+
+
+def test_persisted_words_load_back_into_the_same_bits():
+    ordinals = [0, 5, 31, 32, 63, 64, 200]
+    words = {}
+    for path, operation in word_updates(ordinals).items():
+        words[path.split('.', 1)[1]] = int(operation['or'])
+
+    bitmap = SeenBitmap()
+    for index, value in words.items():
+        bitmap.set_word(int(index), value)
+
+    assert [ordinal for ordinal in range(WORD_BITS * 8) if ordinal in bitmap] == ordinals
+
+
+def test_set_word_ors_into_existing_bits():
+    bitmap = SeenBitmap()
+    bitmap.add(1)
+    bitmap.set_word(0, 1 << 2)
+    assert 1 in bitmap and 2 in bitmap
+
+
+def test_mask_matches_membership():
+    bitmap = SeenBitmap()
+    for ordinal in (3, 17, 40):
+        bitmap.add(ordinal)
+    ordinals = np.array([0, 3, 17, 18, 40, 41, 5000])
+
+    assert bitmap.mask(ordinals).tolist() == [ordinal in bitmap for ordinal in ordinals.tolist()]
+
+
+def test_mask_never_marks_missing_ordinals_as_seen():
+    bitmap = SeenBitmap()
+    bitmap.add(7)  # The highest bit, which a -1 index would read
+
+    assert bitmap.mask(np.array([-1, 7])).tolist() == [False, True]
+
+
+def test_load_many_reads_persisted_bitmaps_without_caching():
+    collection = AsyncMongoMockClient()['seen'].seen_pets
+    store = SeenStore(collection, maxsize=10, ttl=60)
+
+    async def run():
+        await collection.insert_many([
+            {'user_id': 'a', 'words': {'0': 1 << 3, '1': 1 << (40 - WORD_BITS)}},
+            {'user_id': 'b', 'words': {}},
+        ])
+        return await store.load_many(['a', 'b', 'c'])
+
+    bitmaps = asyncio.run(run())
+    assert sorted(bitmaps) == ['a', 'b']
+    assert [ordinal for ordinal in range(64) if ordinal in bitmaps['a']] == [3, 40]
+    assert len(store.cache) == 0
+
+
+def test_swipe_recorded_while_the_bitmap_is_rebuilt_is_kept():
+    collection = MongomockSeenCollection(AsyncMongoMockClient()['seen'].seen_pets)
+    store = SeenStore(collection, maxsize=10, ttl=60)
+    swipes = [3]
+
+    async def history():
+        ordinals = list(swipes)
+        if swipes == [3]:
+            # Another request commits a swipe after this read, before the upsert
+            swipes.append(40)
+            await store.add('a', [40])
+        return ordinals
+
+    async def run():
+        cached = await store.get('a', history)
+        store.cache.invalidate('a')
+        return cached, await store.get('a', history)
+
+    cached, persisted = asyncio.run(run())
+    for bitmap in (cached, persisted):
+        assert [ordinal for ordinal in range(64) if ordinal in bitmap] == [3, 40]
@@ -0,0 +1,93 @@
+import mongomock
+from pymongo.errors import BulkWriteError
+
+import server
+
+from .conftest import TRAITS, create_pet, register
+
+
+def like(pet_id: str) -> dict:
+    return {'pet_id': pet_id, 'action': 'like'}
+
+
+def browsing_adopter(api) -> dict:
+    """An adopter whose seen bitmap is cached, as browsing the feed leaves it before swiping"""
+    headers = register(api, 'adopter', personality_traits=TRAITS)
+    api.get('/api/pets/available/list', headers=headers)
+    return headers
+
+
+def seen_ordinals(api, headers: dict) -> set:
+    """Ordinals set in the adopter's seen bitmap; the cached copy must agree with the persisted one"""
+    user_id = api.get('/api/users/profile', headers=headers).json()['id']
+    pets = server.db.pets.find({}, {'_id': 0, 'ordinal': 1})
+    ordinals = {pet['ordinal'] for pet in api.portal.call(pets.to_list, None)}
+    cached = server.seen_store.cache.get(user_id)
+    server.seen_store.cache.invalidate(user_id)
+    persisted = api.portal.call(server.get_seen_pets, user_id)
+    assert {o for o in ordinals if o in cached} == {o for o in ordinals if o in persisted}
+    return {o for o in ordinals if o in persisted}
+
+
+def ordinal_of(api, pet_id: str) -> int:
+    return api.portal.call(server.db.pets.find_one, {'id': pet_id})['ordinal']
+
+
+def test_repeated_like_is_rejected_without_a_second_match(api):
+    foundation = register(api, 'foundation')
+    adopter = browsing_adopter(api)
+    pet = create_pet(api, foundation)
+
+    first = api.post('/api/matches/like', json=like(pet['id']), headers=adopter)
+    assert first.status_code == 200 and first.json()['is_match']
+    again = api.post('/api/matches/like', json={'pet_id': pet['id'], 'action': 'pass'}, headers=adopter)
+    assert again.status_code == 400
+
+    matches = api.portal.call(server.db.matches.find({'pet_id': pet['id']}, {'_id': 0}).to_list, None)
+    assert [match['id'] for match in matches] == [first.json()['id']]
+    assert seen_ordinals(api, adopter) == {ordinal_of(api, pet['id'])}
+
+
+def test_mixed_batch_reports_only_new_swipes(api):
+    foundation = register(api, 'foundation')
+    adopter = browsing_adopter(api)
+    old, new, passed = (create_pet(api, foundation, name=name) for name in ('Luna', 'Max', 'Toby'))
+    api.post('/api/matches/like', json=like(old['id']), headers=adopter)
+
+    response = api.post('/api/matches/swipes', json={'swipes': [
+        like(old['id']),
+        like(new['id']),
+        {'pet_id': passed['id'], 'action': 'pass'},
+        like(new['id']),
+        like('missing'),
+    ]}, headers=adopter)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [(match['pet_id'], match['is_match']) for match in body['recorded']] == [(new['id'], True), (passed['id'], False)]
+    assert sorted(body['duplicates']) == sorted([new['id'], old['id']])
+    assert body['not_found'] == ['missing']
+    assert seen_ordinals(api, adopter) == {ordinal_of(api, pet['id']) for pet in (old, new, passed)}
+    assert len(api.get('/api/matches', headers=adopter).json()) == 2
+
+
+def test_batch_losing_a_race_reports_the_swipe_as_duplicate(api, monkeypatch):
+    foundation = register(api, 'foundation')
+    adopter = browsing_adopter(api)
+    raced, won = create_pet(api, foundation, name='Luna'), create_pet(api, foundation, name='Max')
+    bulk_write = mongomock.collection.Collection.bulk_write
+
+    def racing_bulk_write(self, requests, ordered=True, **kwargs):
+        """Another request inserts the first swipe between our read and our upsert"""
+        result = bulk_write(self, requests[1:], ordered=ordered, **kwargs)
+        raise BulkWriteError({
+            'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'E11000 duplicate key error'}],
+            'upserted': [{'index': index + 1, '_id': _id} for index, _id in result.upserted_ids.items()],
+        })
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'bulk_write', racing_bulk_write)
+    body = api.post('/api/matches/swipes', json={'swipes': [like(raced['id']), like(won['id'])]}, headers=adopter).json()
+
+    assert [match['pet_id'] for match in body['recorded']] == [won['id']]
+    assert body['duplicates'] == [raced['id']]
+    assert seen_ordinals(api, adopter) == {ordinal_of(api, won['id'])}